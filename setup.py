@@ -18,7 +18,7 @@ setup(
     license = "GPL",
     keywords = "nlp computational_linguistics",
     url = "https://github.com/proycon/spreek2schrijf",
-    packages=['spreek2schrijf', 'spreek2schrijf.webservice'],
+    packages=['spreek2schrijf', 'spreek2schrijf.webservice', 'spreek2schrijf.benchmark'],
     long_description=read('README.rst'),
     classifiers=[
         "Development Status :: 4 - Beta",
@@ -31,10 +31,21 @@ setup(
     zip_safe=False,
     include_package_data=True,
     package_data = {'spreek2schrijf':['webservice/*.sh','webservice/*.txt','webservice/*.wsgi','webservice/*.perl'] },
-    install_requires=[  'python-ucto >= 0.2.2','python-Levenshtein','numpy','lxml', 'beautifulsoup4', 'clam >= 3.0'],
+    install_requires=[  'python-ucto >= 0.2.2','python-Levenshtein','numpy','lxml', 'clam >= 3.0'],
     entry_points = {    'console_scripts': [
         's2s-aligner = spreek2schrijf.aligner:main',
         's2s-buildparcorpus = spreek2schrijf.buildparcorpus:main',
-        's2s-extracttext = spreek2schrijf.extracttext:main'
+        's2s-extracttext = spreek2schrijf.extracttext:main',
+        's2s-decoderpool = spreek2schrijf.webservice.decoderpool:main',
+        's2s-translationcache = spreek2schrijf.webservice.translationcache:main',
+        's2s-pipeline = spreek2schrijf.webservice.pipeline:main',
+        's2s-parseflemishhtml = spreek2schrijf.webservice.parseflemishhtml:main',
+        's2s-writeflemishhtml = spreek2schrijf.webservice.writeflemishhtml:main',
+        's2s-translate = spreek2schrijf.webservice.batcher:main',
+        's2s-asrcache = spreek2schrijf.webservice.asrcache:main',
+        's2s-chunkasr = spreek2schrijf.webservice.chunker:main',
+        's2s-evaluate = spreek2schrijf.evaluate:main',
+        's2s-benchmark = spreek2schrijf.benchmark.benchmark:main',
+        's2s-synthetic = spreek2schrijf.benchmark.synthetic:main'
     ] }
 )
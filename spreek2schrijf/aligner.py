@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 
 import sys
+import os
 import argparse
 import json
+import time
+import bisect
+import itertools
+import multiprocessing
+from array import array
 import numpy as np
 import Levenshtein
-from spreek2schrijf.formats import AudioDoc, CXMLDoc
+from spreek2schrijf.formats import AudioDoc, CXMLDoc, CompactAudioDoc, CompactTranscriptDoc
+from spreek2schrijf.vocabulary import Vocabulary, NeighbourIndex
 
-MARGIN = 1000
+MARGIN = 1000 #maximum number of ASR words searched for a single sentence (AnchorAligner)
 
 
 def wordmatch(s1,s2, threshold=2):
@@ -23,33 +30,161 @@ def wordmatch(s1,s2, threshold=2):
         return Levenshtein.distance(s1,s2) <= threshold
 
 
+def wordmatch_matrix(seq1, seq2, threshold=2, neighbours=None):
+    """Computes wordmatch() for all word pairs in one batch, returns a boolean matrix of shape (len(seq2), len(seq1)).
+    If a NeighbourIndex (with the same threshold) is passed, matches are looked up in it rather than computed."""
+    if neighbours is not None:
+        if neighbours.threshold != threshold:
+            raise ValueError("Neighbour index was built for a different threshold (" + str(neighbours.threshold) + ")")
+        ids1 = neighbours.vocabulary.encode(seq1)
+        ids2 = neighbours.vocabulary.encode(seq2)
+        neighbours.update()
+        matches = ids2[:,None] == ids1[None,:]
+        columns = ids1.tolist()
+        for i, id in enumerate(ids2.tolist()):
+            if neighbours.neighbours[id]:
+                matches[i] |= [ other in neighbours.neighbours[id] for other in columns ]
+        return matches
+    #intern the lowercased words so exact matches become a single integer comparison
+    vocab = {}
+    ids1 = np.array([ vocab.setdefault(w.lower(), len(vocab)) for w in seq1 ], dtype=int)
+    ids2 = np.array([ vocab.setdefault(w.lower(), len(vocab)) for w in seq2 ], dtype=int)
+    words = list(vocab)
+    lengths = np.array([ len(w) for w in words ], dtype=int)
+    matches = ids2[:,None] == ids1[None,:]
+    l1 = lengths[ids1][None,:]
+    l2 = lengths[ids2][:,None]
+    #the same short-word and length-difference rules as wordmatch(), only the survivors need a Levenshtein call
+    candidates = ~matches & (np.minimum(l1,l2) > threshold+2) & (np.abs(l1 - l2) <= threshold)
+    distances = {}
+    for i, j in zip(*np.nonzero(candidates)):
+        pair = (ids2[i], ids1[j])
+        if pair not in distances:
+            distances[pair] = Levenshtein.distance(words[pair[0]], words[pair[1]])
+        matches[i,j] = distances[pair] <= threshold
+    return matches
+
+
+def smith_waterman_matrix(matches, match=3, mismatch=-1, insertion=-0.5, deletion=-0.5):
+    """Fills the Smith Waterman matrix from a boolean match matrix (as produced by wordmatch_matrix()), one row at a time"""
+    rows, cols = matches.shape
+    mat = np.zeros((rows + 1, cols + 1))
+    substitution = np.where(matches, match, mismatch).astype(float)
+    #the insertion chain within a row has a closed form: mat[i,j] = max_k(t[k] + (j-k) * insertion),
+    #where t holds the best of the zero, diagonal and deletion cases
+    steps = np.arange(cols + 1) * insertion
+    t = np.zeros(cols + 1)
+    for i in range(1, rows + 1):
+        prev = mat[i - 1]
+        np.maximum(prev[:-1] + substitution[i - 1], prev[1:] + deletion, out=t[1:])
+        np.maximum(t, 0, out=t)
+        t -= steps
+        np.maximum.accumulate(t, out=mat[i])
+        mat[i] += steps
+    return mat
+
+
+def _smith_waterman_fill(seq1, seq2, match, mismatch, insertion, deletion, ldthreshold, engine, neighbours):
+    """Fills the Smith Waterman matrix with seq2 along the rows and seq1 along the columns"""
+    if engine == "numpy":
+        return smith_waterman_matrix(wordmatch_matrix(seq1, seq2, ldthreshold, neighbours), match, mismatch, insertion, deletion)
+    elif engine == "python":
+        # create the distance matrix
+        mat = np.zeros((len(seq2) + 1, len(seq1) + 1))
+        # iterate over the matrix column wise
+        for i in range(1, mat.shape[0]):
+            # iterate over the matrix row wise
+            for j in range(1, mat.shape[1]):
+                # set the current matrix element with the maximum of 4 different cases
+                mat[i, j] = max(
+                    # negative values are not allowed
+                    0,
+                    # if previous word matches increase the score by match, else decrease it by mismatch
+                    mat[i - 1, j - 1] + (match if wordmatch(seq1[j - 1],seq2[i - 1], ldthreshold) else mismatch), #MAYBE TODO: match function can be made less strict
+                    # one word is missing in seq2, so decrease the score by deletion
+                    mat[i - 1, j] + deletion,
+                    # one additional word is in seq2, so decrease the score by insertion
+                    mat[i, j - 1] + insertion
+                )
+        return mat
+    else:
+        raise ValueError("Unknown Smith-Waterman engine: " + str(engine))
+
+
 #adapted from http://climberg.de/page/smith-waterman-distance-for-feature-extraction-in-nlp/ (by Christian Limbergs)
-def smith_waterman_distance(seq1, seq2, match=3, mismatch=-1, insertion=-0.5, deletion=-0.5, normalize_score=True, ldthreshold=2):
-    """Smith Waterman algorithm"""
+def smith_waterman_distance(seq1, seq2, match=3, mismatch=-1, insertion=-0.5, deletion=-0.5, normalize_score=True, ldthreshold=2, engine="numpy", neighbours=None):
+    """Smith Waterman algorithm. The engine is either 'numpy' (vectorised) or 'python' (cell by cell), both yield the same score
+    and matrix (exactly so as long as the scores are multiples of a power of two, like the defaults). The numpy engine can look up
+    word matches in a precomputed NeighbourIndex (see spreek2schrijf.vocabulary)."""
     # switch sequences, so that seq1 is the longer sequence to search for seq2
     if len(seq2) > len(seq1): seq1, seq2 = seq2, seq1
-    # create the distance matrix
-    mat = np.zeros((len(seq2) + 1, len(seq1) + 1))
-    # iterate over the matrix column wise
-    for i in range(1, mat.shape[0]):
-        # iterate over the matrix row wise
-        for j in range(1, mat.shape[1]):
-            # set the current matrix element with the maximum of 4 different cases
-            mat[i, j] = max(
-                # negative values are not allowed
-                0,
-                # if previous word matches increase the score by match, else decrease it by mismatch
-                mat[i - 1, j - 1] + (match if wordmatch(seq1[j - 1],seq2[i - 1], ldthreshold) else mismatch), #MAYBE TODO: match function can be made less strict
-                # one word is missing in seq2, so decrease the score by deletion
-                mat[i - 1, j] + deletion,
-                # one additional word is in seq2, so decrease the score by insertion
-                mat[i, j - 1] + insertion
-            )
+    mat = _smith_waterman_fill(seq1, seq2, match, mismatch, insertion, deletion, ldthreshold, engine, neighbours)
     # the maximum of mat is now the score, which is returned raw or normalized (with a range of 0-1)
     score = np.max(mat) / (len(seq2) * match) if normalize_score else np.max(mat)
     score *= len(seq2) / len(seq1)
     return score, mat
 
+def smith_waterman_prefix_distances(seq1, seq2, ends=None, match=3, mismatch=-1, insertion=-0.5, deletion=-0.5, normalize_score=True, ldthreshold=2, engine="numpy", neighbours=None):
+    """Scores seq1 against the prefixes seq2[:end] for all given end positions (defaults to all non-empty prefixes).
+    Returns a list with, for each end, the same score smith_waterman_distance(seq1, seq2[:end]) would return,
+    but the matrix is computed only once, for the longest prefix."""
+    if ends is None:
+        ends = range(1, len(seq2)+1)
+    ends = [ min(end, len(seq2)) for end in ends ]
+    if not ends:
+        return []
+    seq2 = seq2[:max(ends)]
+    #A prefix of seq2 that is at most as long as seq1 ends up in the rows (see smith_waterman_distance),
+    #a longer one in the columns. A DP matrix for a prefix is a submatrix of the DP matrix of the whole sequence,
+    #so the best score per prefix is a running maximum over the rows or columns
+    rowbest = colbest = None
+    if min(ends) <= len(seq1):
+        mat = _smith_waterman_fill(seq1, seq2, match, mismatch, insertion, deletion, ldthreshold, engine, neighbours)
+        rowbest = np.maximum.accumulate(mat.max(axis=1))
+        if insertion == deletion:
+            #the recurrence is symmetric, no need for a second matrix
+            colbest = rowbest
+    if max(ends) > len(seq1) and colbest is None:
+        mat = _smith_waterman_fill(seq2, seq1, match, mismatch, insertion, deletion, ldthreshold, engine, neighbours)
+        colbest = np.maximum.accumulate(mat.max(axis=0))
+    scores = []
+    for end in ends:
+        if end > len(seq1):
+            shorter, longer, best = len(seq1), end, colbest[end]
+        else:
+            shorter, longer, best = end, len(seq1), rowbest[end]
+        score = best / (shorter * match) if normalize_score else best
+        score *= shorter / longer
+        scores.append(score)
+    return scores
+
+def smith_waterman_span(seq1, seq2, match=3, mismatch=-1, insertion=-0.5, deletion=-0.5, ldthreshold=2, engine="numpy", neighbours=None):
+    """Finds the subsequence of seq1 that seq2 aligns to best (local alignment with backtracking).
+    Returns (begin, end, score): the indices in seq1 and the raw alignment score, or None if nothing aligns"""
+    if engine == "numpy":
+        matches = wordmatch_matrix(seq1, seq2, ldthreshold, neighbours)
+        mat = smith_waterman_matrix(matches, match, mismatch, insertion, deletion)
+    else:
+        mat = _smith_waterman_fill(seq1, seq2, match, mismatch, insertion, deletion, ldthreshold, engine, neighbours)
+        matches = None
+    i, j = np.unravel_index(np.argmax(mat), mat.shape)
+    best = float(mat[i, j])
+    if best <= 0:
+        return None
+    end = j
+    while i > 0 and j > 0 and mat[i, j] > 0:
+        if matches is not None:
+            substitution = match if matches[i - 1, j - 1] else mismatch
+        else:
+            substitution = match if wordmatch(seq1[j - 1], seq2[i - 1], ldthreshold) else mismatch
+        if np.isclose(mat[i, j], mat[i - 1, j - 1] + substitution):
+            i, j = i - 1, j - 1
+        elif np.isclose(mat[i, j], mat[i - 1, j] + deletion):
+            i -= 1
+        else:
+            j -= 1
+    return int(j), int(end), best
+
 def find_sequence(seq1, seq2, match=3, mismatch=-1, insertion=-0.5, deletion=-0.5, normalize_score=True, ldthreshold=2):
     score, mat = smith_waterman(seq1,seq2,match,mismatch,insertion,deletion,normalize_score, ldthreshold)
 
@@ -71,58 +206,142 @@ def find_sequence(seq1, seq2, match=3, mismatch=-1, insertion=-0.5, deletion=-0.
 
 
 
+class TimeIndex:
+    """Index over the start times of the ASR words, finds the first word starting at or after a given time by binary search"""
+
+    def __init__(self, starttimes):
+        self.starttimes = array('q', starttimes)
+        #running maximum of the start times; this is sorted even if the ASR output is not strictly ordered
+        self.maxtimes = array('q', itertools.accumulate(self.starttimes, max))
+
+    def __len__(self):
+        return len(self.starttimes)
+
+    def find(self, time, begin=0):
+        """Returns the index of the first word, not before index begin, that starts at or after the given time (or None if there is none)"""
+        #no word before the bisection point can qualify, beyond it we only need to step over out-of-order words
+        j = max(bisect.bisect_left(self.maxtimes, time), begin)
+        while j < len(self.starttimes):
+            if self.starttimes[j] >= time:
+                return j
+            j += 1
+        return None
+
+
 class TimeAligner:
-    def __init__(self,debug=False):
+    def __init__(self,debug=False, engine="numpy", metrics=False, progress=None):
+        """If metrics is set, the aligner is instrumented (see metricsrecord()). Progress messages are printed at most every
+        progress seconds (None disables them, in debug mode they are printed for every sentence)"""
         self.loss = 0
         self.total = 0
         self.scores = []
         self.debug = debug
+        self.engine = engine
+        self.progress = progress
+        self.metrics = None
+        if metrics:
+            self.metrics = {
+                "asrwords": 0,
+                "sentences": 0,
+                "time": { "setup": 0.0, "startsearch": 0.0, "flexibility": 0.0, "scoring": 0.0, "wall": 0.0 }, #seconds
+                "cells": 0, #DP matrix cells computed
+                "transcriptlengths": {}, #histogram: sentence length (words) -> number of sentences
+                "candidatelengths": {}, #histogram: length of the longest ASR candidate scored -> number of sentences
+            }
 
+    def metricsrecord(self):
+        """Returns the statistics and (if enabled) the metrics of the aligner as a dictionary, for output as JSON. Note that
+        the wall time also includes the time the consumer of the aligner spends between sentences"""
+        record = {
+            "loss": self.loss / self.total if self.total else None,
+            "total": self.total,
+            "avscore": sum(self.scores) / len(self.scores) if self.scores else None,
+        }
+        if self.metrics is not None:
+            record.update(self.metrics)
+            record['transcriptlengths'] = { str(length): count for length, count in sorted(self.metrics['transcriptlengths'].items()) }
+            record['candidatelengths'] = { str(length): count for length, count in sorted(self.metrics['candidatelengths'].items()) }
+        return record
 
     def __call__(self,transcriptdoc, audiodoc, score_threshold, ldthreshold):
-        audiowords = list(audiodoc)
-        #print("Words in ASR output: ",len(audiowords),file=sys.stderr)
-        window = audiowords[:MARGIN]
+        metrics = self.metrics
+        if metrics is not None:
+            begintime = time.perf_counter()
+        lastprogress = 0.0
+        if not isinstance(audiodoc, CompactAudioDoc):
+            audiodoc = CompactAudioDoc.fromdoc(audiodoc)
+        timeindex = TimeIndex(audiodoc.starttimes.tolist())
+        #print("Words in ASR output: ",len(audiodoc),file=sys.stderr)
         cursor = 0
         buffer = None
         sentences = list(transcriptdoc)
+        #per-session vocabulary with all fuzzy word matches precomputed
+        vocabulary = Vocabulary(audiodoc.vocabulary)
+        for sentence, _, _ in sentences:
+            vocabulary.encode(sentence.split(' '))
+        neighbours = NeighbourIndex(vocabulary)
+        if metrics is not None:
+            metrics['asrwords'] += len(audiodoc)
+            metrics['sentences'] += len(sentences)
+            for sentence, _, _ in sentences:
+                length = sentence.count(' ') + 1
+                metrics['transcriptlengths'][length] = metrics['transcriptlengths'].get(length, 0) + 1
+            metrics['time']['setup'] += time.perf_counter() - begintime
         if self.debug:
-            print("           asr word count:", len(audiowords),file=sys.stderr)
+            print("           asr word count:", len(audiodoc),file=sys.stderr)
             print("transcript sentence count:", len(sentences), file=sys.stderr)
         begin = 0
         sentences.append((None,None,None)) #stop dummy
         for i, (sentence, transcriptstart, transcriptend) in enumerate(sentences):
             if sentence is None:
-                begin = len(audiowords)
+                begin = len(audiodoc)
             else:
-                print("PROCESSING #" + str(i+1) + "/" + str(len(sentences)) + ":",  sentence,file=sys.stderr)
+                if self.debug or (self.progress is not None and time.time() - lastprogress >= self.progress):
+                    print("PROCESSING #" + str(i+1) + "/" + str(len(sentences)) + ":",  sentence,file=sys.stderr)
+                    lastprogress = time.time()
                 #Find strict begin according to timestamp
-                for j, (audioword, audiostart, audioend) in enumerate(audiowords):
-                    if j >= begin:
-                        if audiostart >= transcriptstart:
-                            if self.debug:
-                                print("-------------------------------------------------------",file=sys.stderr)
-                                print("     TRANSCRIPT: ", sentence,file=sys.stderr)
-                                print(" ASR FIRST WORD: ", j, audioword,file=sys.stderr)
-                                print("    ASR EXCERPT: ", " ".join([ w for w,_,_ in audiowords[j:j+10]]), "...",file=sys.stderr)
-                                print("TRANSCRIPTSTART: ", transcriptstart,file=sys.stderr)
-                                print("     AUDIOSTART: ", audiostart,file=sys.stderr)
-                            begin = j
-                            break
+                if metrics is not None:
+                    t = time.perf_counter()
+                j = timeindex.find(transcriptstart, begin)
+                if metrics is not None:
+                    metrics['time']['startsearch'] += time.perf_counter() - t
+                if j is not None:
+                    if self.debug:
+                        audioword, audiostart, _ = audiodoc[j]
+                        print("-------------------------------------------------------",file=sys.stderr)
+                        print("     TRANSCRIPT: ", sentence,file=sys.stderr)
+                        print(" ASR FIRST WORD: ", j, audioword,file=sys.stderr)
+                        print("    ASR EXCERPT: ", " ".join(audiodoc.words(j, j+10)), "...",file=sys.stderr)
+                        print("TRANSCRIPTSTART: ", transcriptstart,file=sys.stderr)
+                        print("     AUDIOSTART: ", audiostart,file=sys.stderr)
+                    begin = j
             if buffer is not None:
                 transcriptsentence, audiobegin = buffer
+                if metrics is not None:
+                    flexibilitybegin = time.perf_counter()
                 #flexibility step, see if moving the end point earlier helps:
+                #all candidate end points are prefixes of the longest candidate, so they are scored from a single matrix
+                offsets = [ j for j in range(-5,5) if begin+j > audiobegin ]
                 scores = []
-                for j in range(-5,5):
-                    if begin+j > audiobegin:
-                        asrsentence = [ w for w,_,_ in audiowords[audiobegin:begin+j]]
-                        score, mat = smith_waterman_distance(transcriptsentence, asrsentence)
-                        scores.append( (j, float(score), asrsentence) )
+                if offsets:
+                    asrcandidate = audiodoc.words(audiobegin, begin+offsets[-1])
+                    if metrics is not None:
+                        t = time.perf_counter()
+                    prefixscores = smith_waterman_prefix_distances(transcriptsentence, asrcandidate, [ begin+j-audiobegin for j in offsets ], engine=self.engine, neighbours=neighbours if self.engine == "numpy" else None)
+                    if metrics is not None:
+                        metrics['time']['scoring'] += time.perf_counter() - t
+                        #with the default (symmetric) gap penalties a single matrix is filled, for the longest candidate
+                        metrics['cells'] += (len(transcriptsentence) + 1) * (len(asrcandidate) + 1)
+                        metrics['candidatelengths'][len(asrcandidate)] = metrics['candidatelengths'].get(len(asrcandidate), 0) + 1
+                    for j, score in zip(offsets, prefixscores):
+                        scores.append( (j, float(score), asrcandidate[:begin+j-audiobegin]) )
 
                 #no flexibility step
-                #asrsentence = [ w for w,_,_ in audiowords[audiobegin:begin]]
+                #asrsentence = audiodoc.words(audiobegin, begin)
                 #scores.append( (0, smith_waterman_distance(transcriptsentence, asrsentence)[0], asrsentence))
 
+                if metrics is not None:
+                    metrics['time']['flexibility'] += time.perf_counter() - flexibilitybegin
                 if scores:
                     offset, score, asrsentence = max(scores, key=lambda x:x[1])
                     begin += offset
@@ -142,29 +361,434 @@ class TimeAligner:
                         self.loss += 1
             if sentence is not None:
                 buffer = (sentence.split(' '), begin)
+        if metrics is not None:
+            metrics['time']['wall'] += time.perf_counter() - begintime
+
+
+class AnchorAligner(TimeAligner):
+    """Aligns using anchors rather than timestamps: n-grams that occur exactly once in both the transcript and the ASR output.
+    The longest monotonic chain of anchors cuts the session into independent windows, every sentence is then searched for
+    (local Smith-Waterman alignment) only in the part of its window where the anchors place it, capped at margin ASR words.
+    The cost thus grows with the window size rather than the session length, and clock offsets between the recordings do not
+    matter"""
+
+    def __init__(self, debug=False, engine="numpy", metrics=False, progress=None, ngram=3, margin=MARGIN, slack=10):
+        super().__init__(debug, engine, metrics, progress)
+        self.ngram = ngram
+        self.margin = margin
+        self.slack = slack #extra ASR words searched on either side of the estimated position
+        if self.metrics is not None:
+            self.metrics['anchors'] = 0
+            self.metrics['time']['anchoring'] = 0.0
+
+    def findanchors(self, transcriptids, asrids):
+        """Returns the anchors as a list of (transcript position, ASR position) pairs, increasing in both"""
+        n = self.ngram
+        def ngrams(ids):
+            positions = {}
+            for i in range(len(ids) - n + 1):
+                key = tuple(ids[i:i+n])
+                positions[key] = -1 if key in positions else i #-1 marks an n-gram that is not unique
+            return positions
+        asrpositions = ngrams(asrids)
+        candidates = []
+        for key, tpos in ngrams(transcriptids).items():
+            if tpos != -1 and asrpositions.get(key, -1) != -1:
+                candidates.append((tpos, asrpositions[key]))
+        candidates.sort()
+        #longest chain that is increasing in the ASR positions as well (patience sorting)
+        tails = [] #ASR position of the last anchor of the best chain of each length
+        tailindex = []
+        previous = [None] * len(candidates)
+        for k, (_, apos) in enumerate(candidates):
+            length = bisect.bisect_left(tails, apos)
+            if length == len(tails):
+                tails.append(apos)
+                tailindex.append(k)
+            else:
+                tails[length] = apos
+                tailindex[length] = k
+            previous[k] = tailindex[length-1] if length > 0 else None
+        chain = []
+        k = tailindex[-1] if tailindex else None
+        while k is not None:
+            chain.append(candidates[k])
+            k = previous[k]
+        chain.reverse()
+        return chain
+
+    def __call__(self, transcriptdoc, audiodoc, score_threshold, ldthreshold):
+        metrics = self.metrics
+        if metrics is not None:
+            begintime = time.perf_counter()
+        lastprogress = 0.0
+        if not isinstance(audiodoc, CompactAudioDoc):
+            audiodoc = CompactAudioDoc.fromdoc(audiodoc)
+        sentences = [ sentence.split(' ') for sentence, _, _ in transcriptdoc ]
+        vocabulary = Vocabulary(audiodoc.vocabulary)
+        asrids = np.array([ vocabulary.ids[word.lower()] for word in audiodoc.vocabulary ], dtype=int)[audiodoc.wordids].tolist()
+        transcriptids = []
+        offsets = [] #position of every sentence in the concatenated transcript
+        for sentence in sentences:
+            offsets.append(len(transcriptids))
+            transcriptids += vocabulary.encode(sentence).tolist()
+        neighbours = NeighbourIndex(vocabulary, ldthreshold)
+        if metrics is not None:
+            metrics['asrwords'] += len(audiodoc)
+            metrics['sentences'] += len(sentences)
+            for sentence in sentences:
+                metrics['transcriptlengths'][len(sentence)] = metrics['transcriptlengths'].get(len(sentence), 0) + 1
+            metrics['time']['setup'] += time.perf_counter() - begintime
+            t = time.perf_counter()
+        #the session boundaries act as anchors too
+        anchors = [(0, 0)] + self.findanchors(transcriptids, asrids) + [(len(transcriptids), len(audiodoc))]
+        anchortpos = [ tpos for tpos, _ in anchors ]
+        if metrics is not None:
+            metrics['anchors'] += len(anchors) - 2
+            metrics['time']['anchoring'] += time.perf_counter() - t
+        if self.debug:
+            print("           asr word count:", len(audiodoc),file=sys.stderr)
+            print("transcript sentence count:", len(sentences), file=sys.stderr)
+            print("             anchor count:", len(anchors) - 2, file=sys.stderr)
+
+        lastend = 0
+        for i, (sentence, begin) in enumerate(zip(sentences, offsets)):
+            if self.debug or (self.progress is not None and time.time() - lastprogress >= self.progress):
+                print("PROCESSING #" + str(i+1) + "/" + str(len(sentences)) + ":",  " ".join(sentence),file=sys.stderr)
+                lastprogress = time.time()
+            end = begin + len(sentence)
+            #the window: between the last anchor at or before the sentence and the first anchor at or after it
+            k = bisect.bisect_right(anchortpos, begin) - 1
+            l = max(bisect.bisect_left(anchortpos, end), k + 1)
+            (tbegin, abegin), (tend, aend) = anchors[k], anchors[min(l, len(anchors) - 1)]
+            #estimate the position of the sentence in the ASR output by interpolating between the anchors
+            ratio = (aend - abegin) / (tend - tbegin) if tend > tbegin else 1.0
+            estimate = abegin + int((begin - tbegin) * ratio)
+            regionbegin = max(abegin, estimate - self.slack, lastend if lastend < aend else abegin)
+            regionend = min(aend + self.ngram, len(audiodoc), abegin + int((end - tbegin) * ratio) + self.slack, regionbegin + self.margin)
+            self.total += 1
+            score = 0.0
+            span = None
+            if regionend > regionbegin:
+                region = audiodoc.words(regionbegin, regionend)
+                if metrics is not None:
+                    t = time.perf_counter()
+                    metrics['cells'] += (len(sentence) + 1) * (len(region) + 1)
+                    metrics['candidatelengths'][len(region)] = metrics['candidatelengths'].get(len(region), 0) + 1
+                span = smith_waterman_span(region, sentence, ldthreshold=ldthreshold, engine=self.engine, neighbours=neighbours if self.engine == "numpy" else None)
+                if span is not None:
+                    asrsentence = region[span[0]:span[1]]
+                    #normalised as smith_waterman_distance() would score the sentence against the span: the best local
+                    #alignment lies within the span, so the maximum of the matrix is the same
+                    score = span[2] / (3 * max(len(sentence), len(asrsentence)))
+                if metrics is not None:
+                    metrics['time']['scoring'] += time.perf_counter() - t
+            self.scores.append(score)
+            if span is not None and score >= score_threshold:
+                lastend = regionbegin + span[1]
+                if self.debug:
+                    print("TRANSCRIPT: ", " ".join(sentence), " ASR: ", " ".join(asrsentence), " SCORE=", score, file=sys.stderr)
+                yield " ".join(sentence), " ".join(asrsentence), score, regionbegin + span[0] - estimate
+            else:
+                if self.debug:
+                    print("Score threshold not met. SCORE=", score, "TRANSCRIPT="," ".join(sentence), file=sys.stderr)
+                self.loss += 1
+        if metrics is not None:
+            metrics['time']['wall'] += time.perf_counter() - begintime
+
+
+class GlobalAligner(TimeAligner):
+    """Aligns the whole transcript against the whole ASR output in one global alignment (same scores as the Smith-Waterman
+    alignment, same match rule as wordmatch()), then projects the sentence boundaries of the transcript onto the ASR words.
+    The alignment is computed with Hirschberg's divide and conquer algorithm, so memory use is linear in the session length"""
+
+    BASECELLS = 250000 #subproblems up to this size are solved directly, with a full matrix
+
+    def __init__(self, debug=False, engine="numpy", metrics=False, progress=None, match=3, mismatch=-1, gap=-0.5):
+        super().__init__(debug, engine, metrics, progress)
+        self.match = match
+        self.mismatch = mismatch
+        self.gap = gap
+        if self.metrics is not None:
+            self.metrics['time']['alignment'] = 0.0
+
+    def matchvector(self, id, colids):
+        """Boolean vector: which of the column words match the given word"""
+        self.lookup[id] = True
+        for other in self.neighbours.neighbours[id]:
+            self.lookup[other] = True
+        matches = self.lookup[colids]
+        self.lookup[id] = False
+        for other in self.neighbours.neighbours[id]:
+            self.lookup[other] = False
+        return matches
+
+    def lastrow(self, rowids, colids):
+        """Global alignment scores of all of rowids against every prefix of colids (the last row of the matrix), computed
+        row by row in linear space (the insertion chain within a row has a closed form, see smith_waterman_matrix())"""
+        #float32 is exact for the default scores (all multiples of 0.5) and halves the memory traffic
+        steps = (np.arange(len(colids) + 1) * self.gap).astype(np.float32)
+        row = steps.copy()
+        t = np.empty(len(colids) + 1, dtype=np.float32)
+        diagonal = np.empty(len(colids), dtype=np.float32)
+        for k, id in enumerate(rowids, 1):
+            t[0] = k * self.gap
+            np.add(row[:-1], self.mismatch, out=diagonal)
+            diagonal[self.matchvector(id, colids)] += self.match - self.mismatch
+            np.maximum(diagonal, row[1:] + self.gap, out=t[1:])
+            t -= steps
+            np.maximum.accumulate(t, out=row)
+            row += steps
+        if self.metrics is not None:
+            self.metrics['cells'] += (len(rowids) + 1) * (len(colids) + 1)
+        return row
+
+    def solve(self, rowids, colids, rowoffset, coloffset, alignment):
+        """Aligns a subproblem directly with a full matrix and backtracking, stores the aligned column for every row"""
+        mat = np.empty((len(rowids) + 1, len(colids) + 1))
+        substitution = np.empty((len(rowids), len(colids)))
+        steps = np.arange(len(colids) + 1) * self.gap
+        mat[0] = steps
+        t = np.empty(len(colids) + 1)
+        for k, id in enumerate(rowids, 1):
+            substitution[k-1] = np.where(self.matchvector(id, colids), self.match, self.mismatch)
+            t[0] = k * self.gap
+            np.maximum(mat[k-1,:-1] + substitution[k-1], mat[k-1,1:] + self.gap, out=t[1:])
+            mat[k] = np.maximum.accumulate(t - steps) + steps
+        if self.metrics is not None:
+            self.metrics['cells'] += mat.size
+        i, j = len(rowids), len(colids)
+        while i > 0 and j > 0:
+            if np.isclose(mat[i,j], mat[i-1,j-1] + substitution[i-1,j-1]):
+                i -= 1
+                j -= 1
+                alignment[rowoffset + i] = coloffset + j
+            elif np.isclose(mat[i,j], mat[i-1,j] + self.gap):
+                i -= 1
+            else:
+                j -= 1
+
+    def hirschberg(self, rowids, colids, rowoffset, coloffset, alignment):
+        if not len(rowids) or not len(colids):
+            return
+        if len(rowids) == 1 or len(rowids) * len(colids) <= self.BASECELLS:
+            self.solve(rowids, colids, rowoffset, coloffset, alignment)
+            return
+        middle = len(rowids) // 2
+        forward = self.lastrow(rowids[:middle], colids)
+        backward = self.lastrow(rowids[middle:][::-1], colids[::-1])[::-1]
+        split = int(np.argmax(forward + backward))
+        self.hirschberg(rowids[:middle], colids[:split], rowoffset, coloffset, alignment)
+        self.hirschberg(rowids[middle:], colids[split:], rowoffset + middle, coloffset + split, alignment)
+
+    def __call__(self, transcriptdoc, audiodoc, score_threshold, ldthreshold):
+        metrics = self.metrics
+        if metrics is not None:
+            begintime = time.perf_counter()
+        lastprogress = 0.0
+        if not isinstance(audiodoc, CompactAudioDoc):
+            audiodoc = CompactAudioDoc.fromdoc(audiodoc)
+        sentences = [ sentence.split(' ') for sentence, _, _ in transcriptdoc ]
+        vocabulary = Vocabulary(audiodoc.vocabulary)
+        asrids = np.array([ vocabulary.ids[word.lower()] for word in audiodoc.vocabulary ], dtype=int)[audiodoc.wordids]
+        offsets = [] #position of every sentence in the concatenated transcript
+        transcriptids = array('q')
+        for sentence in sentences:
+            offsets.append(len(transcriptids))
+            transcriptids.extend(vocabulary.encode(sentence).tolist())
+        offsets.append(len(transcriptids))
+        transcriptids = np.frombuffer(transcriptids, dtype=np.int64)
+        self.neighbours = neighbours = NeighbourIndex(vocabulary, ldthreshold)
+        self.lookup = np.zeros(len(vocabulary), dtype=bool) #scratch space for matchvector()
+        if metrics is not None:
+            metrics['asrwords'] += len(audiodoc)
+            metrics['sentences'] += len(sentences)
+            for sentence in sentences:
+                metrics['transcriptlengths'][len(sentence)] = metrics['transcriptlengths'].get(len(sentence), 0) + 1
+            metrics['time']['setup'] += time.perf_counter() - begintime
+            t = time.perf_counter()
+        if self.debug:
+            print("           asr word count:", len(audiodoc),file=sys.stderr)
+            print("transcript sentence count:", len(sentences), file=sys.stderr)
+
+        #for every transcript word the index of the ASR word it is aligned to, or -1
+        alignment = np.full(len(transcriptids), -1, dtype=np.int64)
+        self.hirschberg(transcriptids, asrids, 0, 0, alignment)
+        if metrics is not None:
+            metrics['time']['alignment'] += time.perf_counter() - t
+
+        for i, sentence in enumerate(sentences):
+            if self.debug or (self.progress is not None and time.time() - lastprogress >= self.progress):
+                print("PROCESSING #" + str(i+1) + "/" + str(len(sentences)) + ":",  " ".join(sentence),file=sys.stderr)
+                lastprogress = time.time()
+            #the sentence covers the ASR words from the first to the last one its words are aligned to
+            aligned = alignment[offsets[i]:offsets[i+1]]
+            aligned = aligned[aligned >= 0]
+            self.total += 1
+            score = 0.0
+            if len(aligned):
+                asrsentence = audiodoc.words(int(aligned[0]), int(aligned[-1]) + 1)
+                if metrics is not None:
+                    t = time.perf_counter()
+                score = float(smith_waterman_distance(sentence, asrsentence, ldthreshold=ldthreshold, engine=self.engine, neighbours=neighbours if self.engine == "numpy" else None)[0])
+                if metrics is not None:
+                    metrics['time']['scoring'] += time.perf_counter() - t
+                if np.isnan(score):
+                    score = 0.0
+            self.scores.append(score)
+            if len(aligned) and score >= score_threshold:
+                #there is no flexibility step in this mode, the offset is always 0
+                yield " ".join(sentence), " ".join(asrsentence), score, 0
+            else:
+                if self.debug:
+                    print("Score threshold not met. SCORE=", score, "TRANSCRIPT="," ".join(sentence), file=sys.stderr)
+                self.loss += 1
+        if metrics is not None:
+            metrics['time']['wall'] += time.perf_counter() - begintime
+
+
+def align(speechfile, transcriptfile, out=sys.stdout, score_threshold=0.5, ldthreshold=2, debug=False, engine="numpy", cache=False, jsonl=False, metrics=False, progress=None, mode="time"):
+    """Aligns one session and writes the sentence pairs as JSON (or as JSON Lines, one pair per line, if jsonl is set) to out,
+    returns the aligner (which holds the statistics and, if metrics is set, the metrics).
+    The mode is either 'time' (TimeAligner, driven by the timestamps), 'anchor' (AnchorAligner, driven by unique n-grams) or
+    'global' (GlobalAligner, a single alignment of the whole session).
+    If cache is set, the parsed input documents are cached alongside the XML files and reused on subsequent runs."""
+    if cache:
+        audiodoc = CompactAudioDoc.load(speechfile, cache=True)
+        transcriptdoc = CompactTranscriptDoc.load(transcriptfile, cache=True)
+    else:
+        audiodoc = AudioDoc(speechfile, stream=True)
+        transcriptdoc = CXMLDoc(transcriptfile)
+
+    if mode == "time":
+        aligner = TimeAligner(debug, engine, metrics, progress)
+    elif mode == "anchor":
+        aligner = AnchorAligner(debug, engine, metrics, progress)
+    elif mode == "global":
+        aligner = GlobalAligner(debug, engine, metrics, progress)
+    else:
+        raise ValueError("Unknown alignment mode: " + str(mode))
+    if jsonl:
+        for transcriptsentence, asrsentence,score, offset in aligner(transcriptdoc, audiodoc, score_threshold, ldthreshold):
+            print(json.dumps({"transcript": transcriptsentence, "asr":asrsentence, "score":score, "offset": offset}, ensure_ascii=False), file=out)
+        return aligner
+    print("{ \"sentence_pairs\" : [", file=out)
+    for i, (transcriptsentence, asrsentence,score, offset) in enumerate(aligner(transcriptdoc, audiodoc, score_threshold, ldthreshold)):
+        if i > 0: print(",", file=out)
+        print(json.dumps({"transcript": transcriptsentence, "asr":asrsentence, "score":score, "offset": offset}, indent=4, ensure_ascii=False), file=out)
+    print("]}", file=out)
+    return aligner
+
+
+def alignsession(job):
+    """Aligns one session of a batch, writing to its own output file. Returns (session, loss, total, scores, metrics, error),
+    metrics is None if not enabled"""
+    session, speechfile, transcriptfile, outputfile, score_threshold, ldthreshold, debug, engine, cache, jsonl, metrics, progress, mode = job
+    try:
+        with open(outputfile,'w',encoding='utf-8') as out:
+            aligner = align(speechfile, transcriptfile, out, score_threshold, ldthreshold, debug, engine, cache, jsonl, metrics, progress, mode)
+        return session, aligner.loss, aligner.total, aligner.scores, aligner.metricsrecord() if metrics else None, None
+    except Exception as e: #pylint: disable=broad-except
+        #one failing session should not take the whole batch down, it is reported in the summary
+        if os.path.exists(outputfile):
+            os.unlink(outputfile)
+        return session, 0, 0, [], None, type(e).__name__ + ": " + str(e)
+
+
+def alignbatch(sessions, inputdir, outputdir, speechpattern, transcriptpattern, score_threshold=0.5, ldthreshold=2, debug=False, engine="numpy", cache=False, jsonl=False, workers=None, metrics=False, progress=None, mode="time"):
+    """Aligns multiple sessions in parallel, writes the JSON output per session to the output directory and returns a summary
+    (with the metrics record of each session, if metrics is set)"""
+    jobs = []
+    for session in sessions:
+        jobs.append( (session,
+            os.path.join(inputdir, speechpattern.format(session=session)),
+            os.path.join(inputdir, transcriptpattern.format(session=session)),
+            os.path.join(outputdir, session + (".jsonl" if jsonl else ".json")),
+            score_threshold, ldthreshold, debug, engine, cache, jsonl, metrics, progress, mode) )
+    results = {}
+    with multiprocessing.Pool(workers) as pool:
+        for session, loss, total, scores, record, error in pool.imap_unordered(alignsession, jobs):
+            if error:
+                print("FAILED: ", session, error, file=sys.stderr)
+            else:
+                print("DONE: ", session, file=sys.stderr)
+            results[session] = (loss, total, scores, record, error)
+
+    summary = {"sessions": [], "failed": [], "loss": 0, "total": 0, "scores": []}
+    for session in sessions:
+        loss, total, scores, record, error = results[session]
+        if error:
+            summary['failed'].append({"session": session, "error": error})
+        else:
+            summary['sessions'].append({"session": session, "loss": loss, "total": total, "avscore": sum(scores) / len(scores) if scores else None})
+            if record is not None:
+                summary['sessions'][-1]['metrics'] = record
+            summary['loss'] += loss
+            summary['total'] += total
+            summary['scores'] += scores
+    return summary
 
 
 def main():
     parser = argparse.ArgumentParser(description="Spreek2Schrijf Aligner", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('-s','--speech', type=str,help="AudioDoc XML", action='store',default="",required=True)
-    parser.add_argument('-t','--transcript', type=str,help="Conversational XML", action='store',default="",required=True)
+    parser.add_argument('-s','--speech', type=str,help="AudioDoc XML", action='store',default="",required=False)
+    parser.add_argument('-t','--transcript', type=str,help="Conversational XML", action='store',default="",required=False)
     parser.add_argument('-S','--score', type=float,help="Smith-Waterman distance score threshold", action='store',default=0.5,required=False)
     parser.add_argument('-D','--ldthreshold', type=int,help=argparse.SUPPRESS, action='store',default=2,required=False) #obsolete
+    parser.add_argument('-m','--mode', type=str,help="Alignment mode: time (sentences are located by their timestamps) or anchor (sentences are located between n-grams that are unique in both the transcript and the ASR output, robust to clock offsets) or global (one linear-space alignment of the whole session, sentence boundaries are projected onto the ASR output)", action='store',choices=('time','anchor','global'),default="time",required=False)
+    parser.add_argument('-E','--engine', type=str,help="Smith-Waterman engine: numpy (vectorised) or python (reference implementation)", action='store',choices=('numpy','python'),default="numpy",required=False)
+    parser.add_argument('-C','--cache', help="Cache the parsed input documents in a file alongside each XML file (*.s2scache) and reuse it as long as the XML file is unchanged", action='store_true',default=False,required=False)
+    parser.add_argument('-J','--jsonl', help="Output JSON Lines (one sentence pair per line) rather than JSON", action='store_true',default=False,required=False)
     parser.add_argument('-d','--debug', help="Debug", action='store_true',default=False,required=False)
+    parser.add_argument('-P','--progress', type=float,help="Print progress messages, at most once per this many seconds", action='store',default=None,required=False)
+    parser.add_argument('-M','--metrics', type=str,help="Instrument the aligner and append a JSON metrics record (timings, DP cells computed, sentence length histograms) per session to this file (JSON Lines)", action='store',default="",required=False)
+    parser.add_argument('-I','--index', type=str,help="Batch mode: index file listing one session per line (use instead of --speech and --transcript)", action='store',default="",required=False)
+    parser.add_argument('-i','--inputdir', type=str,help="Batch mode: input directory", action='store',default=".",required=False)
+    parser.add_argument('-o','--outputdir', type=str,help="Batch mode: output directory, JSON output will be written to SESSION.json (or SESSION.jsonl)", action='store',default=".",required=False)
+    parser.add_argument('--speechpattern', type=str,help="Batch mode: filename of the AudioDoc XML in the input directory, {session} is replaced by the session", action='store',default="{session}.asr.xml",required=False)
+    parser.add_argument('--transcriptpattern', type=str,help="Batch mode: filename of the Conversational XML in the input directory, {session} is replaced by the session", action='store',default="{session}.xml",required=False)
+    parser.add_argument('-j','--workers', type=int,help="Batch mode: number of worker processes (defaults to the number of CPUs)", action='store',default=None,required=False)
+    parser.add_argument('--summary', type=str,help="Batch mode: write a JSON summary with the statistics for all sessions to this file", action='store',default="",required=False)
     args = parser.parse_args()
 
-    audiodoc = AudioDoc(args.speech)
-    transcriptdoc = CXMLDoc(args.transcript)
-
-    print("{ \"sentence_pairs\" : [")
-    aligner = TimeAligner(args.debug)
-    for i, (transcriptsentence, asrsentence,score, offset) in enumerate(aligner(transcriptdoc, audiodoc, args.score, args.ldthreshold)):
-        if i > 0: print(",")
-        print(json.dumps({"transcript": transcriptsentence, "asr":asrsentence, "score":score, "offset": offset}, indent=4, ensure_ascii=False))
-    print("]}")
-    if aligner.total:
-        print("LOSS: ", round((aligner.loss / aligner.total) * 100,2), "%", file=sys.stderr)
-        print("AV SCORE: ", round((sum(aligner.scores) / len(aligner.scores)),2), " (prior to pruning)", file=sys.stderr)
+    if args.index:
+        with open(args.index,'r',encoding='utf-8') as f:
+            sessions = [ line.strip() for line in f if line.strip() ]
+        os.makedirs(args.outputdir, exist_ok=True)
+        summary = alignbatch(sessions, args.inputdir, args.outputdir, args.speechpattern, args.transcriptpattern, args.score, args.ldthreshold, args.debug, args.engine, args.cache, args.jsonl, args.workers, bool(args.metrics), args.progress, args.mode)
+        for session in summary['sessions']:
+            if session['total']:
+                print(session['session'] + "\tLOSS: ", round((session['loss'] / session['total']) * 100,2), "%\tAV SCORE: ", round(session['avscore'],2), file=sys.stderr)
+        for session in summary['failed']:
+            print(session['session'] + "\tFAILED: ", session['error'], file=sys.stderr)
+        print("SESSIONS: ", len(summary['sessions']), "aligned, ", len(summary['failed']), "failed", file=sys.stderr)
+        if summary['total']:
+            print("LOSS: ", round((summary['loss'] / summary['total']) * 100,2), "%", file=sys.stderr)
+            print("AV SCORE: ", round((sum(summary['scores']) / len(summary['scores'])),2), " (prior to pruning)", file=sys.stderr)
+        if args.metrics:
+            with open(args.metrics,'a',encoding='utf-8') as f:
+                for session in summary['sessions']:
+                    print(json.dumps(dict(session=session['session'], **session['metrics'])), file=f)
+        if args.summary:
+            with open(args.summary,'w',encoding='utf-8') as f:
+                json.dump({
+                    "sessions": summary['sessions'],
+                    "failed": summary['failed'],
+                    "loss": summary['loss'] / summary['total'] if summary['total'] else None,
+                    "avscore": sum(summary['scores']) / len(summary['scores']) if summary['scores'] else None,
+                }, f, indent=4, ensure_ascii=False)
+        if summary['failed']:
+            sys.exit(1)
+    elif args.speech and args.transcript:
+        aligner = align(args.speech, args.transcript, sys.stdout, args.score, args.ldthreshold, args.debug, args.engine, args.cache, args.jsonl, bool(args.metrics), args.progress, args.mode)
+        if args.metrics:
+            with open(args.metrics,'a',encoding='utf-8') as f:
+                print(json.dumps(dict(session=os.path.basename(args.transcript), **aligner.metricsrecord())), file=f)
+        if aligner.total:
+            print("LOSS: ", round((aligner.loss / aligner.total) * 100,2), "%", file=sys.stderr)
+            print("AV SCORE: ", round((sum(aligner.scores) / len(aligner.scores)),2), " (prior to pruning)", file=sys.stderr)
+    else:
+        parser.error("Specify either --speech and --transcript, or --index for batch mode")
 
 
 if __name__ == '__main__':
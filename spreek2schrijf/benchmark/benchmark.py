@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+#Benchmarks for the aligner, the document formats and the post-correction, on synthetic sessions of increasing size.
+#Results are written as JSON and can be compared against a stored baseline.
+
+import sys
+import os
+import io
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+from spreek2schrijf.aligner import TimeAligner, AnchorAligner, GlobalAligner, smith_waterman_distance
+from spreek2schrijf.formats import AudioDoc, CXMLDoc, CompactAudioDoc
+from spreek2schrijf.webservice.postcorrect import PostCorrector
+from spreek2schrijf.benchmark.synthetic import Session
+
+NAMESFILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "webservice", "namen.txt")
+
+
+def measure(function, repeat=1, memory=True):
+    """Runs the function repeat times, returns the best time (in seconds), the peak memory use (in bytes, as traced by
+    tracemalloc in a separate run, or None) and the return value of the last run"""
+    best = None
+    with contextlib.redirect_stderr(io.StringIO()): #the code under test may be verbose
+        for _ in range(repeat):
+            gc.collect()
+            begintime = time.perf_counter()
+            result = function()
+            duration = time.perf_counter() - begintime
+            if best is None or duration < best:
+                best = duration
+        peak = None
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            function()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    return best, peak, result
+
+
+class Benchmarks:
+    """The benchmarks for one synthetic session. Every benchmark returns (items, unit, extra results)"""
+
+    def __init__(self, session, tmpdir, noise, drift):
+        self.session = session
+        self.transcriptfile = os.path.join(tmpdir, "transcript.xml")
+        self.speechfile = os.path.join(tmpdir, "speech.xml")
+        session.writetranscript(self.transcriptfile)
+        session.writeasr(self.speechfile, noise, drift)
+        self.audiodoc = CompactAudioDoc.fromdoc(AudioDoc(self.speechfile, stream=True))
+        self.transcript = list(CXMLDoc(self.transcriptfile))
+
+    def audiodoc_parse(self):
+        return len(list(AudioDoc(self.speechfile))), "words", {}
+
+    def audiodoc_stream(self):
+        return len(list(AudioDoc(self.speechfile, stream=True))), "words", {}
+
+    def audiodoc_compact(self):
+        return len(CompactAudioDoc.fromdoc(AudioDoc(self.speechfile, stream=True))), "words", {}
+
+    def cxmldoc_parse(self):
+        return len(list(CXMLDoc(self.transcriptfile))), "sentences", {}
+
+    def smith_waterman(self, engine):
+        rand = random.Random(0)
+        pairs = 0
+        for sentence, _, _ in self.transcript[:200]:
+            transcript = sentence.split(' ')
+            begin = rand.randrange(max(1, len(self.audiodoc) - len(transcript)))
+            smith_waterman_distance(transcript, self.audiodoc.words(begin, begin + len(transcript)), engine=engine)
+            pairs += 1
+        return pairs, "pairs", {}
+
+    def smith_waterman_numpy(self):
+        return self.smith_waterman("numpy")
+
+    def smith_waterman_python(self):
+        return self.smith_waterman("python")
+
+    def timealigner(self, engine, alignerclass=TimeAligner):
+        aligner = alignerclass(engine=engine)
+        pairs = sum( 1 for _ in aligner(self.transcript, self.audiodoc, 0.5, 2) )
+        return len(self.transcript), "sentences", {
+            "pairs": pairs,
+            "loss": aligner.loss / aligner.total if aligner.total else None,
+            "avscore": sum(aligner.scores) / len(aligner.scores) if aligner.scores else None,
+        }
+
+    def timealigner_numpy(self):
+        return self.timealigner("numpy")
+
+    def timealigner_python(self):
+        return self.timealigner("python")
+
+    def anchoraligner_numpy(self):
+        return self.timealigner("numpy", AnchorAligner)
+
+    def globalaligner_numpy(self):
+        return self.timealigner("numpy", GlobalAligner)
+
+    def postcorrect(self):
+        corrector = PostCorrector.fromfile(NAMESFILE, log=None)
+        lines = [ " ".join(words).lower() for words, _ in self.session.sentences ]
+        return sum( 1 for _ in corrector.correct(lines) ), "lines", {}
+
+BENCHMARKS = ("audiodoc_parse", "audiodoc_stream", "audiodoc_compact", "cxmldoc_parse", "smith_waterman_numpy", "smith_waterman_python", "timealigner_numpy", "timealigner_python", "anchoraligner_numpy", "globalaligner_numpy", "postcorrect")
+
+#benchmarks that are too slow for large sizes are capped
+MAXSIZE = {
+    "timealigner_python": 2000,
+    "globalaligner_numpy": 2000, #quadratic time
+}
+
+
+def run(sizes, benchmarks=BENCHMARKS, repeat=3, memory=True, seed=0, noise=0.15, drift=1000, log=sys.stderr):
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            suite = Benchmarks(Session(size, seed), tmpdir, noise, drift)
+            for name in benchmarks:
+                if size > MAXSIZE.get(name, size):
+                    continue
+                duration, peak, (items, unit, extra) = measure(getattr(suite, name), repeat, memory)
+                result = {
+                    "benchmark": name,
+                    "size": size,
+                    "seconds": duration,
+                    "items": items,
+                    "unit": unit,
+                    "throughput": items / duration if duration else None,
+                    "peakmemory": peak,
+                }
+                result.update(extra)
+                results.append(result)
+                if log:
+                    print(name + "\tsize=" + str(size) + "\t" + str(round(result['throughput'],1)) + " " + unit + "/s" + ("\tpeak=" + str(round(peak / 1024 / 1024,2)) + "MB" if peak is not None else "") + "".join( "\t" + key + "=" + str(round(value,4) if isinstance(value, float) else value) for key, value in extra.items() ),file=log)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": seed,
+        "noise": noise,
+        "drift": drift,
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance=0.1, log=sys.stderr):
+    """Compares a report against a baseline report, returns the list of regressions: lower throughput (beyond the tolerance,
+    a fraction), higher peak memory (likewise) or a higher alignment loss"""
+    regressions = []
+    reference = { (result['benchmark'], result['size']): result for result in baseline['results'] }
+    for result in report['results']:
+        key = (result['benchmark'], result['size'])
+        if key not in reference:
+            continue
+        old = reference[key]
+        changes = []
+        if result['throughput'] and old['throughput']:
+            ratio = result['throughput'] / old['throughput']
+            changes.append("throughput x" + str(round(ratio,2)))
+            if ratio < 1 - tolerance:
+                regressions.append((key, "throughput", old['throughput'], result['throughput']))
+        if result.get('peakmemory') and old.get('peakmemory'):
+            ratio = result['peakmemory'] / old['peakmemory']
+            changes.append("memory x" + str(round(ratio,2)))
+            if ratio > 1 + tolerance:
+                regressions.append((key, "peakmemory", old['peakmemory'], result['peakmemory']))
+        if result.get('loss') is not None and old.get('loss') is not None:
+            changes.append("loss " + str(round(old['loss'],4)) + " -> " + str(round(result['loss'],4)))
+            if result['loss'] > old['loss']:
+                regressions.append((key, "loss", old['loss'], result['loss']))
+        if log:
+            print(key[0] + "\tsize=" + str(key[1]) + "\t" + ", ".join(changes),file=log)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the aligner, document formats and post-correction on synthetic sessions", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n','--sizes', type=str,help="Session sizes (number of sentences) to benchmark, comma separated", action='store',default="100,1000,5000",required=False)
+    parser.add_argument('-b','--benchmarks', type=str,help="Benchmarks to run, comma separated (choose from: " + ", ".join(BENCHMARKS) + ")", action='store',default=",".join(BENCHMARKS),required=False)
+    parser.add_argument('-r','--repeat', type=int,help="Number of timed runs per benchmark (the best is reported)", action='store',default=3,required=False)
+    parser.add_argument('--nomemory', help="Do not measure peak memory (saves an extra run per benchmark)", action='store_true',default=False,required=False)
+    parser.add_argument('--seed', type=int,help="Random seed for the synthetic sessions", action='store',default=0,required=False)
+    parser.add_argument('--noise', type=float,help="Fraction of ASR errors in the synthetic sessions", action='store',default=0.15,required=False)
+    parser.add_argument('--drift', type=int,help="Maximum timestamp drift in the synthetic sessions (ms)", action='store',default=1000,required=False)
+    parser.add_argument('-o','--output', type=str,help="Write the results (JSON) to this file (defaults to standard output)", action='store',default="",required=False)
+    parser.add_argument('--baseline', type=str,help="Compare against the results (JSON) in this file, exits with status 1 on regressions", action='store',default="",required=False)
+    parser.add_argument('--tolerance', type=float,help="Relative change in throughput or memory that is tolerated before it counts as a regression", action='store',default=0.1,required=False)
+    args = parser.parse_args()
+
+    benchmarks = args.benchmarks.split(',')
+    for name in benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark: " + name)
+    report = run([ int(size) for size in args.sizes.split(',') ], benchmarks, args.repeat, not args.nomemory, args.seed, args.noise, args.drift)
+    if args.output:
+        with open(args.output,'w',encoding='utf-8') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+    if args.baseline:
+        with open(args.baseline,'r',encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for (name, size), field, old, new in regressions:
+            print("REGRESSION: " + name + " size=" + str(size) + " " + field + ": " + str(old) + " -> " + str(new),file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
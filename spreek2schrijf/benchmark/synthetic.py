@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+#Generates synthetic sessions: a transcript in conversational XML (as read by formats.CXMLDoc) and the matching ASR output in
+#AudioDoc XML (as read by formats.AudioDoc), with ASR errors and timestamp drift between the two.
+
+import sys
+import random
+import argparse
+from xml.sax.saxutils import escape
+
+VOCABULARY = """de het een en van in is dat op te zijn met voor niet ook aan er om maar nog als bij dan door wel naar over
+ik u wij we zij hij het dit deze die wat hoe waarom wanneer waar welke geen heel zeer goed dank voorzitter minister kamer
+staatssecretaris regering kabinet motie amendement interruptie collega fractie begroting wetsvoorstel debat vraag vragen
+antwoord woord beantwoording aangegeven gezegd toegezegd afspraken mening oordeel standpunt verzoek brief onderzoek
+ontwikkelingen maatregelen gemeenten provincies burgers ondernemers belastingen zorgverzekering onderwijs veiligheid
+defensie infrastructuur woningmarkt arbeidsmarkt pensioenen klimaatakkoord stikstof asielzoekers integratie europese
+unie nederland amsterdam rotterdam rutte wilders klaver jetten pvda vvd cda d66 groenlinks""".split()
+
+EOS = ('.', '?', '!')
+
+
+class Session:
+    """A synthetic session: a list of sentences, each a (words, starttime) tuple with the start time in milliseconds"""
+
+    def __init__(self, sentences=1000, seed=0, minlength=3, maxlength=25, wordduration=350, vocabulary=VOCABULARY):
+        self.random = random.Random(seed)
+        self.wordduration = wordduration
+        self.vocabulary = vocabulary
+        self.sentences = []
+        time = 0
+        for _ in range(sentences):
+            length = self.random.randint(minlength, maxlength)
+            words = [ self.random.choice(vocabulary) for _ in range(length) ]
+            words[0] = words[0].capitalize()
+            self.sentences.append((words, time))
+            time += length * wordduration + self.random.randint(0, 2000) #words plus a pause
+
+    def __len__(self):
+        return len(self.sentences)
+
+    def words(self):
+        return sum( len(words) for words, _ in self.sentences )
+
+    def writetranscript(self, filename, turnsize=5):
+        """Writes the transcript as conversational XML, turnsize sentences per turn"""
+        with open(filename,'w',encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="utf-8"?>\n<root>\n')
+            for k in range(0, len(self.sentences), turnsize):
+                turnstart = self.sentences[k][1]
+                f.write('<turn recordingTime="%d">\n<transcription>\n' % turnstart)
+                for words, starttime in self.sentences[k:k+turnsize]:
+                    for i, word in enumerate(words):
+                        postfix = ' postfix="%s"' % self.random.choice(EOS) if i == len(words) - 1 else ''
+                        f.write('<word startMs="%d" endMs="%d"%s><text>%s</text></word>\n' % (starttime - turnstart + i * self.wordduration, self.wordduration, postfix, escape(word)))
+                f.write('</transcription>\n</turn>\n')
+            f.write('</root>\n')
+
+    def misrecognize(self, word):
+        """Returns a word the ASR might have produced instead: a near miss or a different word"""
+        if len(word) > 4 and self.random.random() < 0.5:
+            i = self.random.randrange(len(word))
+            return word[:i] + self.random.choice("aeioulnrst") + word[i+1:]
+        return self.random.choice(self.vocabulary)
+
+    def writeasr(self, filename, noise=0.15, drift=1000, jitter=300):
+        """Writes the ASR output as AudioDoc XML. A fraction noise of the words is deleted, substituted or followed by an
+        inserted word. Timestamps drift from the transcript in a random walk bounded by drift (ms), plus per-word jitter"""
+        offset = 0
+        with open(filename,'w',encoding='utf-8') as f:
+            f.write('<?xml version="1.0" ?>\n<AudioDoc name="synthetic.wav">\n\t<SegmentList>\n\t\t<SpeechSegment lang="dut">\n')
+            for words, starttime in self.sentences:
+                offset = max(-drift, min(drift, offset + self.random.randint(-drift // 4, drift // 4)))
+                for i, word in enumerate(words):
+                    asrwords = [word.lower()]
+                    r = self.random.random()
+                    if r < noise / 3:
+                        asrwords = []
+                    elif r < noise * 2 / 3:
+                        asrwords = [self.misrecognize(word.lower())]
+                    elif r < noise:
+                        asrwords.append(self.random.choice(self.vocabulary))
+                    for k, asrword in enumerate(asrwords):
+                        time = starttime + offset + i * self.wordduration + k * (self.wordduration // 2) + self.random.randint(-jitter, jitter)
+                        f.write('\t\t\t<Word stime="%.2f" dur="%.2f" conf="%.2f">%s</Word>\n' % (max(0, time) / 1000, self.wordduration / 1000, self.random.uniform(0.5, 1.0), escape(asrword)))
+            f.write('\t\t</SpeechSegment>\n\t</SegmentList>\n</AudioDoc>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates a synthetic session: a transcript (conversational XML) and ASR output (AudioDoc XML)", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n','--sentences', type=int,help="Number of sentences", action='store',default=1000,required=False)
+    parser.add_argument('--seed', type=int,help="Random seed", action='store',default=0,required=False)
+    parser.add_argument('--noise', type=float,help="Fraction of ASR errors (deletions, substitutions, insertions)", action='store',default=0.15,required=False)
+    parser.add_argument('--drift', type=int,help="Maximum timestamp drift between transcript and ASR output (ms)", action='store',default=1000,required=False)
+    parser.add_argument('-t','--transcript', type=str,help="Output file for the transcript", action='store',required=True)
+    parser.add_argument('-s','--speech', type=str,help="Output file for the ASR output", action='store',required=True)
+    args = parser.parse_args()
+
+    session = Session(args.sentences, args.seed)
+    session.writetranscript(args.transcript)
+    session.writeasr(args.speech, args.noise, args.drift)
+    print("Generated " + str(len(session)) + " sentences, " + str(session.words()) + " words",file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
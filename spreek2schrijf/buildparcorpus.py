@@ -6,24 +6,82 @@ import argparse
 import codecs
 import os.path
 import glob
+import hashlib
+import multiprocessing
+from spreek2schrijf.formats import iterjsonarray
+
+BUFFERSIZE = 1024*1024
+
+def readpairs(filename):
+    """Incrementally reads the (asr, transcript) sentence pairs from aligner output, either JSON or JSON Lines (*.jsonl)"""
+    with open(filename,'r',encoding='utf-8') as f:
+        if filename.endswith('.jsonl'):
+            sentencepairs = ( json.loads(line) for line in f if line.strip() )
+        else:
+            sentencepairs = iterjsonarray(f)
+        for sentencepair in sentencepairs:
+            if 'asr' in sentencepair and 'transcript' in sentencepair:
+                yield sentencepair['asr'], sentencepair['transcript']
+
+def pairhash(asr, transcript):
+    """Compact hash of a sentence pair, for deduplication"""
+    return hashlib.blake2b((asr + "\t" + transcript).encode('utf-8'), digest_size=8).digest()
+
+def assignsplit(session, dev=0.0, test=0.0):
+    """Deterministically assigns a session to the train, dev or test set, based on a hash of its name"""
+    value = int.from_bytes(hashlib.md5(session.encode('utf-8')).digest()[:8], 'big') / 2**64
+    if value < test:
+        return "test"
+    elif value < test + dev:
+        return "dev"
+    else:
+        return "train"
+
+def readsession(filename):
+    """Reads all sentence pairs of one session (runs in a worker process), returns (filename, pairs), each pair with its hash"""
+    return filename, [ (asr, transcript, pairhash(asr, transcript)) for asr, transcript in readpairs(filename) ]
 
 def main():
     parser = argparse.ArgumentParser(description="", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('-i','--inputdir', type=str,help="Input directory", action='store',default=".",required=False)
+    parser.add_argument('-i','--inputdir', type=str,help="Input directory (aligner output, *.json or *.jsonl)", action='store',default=".",required=False)
     parser.add_argument('-o','--outputprefix', type=str,help="Output prefix", action='store',default="corpus",required=False)
+    parser.add_argument('-j','--workers', type=int,help="Number of worker processes for reading the input (defaults to the number of CPUs)", action='store',default=None,required=False)
+    parser.add_argument('--dev', type=float,help="Fraction of the sessions that goes to the development set (PREFIX.*.dev.txt)", action='store',default=0.0,required=False)
+    parser.add_argument('--test', type=float,help="Fraction of the sessions that goes to the test set (PREFIX.*.test.txt)", action='store',default=0.0,required=False)
+    parser.add_argument('--dedup', help="Drop exact duplicate sentence pairs", action='store_true',default=False,required=False)
     args = parser.parse_args()
 
-    spraak = open(args.outputprefix +  ".spraak.txt",'w',encoding='utf-8')
-    schrijf = open(args.outputprefix +  ".schrijf.txt",'w',encoding='utf-8')
-
-    for filename in glob.glob(args.inputdir + "/*.json"):
-        print(os.path.basename(filename),file=sys.stderr)
-        with open(filename,'r',encoding='utf-8') as f:
-            data = json.load(f)
-            for sentencepair in data['sentence_pairs']:
-                if 'asr' in sentencepair and 'transcript' in sentencepair:
-                    print(sentencepair['asr'],file=spraak)
-                    print(sentencepair['transcript'],file=schrijf)
+    outputfiles = {}
+    for split, suffix in (("train", ""), ("dev", ".dev"), ("test", ".test")):
+        if split == "train" or getattr(args, split) > 0:
+            outputfiles[split] = (
+                open(args.outputprefix +  ".spraak" + suffix + ".txt",'w',encoding='utf-8', buffering=BUFFERSIZE),
+                open(args.outputprefix +  ".schrijf" + suffix + ".txt",'w',encoding='utf-8', buffering=BUFFERSIZE),
+            )
+
+    seen = set() #only hashes are kept, not the sentences themselves
+    duplicates = 0
+    filenames = sorted(glob.glob(args.inputdir + "/*.json") + glob.glob(args.inputdir + "/*.jsonl"))
+    with multiprocessing.Pool(args.workers) as pool:
+        for filename, sentencepairs in pool.imap(readsession, filenames):
+            session = os.path.basename(filename).rsplit('.',1)[0]
+            split = assignsplit(session, args.dev, args.test)
+            print(os.path.basename(filename), split, file=sys.stderr)
+            spraak, schrijf = outputfiles[split]
+            for asr, transcript, h in sentencepairs:
+                if args.dedup:
+                    if h in seen:
+                        duplicates += 1
+                        continue
+                    seen.add(h)
+                spraak.write(asr + "\n")
+                schrijf.write(transcript + "\n")
+
+    for spraak, schrijf in outputfiles.values():
+        spraak.close()
+        schrijf.close()
+    if args.dedup:
+        print("Duplicates removed: ", duplicates, file=sys.stderr)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+#Evaluation of MT output against a reference translation: WER, PER and BLEU (4-grams, single reference, with brevity
+#penalty), with bootstrap confidence intervals. The tokenisation and metric definitions follow the mtevalscripts (WER_v01.pl,
+#PER_v01.pl, bleu-1.04.pl), so the scores match theirs, without the need for SGML wrapping.
+
+import sys
+import re
+import json
+import argparse
+import multiprocessing
+from collections import Counter
+import numpy as np
+
+MAXN = 4 #maximum n-gram order for BLEU
+
+#columns of the per-segment statistics
+WORDERRORS, POSERRORS, REFLEN, HYPLEN = range(4)
+MATCHES = 4 #n-gram matches, for n = 1..MAXN
+NGRAMS = MATCHES + MAXN #n-grams in the hypothesis, for n = 1..MAXN
+COLUMNS = NGRAMS + MAXN
+
+
+def tokenize(line, preservecase=False):
+    """Normalises and tokenises a line the way the NIST mteval script does (only ASCII is lowercased)"""
+    line = " " + line.strip() + " "
+    if not preservecase:
+        line = re.sub(r'[A-Z]+', lambda match: match.group(0).lower(), line)
+    line = re.sub(r'([\{-\~\[-\` -\&\(-\+\:-\@\/])', r' \1 ', line) #punctuation
+    line = re.sub(r'([^0-9])([\.,])', r'\1 \2 ', line) #period and comma, unless preceded by a digit
+    line = re.sub(r'([\.,])([^0-9])', r' \1 \2', line) #period and comma, unless followed by a digit
+    line = re.sub(r'([0-9])(-)', r'\1 \2 ', line) #dash, when preceded by a digit
+    return line.split()
+
+def encode(lines, vocabulary, preservecase=False):
+    """Tokenises the lines and encodes every token as an integer, returns a list of arrays. The vocabulary (a dictionary) is
+    extended as needed"""
+    return [ np.array([ vocabulary.setdefault(token, len(vocabulary)) for token in tokenize(line, preservecase) ], dtype=np.int64) for line in lines ]
+
+def editdistance(hyp, ref):
+    """Levenshtein distance between two integer arrays (unit costs), computed row by row. The insertions within a row are
+    resolved with a cumulative minimum rather than a loop over the columns"""
+    if not len(hyp) or not len(ref):
+        return max(len(hyp), len(ref))
+    steps = np.arange(len(ref) + 1)
+    row = steps.copy()
+    t = np.empty(len(ref) + 1, dtype=steps.dtype)
+    for k, id in enumerate(hyp, 1):
+        t[0] = k
+        np.minimum(row[:-1] + (ref != id), row[1:] + 1, out=t[1:])
+        row = np.minimum.accumulate(t - steps) + steps
+    return int(row[-1])
+
+def ngrams(ids, n):
+    ids = ids.tolist()
+    return Counter(zip(*( ids[i:] for i in range(n) )))
+
+def segmentstatistics(hyp, ref):
+    """Returns the sufficient statistics of a single segment (see the COLUMNS), from which all scores can be computed"""
+    stats = np.zeros(COLUMNS, dtype=np.int64)
+    stats[WORDERRORS] = editdistance(hyp, ref)
+    stats[POSERRORS] = max(len(hyp), len(ref)) - sum((Counter(hyp.tolist()) & Counter(ref.tolist())).values())
+    stats[REFLEN] = len(ref)
+    stats[HYPLEN] = len(hyp)
+    for n in range(1, MAXN + 1):
+        hypngrams = ngrams(hyp, n)
+        stats[MATCHES + n - 1] = sum((hypngrams & ngrams(ref, n)).values())
+        stats[NGRAMS + n - 1] = sum(hypngrams.values())
+    return stats
+
+def statistics(hyplines, reflines, preservecase=False):
+    """Returns the statistics of all segments, an array with one row per segment"""
+    vocabulary = {}
+    hyps = encode(hyplines, vocabulary, preservecase)
+    refs = encode(reflines, vocabulary, preservecase)
+    if len(hyps) != len(refs):
+        raise ValueError("Hypothesis and reference differ in length: " + str(len(hyps)) + " vs " + str(len(refs)) + " segments")
+    return np.array([ segmentstatistics(hyp, ref) for hyp, ref in zip(hyps, refs) ], dtype=np.int64).reshape(-1, COLUMNS)
+
+def scores(totals):
+    """Computes the scores from summed statistics. Totals may also be a 2D array with one row of totals per bootstrap sample,
+    the scores are then arrays as well"""
+    totals = np.asarray(totals, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precisions = totals[..., MATCHES:MATCHES+MAXN] / totals[..., NGRAMS:NGRAMS+MAXN]
+        precscore = np.exp(np.mean(np.log(precisions), axis=-1))
+        ratio = totals[..., REFLEN] / totals[..., HYPLEN]
+        brevitypenalty = np.where(ratio > 1, np.exp(1 - ratio), 1.0)
+        return {
+            "WER": 100 * totals[..., WORDERRORS] / totals[..., REFLEN],
+            "PER": 100 * totals[..., POSERRORS] / totals[..., REFLEN],
+            "BLEU": np.nan_to_num(precscore * brevitypenalty),
+            "PrecScore": np.nan_to_num(precscore),
+            "BrevityPenalty": brevitypenalty,
+            "Ref2SysLen": ratio,
+            "precisions": np.nan_to_num(precisions),
+        }
+
+def bootstrapsample(job):
+    """Draws a number of bootstrap samples (segments resampled with replacement), returns the WER, PER and BLEU of each"""
+    stats, samples, seed = job
+    rng = np.random.default_rng(seed)
+    results = scores(np.stack([ stats[rng.integers(0, len(stats), len(stats))].sum(axis=0) for _ in range(samples) ]))
+    return results['WER'], results['PER'], results['BLEU']
+
+def bootstrap(stats, samples=1000, confidence=0.95, workers=None, seed=0):
+    """Computes bootstrap confidence intervals for WER, PER and BLEU, the samples are divided over worker processes.
+    Returns a dictionary mapping each metric to a (low, high) tuple"""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    chunks = [ samples // workers + (1 if i < samples % workers else 0) for i in range(workers) ]
+    jobs = [ (stats, chunk, (seed, i)) for i, chunk in enumerate(chunks) if chunk ]
+    if len(jobs) > 1:
+        with multiprocessing.Pool(len(jobs)) as pool:
+            results = pool.map(bootstrapsample, jobs)
+    else:
+        results = [ bootstrapsample(job) for job in jobs ]
+    intervals = {}
+    for i, metric in enumerate(("WER", "PER", "BLEU")):
+        values = np.concatenate([ result[i] for result in results ])
+        low, high = np.percentile(values, [ 100 * (1 - confidence) / 2, 100 * (1 + confidence) / 2 ])
+        intervals[metric] = (float(low), float(high))
+    return intervals
+
+def evaluate(hyplines, reflines, preservecase=False, samples=1000, confidence=0.95, workers=None, seed=0):
+    """Evaluates hypothesis lines against reference lines, returns a dictionary with the scores (and the confidence
+    intervals, unless samples is 0)"""
+    stats = statistics(hyplines, reflines, preservecase)
+    totals = stats.sum(axis=0)
+    results = scores(totals)
+    report = {
+        "segments": len(stats),
+        "syswords": int(totals[HYPLEN]),
+        "refwords": int(totals[REFLEN]),
+        "WER": float(results['WER']),
+        "PER": float(results['PER']),
+        "BLEU": float(results['BLEU']),
+        "PrecScore": float(results['PrecScore']),
+        "BrevityPenalty": float(results['BrevityPenalty']),
+        "Ref2SysLen": float(results['Ref2SysLen']),
+        "precisions": [ float(precision) for precision in results['precisions'] ],
+    }
+    if samples and len(stats):
+        report['confidence'] = confidence
+        report['intervals'] = bootstrap(stats, samples, confidence, workers, seed)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluates MT output against a reference translation (plain text, one segment per line): WER, PER and BLEU, with bootstrap confidence intervals. Scores match those of the mtevalscripts", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('hypothesis', type=str,help="MT output (plain text, one segment per line)")
+    parser.add_argument('reference', type=str,help="Reference translation (plain text, one segment per line)")
+    parser.add_argument('-c','--case', help="Case-sensitive evaluation", action='store_true',default=False,required=False)
+    parser.add_argument('-b','--bootstrap', type=int,help="Number of bootstrap samples for the confidence intervals (0 to disable)", action='store',default=1000,required=False)
+    parser.add_argument('--confidence', type=float,help="Confidence level of the intervals", action='store',default=0.95,required=False)
+    parser.add_argument('-j','--workers', type=int,help="Number of worker processes for the bootstrap (defaults to the number of CPUs)", action='store',default=None,required=False)
+    parser.add_argument('--seed', type=int,help="Random seed for the bootstrap", action='store',default=0,required=False)
+    parser.add_argument('--json', help="Output JSON", action='store_true',default=False,required=False)
+    args = parser.parse_args()
+
+    with open(args.hypothesis,'r',encoding='utf-8') as f:
+        hyplines = f.readlines()
+    with open(args.reference,'r',encoding='utf-8') as f:
+        reflines = f.readlines()
+    try:
+        report = evaluate(hyplines, reflines, args.case, args.bootstrap, args.confidence, args.workers, args.seed)
+    except ValueError as e:
+        print("ERROR: " + str(e),file=sys.stderr)
+        sys.exit(2)
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+    print("SegsScored," + str(report['segments']))
+    print("SysWords," + str(report['syswords']))
+    print("Ref2SysLen,%.4f" % report['Ref2SysLen'])
+    for n, precision in enumerate(report['precisions'], 1):
+        print("%d-gPrec,%.4f" % (n, precision))
+    print("PrecScore,%.4f" % report['PrecScore'])
+    print("BrevityPenalty,%.4f" % report['BrevityPenalty'])
+    print("BLEUr1n4,%.4f" % report['BLEU'])
+    print("WER,%.4f" % report['WER'])
+    print("PER,%.4f" % report['PER'])
+    if 'intervals' in report:
+        for metric, (low, high) in report['intervals'].items():
+            print(metric + "-CI%d,%.4f,%.4f" % (round(report['confidence'] * 100), low, high))
+
+if __name__ == '__main__':
+    main()
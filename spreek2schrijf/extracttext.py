@@ -9,11 +9,18 @@ from spreek2schrijf.formats import CXMLDoc
 def main():
     parser = argparse.ArgumentParser(description="Extract text from Conversational XML", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-i','--inputdir', type=str,help="Input directory", action='store',default=".",required=False)
+    parser.add_argument('-b','--begin', type=int,help="Only extract the sentences from this time onward (in milliseconds)", action='store',default=None,required=False)
+    parser.add_argument('-e','--end', type=int,help="Only extract the sentences up to this time (in milliseconds)", action='store',default=None,required=False)
+    parser.add_argument('-C','--cache', help="Store the turn index used for --begin/--end in a file alongside each XML file (*.s2sindex) and reuse it as long as the XML file is unchanged", action='store_true',default=False,required=False)
     args = parser.parse_args()
 
     for filename in glob.glob(args.inputdir + "/*.xml"):
         print(os.path.basename(filename),file=sys.stderr)
-        doc = CXMLDoc(filename)
+        if args.begin is not None or args.end is not None:
+            #only the turns in the time range are parsed, using the turn index
+            doc = CXMLDoc(filename, lazy=True).timerange(args.begin, args.end, args.cache)
+        else:
+            doc = CXMLDoc(filename)
         for text in doc:
             print(text)
 
@@ -1,16 +1,42 @@
 
 import sys
+import os
+import re
+import json
+import numpy as np
 import lxml.etree
+from spreek2schrijf.vocabulary import Vocabulary
 
 class AudioDoc:
-    def __init__(self, filename):
-        self.doc = lxml.etree.parse(filename).getroot()
+    def __init__(self, filename, stream=False):
+        """If stream is set, the document is not loaded in memory but parsed incrementally on iteration (see iterparse())"""
+        self.filename = filename
+        if stream:
+            self.doc = None
+        else:
+            self.doc = lxml.etree.parse(filename).getroot()
 
     def __iter__(self):
-        for node in self.doc.xpath('//Word'):
-            starttime = int(float(node.attrib['stime'])*1000)
-            endtime = starttime + int(float(node.attrib['dur'])*1000)
-            yield node.text.strip(), starttime, endtime
+        if self.doc is None:
+            yield from self.iterparse()
+        else:
+            for node in self.doc.xpath('//Word'):
+                yield self.parseword(node)
+
+    def iterparse(self):
+        """Streams the (word, start_ms, end_ms) tuples from file, elements are discarded as soon as they are read so memory use is constant"""
+        for _, node in lxml.etree.iterparse(self.filename, events=('end',), tag='Word'):
+            yield self.parseword(node)
+            node.clear()
+            #drop the processed words from the parent as well
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+
+    @staticmethod
+    def parseword(node):
+        starttime = int(float(node.attrib['stime'])*1000)
+        endtime = starttime + int(float(node.attrib['dur'])*1000)
+        return node.text.strip(), starttime, endtime
 
 class SimplifiedVLOSDoc:
     def __init__(self, filename):
@@ -22,34 +48,351 @@ class SimplifiedVLOSDoc:
                 yield alinea.text.strip()
 
 class CXMLDoc:
-    def __init__(self, filename):
-        self.doc = lxml.etree.parse(filename).getroot()
+    def __init__(self, filename, lazy=False):
+        """If lazy is set, the document is only parsed when it is iterated over, time range queries (see timerange()) then
+        only parse the turns they need"""
+        self.filename = filename
+        if lazy:
+            self.doc = None
+        else:
+            self.doc = lxml.etree.parse(filename).getroot()
+        self.index = None
+
+    def __iter__(self):
+        doc = self.doc if self.doc is not None else lxml.etree.parse(self.filename).getroot()
+        for turn in doc.xpath('//turn'):
+            yield from self.parseturn(turn)
+
+    @staticmethod
+    def parseturn(turn):
+        """Yields the (sentence, start_ms, end_ms) tuples of a single turn element"""
+        turnstarttime = int(turn.attrib['recordingTime'])
+        for transcription in turn.xpath('.//transcription'):
+            text = []
+            words = list(transcription.xpath('.//word'))
+            for i, word in enumerate(words):
+                if not text:
+                    starttime = turnstarttime +  int(word.attrib['startMs'])
+                endtime = starttime + int(word.attrib['endMs'])
+                EOS = (i == len(words))
+                if "non-verbal" not in word.attrib or word.attrib['non-verbal'] == 'false':
+                    if "prefix" in word.attrib:
+                        text.append(word.attrib['prefix'].strip())
+                    wordtext = "".join([ textnode.text for textnode in word.xpath('.//text') if textnode.text ]).strip()
+                    if not wordtext:
+                        print("WARNING: Empty word detected, skipping..!",file=sys.stderr)
+                        #print(lxml.etree.tostring(word),file=sys.stderr)
+                    else:
+                        text.append(wordtext)
+                    if "postfix" in word.attrib:
+                        if word.attrib['postfix'][-1] in ('.','?','!'):
+                            #end of sentence
+                            text.append(word.attrib['postfix'].strip())
+                            EOS = True
+                if EOS:
+                    yield " ".join(text), starttime, endtime
+                    text = []
+
+    def turnindex(self, cache=False):
+        """Returns the turn index of the document (see TurnIndex), built on first use"""
+        if self.index is None:
+            self.index = TurnIndex.load(self.filename, cache)
+        return self.index
+
+    def turn(self, index, cache=False):
+        """Returns the (sentence, start_ms, end_ms) tuples of the turn with the given index (in document order), only that
+        turn is parsed"""
+        return list(self.parseturn(self.turnindex(cache).read(index)))
+
+    def timerange(self, begin=None, end=None, cache=False):
+        """Yields the (sentence, start_ms, end_ms) tuples that overlap the given time range (in milliseconds, either bound
+        may be None), in document order, the same tuples a full iteration yields. Only the turns that overlap the range are
+        parsed"""
+        index = self.turnindex(cache)
+        for i in index.overlapping(begin, end):
+            for sentence, starttime, endtime in self.parseturn(index.read(int(i))):
+                if (end is None or starttime < end) and (begin is None or endtime > begin):
+                    yield sentence, starttime, endtime
+
+
+TURNPATTERN = re.compile(rb'<turn[\s/>]')
+TURNEND = b'</turn>'
+XMLENCODING = re.compile(rb'<\?xml[^>]*encoding=["\']([A-Za-z0-9._-]+)["\']')
+
+class TurnIndex:
+    """Index of the turns in a Conversational XML file: the byte offset and length of every turn element, its recordingTime
+    and the time span of its sentences. Turns can then be parsed individually, without parsing the whole file"""
+
+    def __init__(self, filename, offsets, lengths, recordingtimes, starttimes, endtimes):
+        self.filename = filename
+        self.offsets = offsets
+        self.lengths = lengths
+        self.recordingtimes = recordingtimes
+        self.starttimes = starttimes #earliest sentence start per turn (the recordingTime if there are no sentences)
+        self.endtimes = endtimes #latest sentence end per turn (likewise)
+        #turns are parsed as fragments, without the XML declaration, so the encoding has to be passed explicitly
+        with open(filename,'rb') as f:
+            match = XMLENCODING.match(f.read(1024))
+        self.parser = lxml.etree.XMLParser(encoding=match.group(1).decode('ascii') if match else None)
+
+    @classmethod
+    def build(cls, filename):
+        """Builds the index with a single scan over the file (every turn is parsed once to obtain its time span)"""
+        with open(filename,'rb') as f:
+            data = f.read()
+        index = cls(filename, [], [], [], [], [])
+        pos = 0
+        while True:
+            match = TURNPATTERN.search(data, pos)
+            if match is None:
+                break
+            begin = match.start()
+            tagend = data.index(b'>', begin)
+            if data[tagend-1:tagend] == b'/':
+                end = tagend + 1 #empty turn
+            else:
+                end = data.index(TURNEND, tagend) + len(TURNEND)
+            turn = lxml.etree.fromstring(data[begin:end], index.parser)
+            recordingtime = int(turn.attrib['recordingTime'])
+            times = [ (starttime, endtime) for _, starttime, endtime in CXMLDoc.parseturn(turn) ]
+            index.offsets.append(begin)
+            index.lengths.append(end - begin)
+            index.recordingtimes.append(recordingtime)
+            index.starttimes.append(min(starttime for starttime, _ in times) if times else recordingtime)
+            index.endtimes.append(max(endtime for _, endtime in times) if times else recordingtime)
+            pos = end
+        index.offsets = np.array(index.offsets, dtype=np.int64)
+        index.lengths = np.array(index.lengths, dtype=np.int64)
+        index.recordingtimes = timearray(index.recordingtimes)
+        index.starttimes = timearray(index.starttimes)
+        index.endtimes = timearray(index.endtimes)
+        return index
+
+    @classmethod
+    def load(cls, filename, cache=False):
+        """Loads the index of a Conversational XML file. If cache is set, the index is stored alongside it (*.s2sindex) and
+        reused as long as the XML file is unchanged"""
+        cachefile = filename + ".s2sindex"
+        if cache:
+            cached = loadcache(cachefile, filename, "turnindex")
+            if cached is not None:
+                _, arrays = cached
+                return cls(filename, arrays['offsets'], arrays['lengths'], arrays['recordingtimes'], arrays['starttimes'], arrays['endtimes'])
+        index = cls.build(filename)
+        if cache:
+            try:
+                savecache(cachefile, filename, "turnindex", [], {"offsets": index.offsets, "lengths": index.lengths, "recordingtimes": index.recordingtimes, "starttimes": index.starttimes, "endtimes": index.endtimes})
+            except OSError as e:
+                print("WARNING: Unable to write index " + cachefile + ": " + str(e),file=sys.stderr)
+        return index
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def overlapping(self, begin=None, end=None):
+        """Returns the indices of the turns whose sentences overlap the given time range (in milliseconds)"""
+        mask = np.ones(len(self), dtype=bool)
+        if end is not None:
+            mask &= np.asarray(self.starttimes) < end
+        if begin is not None:
+            mask &= np.asarray(self.endtimes) > begin
+        return np.flatnonzero(mask)
+
+    def read(self, index):
+        """Reads and parses the turn with the given index, returns the turn element"""
+        with open(self.filename,'rb') as f:
+            f.seek(int(self.offsets[index]))
+            return lxml.etree.fromstring(f.read(int(self.lengths[index])), self.parser)
+
+
+def iterjsonarray(f, chunksize=1024*1024):
+    """Incrementally yields the items of the first JSON array in a text stream (such as the sentence pairs in the aligner output),
+    without loading the whole document. Items are expected to be objects, arrays or strings."""
+    decoder = json.JSONDecoder()
+    #find the start of the array
+    while True:
+        buffer = f.read(chunksize)
+        if not buffer:
+            return
+        pos = buffer.find('[')
+        if pos != -1:
+            pos += 1
+            break
+    eof = False
+    while True:
+        #skip whitespace and separators
+        pos = JSONSEPARATORS.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+        try:
+            if pos == len(buffer):
+                raise ValueError("Buffer exhausted")
+            item, pos = decoder.raw_decode(buffer, pos)
+        except ValueError:
+            #incomplete item, read more data
+            if eof:
+                raise
+            chunk = f.read(chunksize)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+        yield item
+
+JSONSEPARATORS = re.compile(r'[\s,]*')
+
+
+CACHEMAGIC = b"S2SCACHE1\n"
+CACHEALIGN = 64
+
+def timearray(times):
+    """Returns the times (in milliseconds) as an int32 array, or as int64 if they do not fit"""
+    times = np.asarray(times, dtype=np.int64)
+    if len(times) and (times.min() < np.iinfo(np.int32).min or times.max() > np.iinfo(np.int32).max):
+        return times
+    return times.astype(np.int32)
+
+def savecache(filename, sourcefile, kind, vocabulary, arrays):
+    """Saves arrays and a vocabulary to a cache file, the arrays can be memory-mapped on load. The cache is tied to the size and modification time of the source file"""
+    stat = os.stat(sourcefile)
+    header = {"kind": kind, "source": [stat.st_size, stat.st_mtime_ns], "vocabulary": vocabulary, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = [array.dtype.str, len(array), offset]
+        offset += -(-array.nbytes // CACHEALIGN) * CACHEALIGN
+    headerdata = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    start = -(-(len(CACHEMAGIC) + 8 + len(headerdata)) // CACHEALIGN) * CACHEALIGN
+    #write to a temporary file first so concurrent readers never see a partial cache
+    tmpfilename = filename + "." + str(os.getpid()) + ".tmp"
+    with open(tmpfilename,'wb') as f:
+        f.write(CACHEMAGIC)
+        f.write(len(headerdata).to_bytes(8,'little'))
+        f.write(headerdata)
+        for name, array in arrays.items():
+            f.seek(start + header['arrays'][name][2])
+            f.write(np.ascontiguousarray(array).tobytes())
+        f.truncate(start + offset)
+    os.replace(tmpfilename, filename)
+
+def loadcache(filename, sourcefile, kind):
+    """Loads a cache file saved by savecache(), returns (vocabulary, arrays) with memory-mapped arrays, or None if there is no valid cache for the source file"""
+    try:
+        stat = os.stat(sourcefile)
+        with open(filename,'rb') as f:
+            if f.read(len(CACHEMAGIC)) != CACHEMAGIC:
+                return None
+            headerlength = int.from_bytes(f.read(8),'little')
+            header = json.loads(f.read(headerlength).decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    if header['kind'] != kind or header['source'] != [stat.st_size, stat.st_mtime_ns]:
+        return None
+    start = -(-(len(CACHEMAGIC) + 8 + headerlength) // CACHEALIGN) * CACHEALIGN
+    arrays = {}
+    for name, (dtype, length, offset) in header['arrays'].items():
+        if length:
+            arrays[name] = np.memmap(filename, dtype=np.dtype(dtype), mode='r', offset=start+offset, shape=(length,))
+        else:
+            arrays[name] = np.zeros(0, dtype=np.dtype(dtype))
+    return header['vocabulary'], arrays
+
+
+class CompactAudioDoc:
+    """Columnar representation of an AudioDoc: interned word IDs with int32 start and end time arrays. Iterates over the same (word, start_ms, end_ms) tuples"""
+
+    def __init__(self, vocabulary, wordids, starttimes, endtimes):
+        self.vocabulary = vocabulary #list of words, indexed by word ID
+        self.wordids = wordids
+        self.starttimes = starttimes
+        self.endtimes = endtimes
+
+    @classmethod
+    def fromdoc(cls, doc):
+        vocabulary = Vocabulary(lowercase=False)
+        wordids, starttimes, endtimes = [], [], []
+        for word, starttime, endtime in doc:
+            wordids.append(vocabulary.add(word))
+            starttimes.append(starttime)
+            endtimes.append(endtime)
+        return cls(vocabulary.words, np.array(wordids, dtype=np.int32), timearray(starttimes), timearray(endtimes))
+
+    @classmethod
+    def load(cls, filename, cache=False):
+        """Loads an AudioDoc XML file. If cache is set, a cache file is stored alongside it and reused as long as the XML file is unchanged"""
+        cachefile = filename + ".s2scache"
+        if cache:
+            cached = loadcache(cachefile, filename, "audiodoc")
+            if cached is not None:
+                vocabulary, arrays = cached
+                return cls(vocabulary, arrays['wordids'], arrays['starttimes'], arrays['endtimes'])
+        doc = cls.fromdoc(AudioDoc(filename, stream=True))
+        if cache:
+            try:
+                savecache(cachefile, filename, "audiodoc", doc.vocabulary, {"wordids": doc.wordids, "starttimes": doc.starttimes, "endtimes": doc.endtimes})
+            except OSError as e:
+                print("WARNING: Unable to write cache " + cachefile + ": " + str(e),file=sys.stderr)
+        return doc
+
+    def words(self, begin=0, end=None):
+        """Returns the words in the given range as a list of strings"""
+        return [ self.vocabulary[id] for id in self.wordids[begin:end].tolist() ]
+
+    def __len__(self):
+        return len(self.wordids)
+
+    def __getitem__(self, index):
+        return self.vocabulary[self.wordids[index]], int(self.starttimes[index]), int(self.endtimes[index])
+
+    def __iter__(self):
+        for id, starttime, endtime in zip(self.wordids.tolist(), self.starttimes.tolist(), self.endtimes.tolist()):
+            yield self.vocabulary[id], starttime, endtime
+
+
+class CompactTranscriptDoc:
+    """Columnar representation of a CXMLDoc: interned token IDs, sentence boundaries as an offset array, and int32 sentence start and end times. Iterates over the same (sentence, start_ms, end_ms) tuples"""
+
+    def __init__(self, vocabulary, tokenids, offsets, starttimes, endtimes):
+        self.vocabulary = vocabulary #list of tokens, indexed by token ID
+        self.tokenids = tokenids
+        self.offsets = offsets #sentence i consists of tokenids[offsets[i]:offsets[i+1]]
+        self.starttimes = starttimes
+        self.endtimes = endtimes
+
+    @classmethod
+    def fromdoc(cls, doc):
+        vocabulary = Vocabulary(lowercase=False)
+        tokenids, offsets, starttimes, endtimes = [], [0], [], []
+        for sentence, starttime, endtime in doc:
+            tokenids += [ vocabulary.add(token) for token in sentence.split(' ') ]
+            offsets.append(len(tokenids))
+            starttimes.append(starttime)
+            endtimes.append(endtime)
+        return cls(vocabulary.words, np.array(tokenids, dtype=np.int32), np.array(offsets, dtype=np.int64), timearray(starttimes), timearray(endtimes))
+
+    @classmethod
+    def load(cls, filename, cache=False):
+        """Loads a Conversational XML file. If cache is set, a cache file is stored alongside it and reused as long as the XML file is unchanged"""
+        cachefile = filename + ".s2scache"
+        if cache:
+            cached = loadcache(cachefile, filename, "cxmldoc")
+            if cached is not None:
+                vocabulary, arrays = cached
+                return cls(vocabulary, arrays['tokenids'], arrays['offsets'], arrays['starttimes'], arrays['endtimes'])
+        doc = cls.fromdoc(CXMLDoc(filename))
+        if cache:
+            try:
+                savecache(cachefile, filename, "cxmldoc", doc.vocabulary, {"tokenids": doc.tokenids, "offsets": doc.offsets, "starttimes": doc.starttimes, "endtimes": doc.endtimes})
+            except OSError as e:
+                print("WARNING: Unable to write cache " + cachefile + ": " + str(e),file=sys.stderr)
+        return doc
+
+    def tokens(self, index):
+        """Returns the tokens of the sentence with the given index"""
+        return [ self.vocabulary[id] for id in self.tokenids[self.offsets[index]:self.offsets[index+1]].tolist() ]
+
+    def __len__(self):
+        return len(self.starttimes)
 
     def __iter__(self):
-        for turn in self.doc.xpath('//turn'):
-            turnstarttime = int(turn.attrib['recordingTime'])
-            for transcription in turn.xpath('.//transcription'):
-                text = []
-                words = list(transcription.xpath('.//word'))
-                for i, word in enumerate(words):
-                    if not text:
-                        starttime = turnstarttime +  int(word.attrib['startMs'])
-                    endtime = starttime + int(word.attrib['endMs'])
-                    EOS = (i == len(words))
-                    if "non-verbal" not in word.attrib or word.attrib['non-verbal'] == 'false':
-                        if "prefix" in word.attrib:
-                            text.append(word.attrib['prefix'].strip())
-                        wordtext = "".join([ textnode.text for textnode in word.xpath('.//text') if textnode.text ]).strip()
-                        if not wordtext:
-                            print("WARNING: Empty word detected, skipping..!",file=sys.stderr)
-                            #print(lxml.etree.tostring(word),file=sys.stderr)
-                        else:
-                            text.append(wordtext)
-                        if "postfix" in word.attrib:
-                            if word.attrib['postfix'][-1] in ('.','?','!'):
-                                #end of sentence
-                                text.append(word.attrib['postfix'].strip())
-                                EOS = True
-                    if EOS:
-                        yield " ".join(text), starttime, endtime
-                        text = []
+        for i, (starttime, endtime) in enumerate(zip(self.starttimes.tolist(), self.endtimes.tolist())):
+            yield " ".join(self.tokens(i)), starttime, endtime
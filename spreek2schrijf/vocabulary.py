@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import numpy as np
+import Levenshtein
+
+
+class Vocabulary:
+    """Maps lowercased tokens (or tokens as-is if lowercase is False) to integer IDs"""
+
+    def __init__(self, words=(), lowercase=True):
+        self.ids = {}
+        self.words = []
+        self.lowercase = lowercase
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """Adds a word (if it is new) and returns its ID"""
+        key = word.lower() if self.lowercase else word
+        try:
+            return self.ids[key]
+        except KeyError:
+            self.ids[key] = len(self.words)
+            self.words.append(key)
+            return self.ids[key]
+
+    def encode(self, words):
+        """Returns an array with the IDs of the given words, unknown words are added"""
+        return np.array([ self.add(word) for word in words ], dtype=int)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return (word.lower() if self.lowercase else word) in self.ids
+
+    def __getitem__(self, id):
+        return self.words[id]
+
+
+def deletions(word, n):
+    """Returns the set of all strings that can be obtained by deleting up to n characters from the word (including the word itself)"""
+    variants = {word}
+    layer = {word}
+    for _ in range(n):
+        layer = { variant[:i] + variant[i+1:] for variant in layer for i in range(len(variant)) }
+        variants |= layer
+    return variants
+
+
+class NeighbourIndex:
+    """Table of all pairs of vocabulary words that aligner.wordmatch() considers a match, so matching becomes a set lookup.
+
+    Candidate pairs are found SymSpell-style: two words within n edits share a string that can be obtained by deleting at most n
+    characters from each. Candidates are then verified with the same length and Levenshtein rules as wordmatch()."""
+
+    def __init__(self, vocabulary, threshold=2):
+        self.vocabulary = vocabulary
+        self.threshold = threshold
+        self.deletions = {} #deletion variant -> IDs of the words that produce it
+        self.neighbours = [] #ID -> set of IDs of matching words (other than the word itself)
+        self.update()
+
+    def update(self):
+        """Indexes the words that were added to the vocabulary since the last update"""
+        words = self.vocabulary.words
+        for id in range(len(self.neighbours), len(words)):
+            word = words[id]
+            self.neighbours.append(set())
+            if len(word) <= self.threshold + 2:
+                #short words only ever match themselves
+                continue
+            candidates = set()
+            for variant in deletions(word, self.threshold):
+                bucket = self.deletions.setdefault(variant, [])
+                candidates.update(bucket)
+                bucket.append(id)
+            for other in candidates:
+                otherword = words[other]
+                if abs(len(word) - len(otherword)) <= self.threshold and Levenshtein.distance(word, otherword) <= self.threshold:
+                    self.neighbours[id].add(other)
+                    self.neighbours[other].add(id)
+
+    def match(self, id1, id2):
+        """Does the word with ID id1 match the word with ID id2?"""
+        return id1 == id2 or id2 in self.neighbours[id1]
+
+    def wordmatch(self, s1, s2):
+        """Same as aligner.wordmatch(), but a lookup (unknown words are added to the vocabulary)"""
+        id1 = self.vocabulary.add(s1)
+        id2 = self.vocabulary.add(s2)
+        self.update()
+        return self.match(id1, id2)
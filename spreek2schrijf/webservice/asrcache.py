@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+#Content-addressed cache of ASR results. The key is a hash of the audio as normalised by the conversion step (16kHz mono
+#16-bit PCM, so the same recording uploaded as WAV, MP3 or OGG maps onto the same entry, the container and header are
+#ignored) together with an identifier of the ASR model. Entries hold the CTM (1Best.ctm) and the transcription.
+
+import sys
+import os
+import json
+import time
+import wave
+import fcntl
+import shutil
+import hashlib
+import argparse
+import contextlib
+
+CHUNKSIZE = 65536 #frames
+CTMFILE = "1Best.ctm"
+TXTFILE = "transcription.txt"
+METAFILE = "meta.json"
+
+
+def audiohash(wavfile):
+    """Hashes the PCM frames (and format) of a WAV file"""
+    h = hashlib.sha256()
+    with contextlib.closing(wave.open(wavfile,'rb')) as f:
+        h.update(("%d:%d:%d\n" % (f.getnchannels(), f.getsampwidth(), f.getframerate())).encode('ascii'))
+        while True:
+            frames = f.readframes(CHUNKSIZE)
+            if not frames:
+                break
+            h.update(frames)
+    return h.hexdigest()
+
+def kaldimodelid(kaldi_nl):
+    """Identifies the ASR model of a Kaldi_NL installation: the decode script plus the size and modification time of all
+    model files"""
+    h = hashlib.sha1()
+    with open(os.path.join(kaldi_nl, "decode_PR.sh"),'rb') as f:
+        h.update(f.read())
+    for root, dirs, files in os.walk(os.path.join(kaldi_nl, "models"), followlinks=True):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            if os.path.exists(path):
+                stat = os.stat(path)
+                h.update((os.path.relpath(path, kaldi_nl) + ":" + str(stat.st_size) + ":" + str(stat.st_mtime_ns) + "\n").encode('utf-8'))
+    return h.hexdigest()
+
+def renameid(line, oldid, newid, ctm=False):
+    """Replaces the file ID in the first field of a CTM line (if ctm is set), or in the utterance ID between the trailing
+    brackets of a transcription line"""
+    if ctm:
+        if line.startswith(oldid + " "):
+            return newid + line[len(oldid):]
+        return line
+    text, bracket, utterance = line.rpartition('(')
+    if bracket and utterance.rstrip().endswith(')'):
+        return text + bracket + utterance.replace(oldid, newid, 1)
+    return line
+
+
+class ASRCache:
+    """Directory of ASR results, one subdirectory per key. The cache is shared by concurrent jobs, so all modifications happen
+    under an exclusive lock (fcntl) on a lock file in the cache directory. Entries are evicted least recently used first
+    (by the modification time of the entry, which is updated on every hit) once the total size exceeds maxsize bytes"""
+
+    def __init__(self, directory, maxsize=None):
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self.lockfile = os.path.join(directory, ".lock")
+        self.statisticsfile = os.path.join(directory, "statistics.json")
+
+    @contextlib.contextmanager
+    def lock(self):
+        with open(self.lockfile,'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @staticmethod
+    def key(wavfile, model):
+        return hashlib.sha256((model + ":" + audiohash(wavfile)).encode('ascii')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def fetch(self, key, target_dir, file_id):
+        """Copies the cached results to the target directory, as Kaldi_NL would have written them (1Best.ctm and
+        {file_id}.txt). Returns True on a hit, False on a miss"""
+        with self.lock():
+            entry = self.path(key)
+            hit = os.path.exists(os.path.join(entry, METAFILE))
+            if hit:
+                with open(os.path.join(entry, METAFILE),'r',encoding='utf-8') as f:
+                    oldid = json.load(f)['file_id']
+                for source, target, ctm in ((CTMFILE, CTMFILE, True), (TXTFILE, file_id + ".txt", False)):
+                    with open(os.path.join(entry, source),'r',encoding='utf-8') as f_in:
+                        with open(os.path.join(target_dir, target),'w',encoding='utf-8') as f_out:
+                            for line in f_in:
+                                f_out.write(renameid(line, oldid, file_id, ctm))
+                os.utime(entry)
+            self.count(hit)
+        return hit
+
+    def store(self, key, source_dir, file_id):
+        """Stores the results in the source directory (as written by Kaldi_NL) under the given key, then evicts entries if
+        the cache is too large"""
+        entry = self.path(key)
+        tmpentry = entry + "." + str(os.getpid()) + ".tmp"
+        os.makedirs(tmpentry, exist_ok=True)
+        try:
+            shutil.copyfile(os.path.join(source_dir, CTMFILE), os.path.join(tmpentry, CTMFILE))
+            shutil.copyfile(os.path.join(source_dir, file_id + ".txt"), os.path.join(tmpentry, TXTFILE))
+            with open(os.path.join(tmpentry, METAFILE),'w',encoding='utf-8') as f:
+                json.dump({"file_id": file_id, "stored": time.time()}, f)
+            with self.lock():
+                if os.path.exists(entry):
+                    shutil.rmtree(entry)
+                os.rename(tmpentry, entry)
+                self.evict()
+        finally:
+            shutil.rmtree(tmpentry, ignore_errors=True)
+
+    def entries(self):
+        """Returns a list of (modification time, size in bytes, path) tuples for all entries"""
+        entries = []
+        for prefix in os.listdir(self.directory):
+            prefixdir = os.path.join(self.directory, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefixdir):
+                continue
+            for name in os.listdir(prefixdir):
+                entry = os.path.join(prefixdir, name)
+                if name.endswith(".tmp") or not os.path.exists(os.path.join(entry, METAFILE)):
+                    continue
+                size = sum( os.path.getsize(os.path.join(entry, filename)) for filename in os.listdir(entry) )
+                entries.append((os.path.getmtime(entry), size, entry))
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits in maxsize (to be called with the lock held).
+        Returns the number of entries removed"""
+        if not self.maxsize:
+            return 0
+        entries = sorted(self.entries())
+        total = sum( size for _, size, _ in entries )
+        removed = 0
+        for _, size, entry in entries:
+            if total <= self.maxsize:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def count(self, hit):
+        """Updates the hit and miss counters, for this session and in total (to be called with the lock held)"""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        statistics = self.totals()
+        statistics['hits' if hit else 'misses'] += 1
+        tmpfilename = self.statisticsfile + "." + str(os.getpid()) + ".tmp"
+        with open(tmpfilename,'w',encoding='utf-8') as f:
+            json.dump(statistics, f)
+        os.replace(tmpfilename, self.statisticsfile)
+
+    def totals(self):
+        try:
+            with open(self.statisticsfile,'r',encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"hits": 0, "misses": 0}
+
+    def statistics(self):
+        """Returns a dictionary with the cache statistics, for this session and in total"""
+        totals = self.totals()
+        entries = self.entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "totalhits": totals['hits'],
+            "totalmisses": totals['misses'],
+            "totalhitrate": totals['hits'] / (totals['hits'] + totals['misses']) if totals['hits'] + totals['misses'] else 0.0,
+            "entries": len(entries),
+            "size": sum( size for _, size, _ in entries ),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspects or maintains the ASR result cache", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c','--cache', type=str,help="Cache directory", action='store',required=True)
+    parser.add_argument('--maxsize', type=int,help="Evict least recently used entries until the cache is at most this size (in MB)", action='store',default=0,required=False)
+    parser.add_argument('--clear', help="Remove all entries", action='store_true',default=False,required=False)
+    args = parser.parse_args()
+
+    cache = ASRCache(args.cache, args.maxsize * 1024 * 1024)
+    if args.clear:
+        with cache.lock():
+            for _, _, entry in cache.entries():
+                shutil.rmtree(entry, ignore_errors=True)
+    elif args.maxsize:
+        with cache.lock():
+            removed = cache.evict()
+        print("Evicted " + str(removed) + " entries",file=sys.stderr)
+    print(json.dumps(cache.statistics(), indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+#Warm translation backend for synchronous requests (the translate action of the webservice). The decoder, translation cache
+#and post-correction are set up once per process. Concurrent requests are collected into small batches within a short time
+#window, so the decoder gets many sentences per call, and throughput rises with the number of concurrent users.
+
+import sys
+import os
+import time
+import shlex
+import queue
+import argparse
+import tempfile
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from spreek2schrijf.webservice.postcorrect import PostCorrector
+from spreek2schrijf.webservice.segment import Segmenter, rejoin, MAXLENGTH
+from spreek2schrijf.webservice.pipeline import Translator
+
+WINDOW = 0.01 #seconds
+MAXBATCH = 64 #sentences
+
+
+class MicroBatcher:
+    """Collects the sentences of concurrent calls into batches for the backend (a function that translates a list of
+    sentences). A batch is sent once it holds maxbatch sentences, or window seconds after its first request arrived. Up to
+    workers batches are translated at the same time. Every call blocks until its own sentences are translated"""
+
+    def __init__(self, backend, window=WINDOW, maxbatch=MAXBATCH, workers=1):
+        self.backend = backend
+        self.window = window
+        self.maxbatch = maxbatch
+        self.requests = queue.Queue()
+        self.slots = threading.BoundedSemaphore(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.batches = 0
+        self.sentences = 0
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+
+    def __call__(self, sentences):
+        sentences = list(sentences)
+        if not sentences:
+            return []
+        future = Future()
+        self.requests.put((sentences, future))
+        return future.result()
+
+    def _collect(self):
+        stop = False
+        while not stop:
+            request = self.requests.get()
+            if request is None:
+                break
+            deadline = time.monotonic() + self.window
+            batch = [request]
+            size = len(request[0])
+            while size < self.maxbatch:
+                try:
+                    request = self.requests.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                size += len(request[0])
+            #wait for a free worker, requests that arrive in the meantime go into the next batch
+            self.slots.acquire()
+            self.batches += 1
+            self.sentences += sum( len(sentences) for sentences, _ in batch )
+            self.executor.submit(self._translate, batch)
+
+    def _translate(self, batch):
+        try:
+            try:
+                results = self.backend([ sentence for sentences, _ in batch for sentence in sentences ])
+            except Exception as e: #pylint: disable=broad-except
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            i = 0
+            for sentences, future in batch:
+                future.set_result(results[i:i+len(sentences)])
+                i += len(sentences)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        self.requests.put(None)
+        self.collector.join()
+        self.executor.shutdown()
+
+
+class WarmTranslator:
+    """Translates spraak text to postcorrected schrijf text: segmentation, MT through the micro-batcher, post-correction.
+    Safe to call from multiple threads"""
+
+    def __init__(self, translator, corrector=None, maxlength=MAXLENGTH, window=WINDOW, maxbatch=MAXBATCH, workers=1):
+        self.translator = translator
+        self.corrector = corrector
+        self.segmenter = Segmenter(None, maxlength) if maxlength else None
+        self.batcher = MicroBatcher(translator, window, maxbatch, workers)
+
+    @classmethod
+    def fromenvironment(cls, environ=os.environ):
+        """Configures the backend from environment variables (as the webservice wrapper script does for the pipeline).
+        The decoder is, in order of preference: the decoder pool on S2S_DECODER_SOCKET, the command in S2S_DECODER (any
+        command that translates one sentence per line, e.g. for testing), or Moses (S2S_MOSES) with S2S_CONFIG"""
+        s2sdir = environ.get('S2SDIR', os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        socket = environ.get('S2S_DECODER_SOCKET') or None
+        command = shlex.split(environ['S2S_DECODER']) if environ.get('S2S_DECODER') else None
+        translator = Translator(environ.get('S2S_CONFIG', os.path.join(s2sdir, "model", "moses.ini")), environ.get('S2S_MOSES', "moses"),
+            socket=socket, cache=environ.get('S2S_TRANSLATION_CACHE') or None, command=command, scratchdir=environ.get('S2S_SCRATCHDIR', tempfile.gettempdir()))
+        namesfile = environ.get('S2S_NAMES', os.path.join(os.path.dirname(os.path.abspath(__file__)), "namen.txt"))
+        corrector = PostCorrector.fromfile(namesfile, log=None) if namesfile else None
+        return cls(translator, corrector,
+            maxlength=int(environ.get('S2S_MAXLENGTH', MAXLENGTH)),
+            window=float(environ.get('S2S_BATCH_WINDOW', WINDOW)),
+            maxbatch=int(environ.get('S2S_BATCH_SIZE', MAXBATCH)),
+            workers=int(environ.get('S2S_MT_WORKERS', 1)))
+
+    def translate(self, lines):
+        """Translates a list of lines, returns the list of translated and postcorrected lines"""
+        lines = [ line.strip() for line in lines ]
+        if self.segmenter is not None:
+            linemap, segments = [], []
+            for linenr, segment in self.segmenter(lines):
+                linemap.append(linenr)
+                segments.append(segment)
+            translations = rejoin(self.batcher(segments), linemap, len(lines))
+        else:
+            translations = self.batcher(lines)
+        if self.corrector is not None:
+            return list(self.corrector.correct(translations))
+        return translations
+
+    def __call__(self, text):
+        """Translates text (one sentence per line), returns the translated text"""
+        return "".join( line + "\n" for line in self.translate(text.strip("\n").split("\n")) )
+
+    def close(self):
+        self.batcher.close()
+        self.translator.close()
+
+
+translator = None
+translatorlock = threading.Lock()
+
+def gettranslator():
+    """Returns the warm translator of this process, it is set up on first use"""
+    global translator #pylint: disable=global-statement
+    with translatorlock:
+        if translator is None:
+            translator = WarmTranslator.fromenvironment()
+        return translator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translates standard input (one sentence per line) with the warm translation backend of the translate action, configured from the environment (S2S_DECODER_SOCKET, S2S_DECODER, S2S_CONFIG, S2S_MOSES, S2S_TRANSLATION_CACHE, S2S_NAMES, S2S_BATCH_WINDOW, S2S_BATCH_SIZE, S2S_MT_WORKERS)", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c','--clients', type=int,help="Send every line as a separate request from this many concurrent clients (to exercise the batching)", action='store',default=1,required=False)
+    args = parser.parse_args()
+
+    warm = gettranslator()
+    lines = [ line.rstrip("\n") for line in sys.stdin ]
+    if args.clients > 1:
+        with ThreadPoolExecutor(max_workers=args.clients) as executor:
+            results = list(executor.map(lambda line: warm.translate([line])[0], lines))
+    else:
+        results = warm.translate(lines)
+    for result in results:
+        print(result)
+    print("Batches: " + str(warm.batcher.batches) + ", sentences: " + str(warm.batcher.sentences),file=sys.stderr)
+    warm.close()
+
+if __name__ == '__main__':
+    main()
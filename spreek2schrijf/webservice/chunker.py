@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+#Chunked ASR decoding of long recordings. The normalised WAV is split at low-energy points (pauses) into chunks of bounded
+#length, with a little overlap, the chunks are decoded in parallel and the per-chunk CTMs are merged into one: times are
+#shifted by the chunk offsets, every word is kept only by the chunk whose own (non-overlapping) part contains its midpoint,
+#and words repeated across a boundary are removed. The merged CTM and transcription look like those of a single decoding
+#run, so ctm2txt and ctm2xml apply unchanged. Any decoder with the calling convention of Kaldi_NL's decode_PR.sh (wavfile,
+#target directory; writes 1Best.ctm and {file_id}.txt there) can be used.
+
+import sys
+import os
+import wave
+import shlex
+import shutil
+import argparse
+import contextlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+MAXLENGTH = 300.0 #maximum chunk length (seconds)
+SEARCH = 60.0 #a split point is sought within the last this many seconds of a chunk
+OVERLAP = 1.0 #extra audio on both sides of a chunk (seconds)
+FRAME = 0.02 #energy frame length (seconds)
+PAUSEWINDOW = 0.3 #the energy is smoothed over this length (seconds), so split points fall in pauses rather than between two syllables
+BLOCKSIZE = 16000 * 60 #samples read at once
+
+
+class ChunkError(Exception):
+    pass
+
+
+def frameenergies(wavfile, frame=FRAME):
+    """Computes the RMS energy of every frame of a (16-bit) WAV file, reading it in blocks. Returns (energies, framelength in
+    samples, samplerate)"""
+    with contextlib.closing(wave.open(wavfile,'rb')) as f:
+        if f.getsampwidth() != 2:
+            raise ChunkError("Expected 16-bit audio: " + wavfile)
+        channels = f.getnchannels()
+        samplerate = f.getframerate()
+        framelength = max(1, int(frame * samplerate))
+        energies = []
+        remainder = np.zeros(0, dtype=np.float64)
+        while True:
+            data = f.readframes(BLOCKSIZE)
+            if not data:
+                break
+            samples = np.frombuffer(data, dtype='<i2').astype(np.float64)
+            if channels > 1:
+                samples = samples.reshape(-1, channels).mean(axis=1)
+            samples = np.concatenate((remainder, samples))
+            n = len(samples) // framelength
+            energies.append(np.sqrt(np.mean(samples[:n*framelength].reshape(n, framelength) ** 2, axis=1)))
+            remainder = samples[n*framelength:]
+        if len(remainder):
+            energies.append(np.array([np.sqrt(np.mean(remainder ** 2))]))
+    return (np.concatenate(energies) if energies else np.zeros(0)), framelength, samplerate
+
+def findsplits(energies, framelength, samplerate, maxlength=MAXLENGTH, search=SEARCH, pausewindow=PAUSEWINDOW):
+    """Returns the split points (in samples): wherever the remaining audio is longer than maxlength, the quietest point in the
+    last search seconds before the maximum length"""
+    framespersecond = samplerate / framelength
+    maxframes = max(1, int(maxlength * framespersecond))
+    searchframes = max(1, min(maxframes, int(search * framespersecond)))
+    window = max(1, int(pausewindow * framespersecond))
+    smoothed = np.convolve(energies, np.ones(window) / window, mode='same') if len(energies) >= window else energies
+    splits = []
+    pos = 0
+    while len(energies) - pos > maxframes:
+        begin = pos + maxframes - searchframes
+        split = begin + int(np.argmin(smoothed[begin:pos+maxframes]))
+        if split <= pos:
+            split = pos + maxframes
+        splits.append(split * framelength)
+        pos = split
+    return splits
+
+def writechunks(wavfile, splits, outputdir, file_id, overlap=OVERLAP):
+    """Writes the chunks as WAV files, with overlap seconds of extra audio on both sides. Returns a list of (chunkfile,
+    offset, begin, end) tuples: the offset of the chunk audio and the part of the recording the chunk is responsible for, in
+    seconds"""
+    chunks = []
+    with contextlib.closing(wave.open(wavfile,'rb')) as f:
+        samplerate = f.getframerate()
+        boundaries = [0] + list(splits) + [f.getnframes()]
+        extra = int(overlap * samplerate)
+        for i in range(len(boundaries) - 1):
+            begin = max(0, boundaries[i] - extra)
+            end = min(boundaries[-1], boundaries[i+1] + extra)
+            chunkfile = os.path.join(outputdir, "%s_chunk%04d.wav" % (file_id, i))
+            f.setpos(begin)
+            with contextlib.closing(wave.open(chunkfile,'wb')) as out:
+                out.setparams(f.getparams())
+                remaining = end - begin
+                while remaining > 0:
+                    data = f.readframes(min(BLOCKSIZE, remaining))
+                    if not data:
+                        break
+                    out.writeframes(data)
+                    remaining -= min(BLOCKSIZE, remaining)
+            chunks.append((chunkfile, begin / samplerate, boundaries[i] / samplerate, boundaries[i+1] / samplerate))
+    return chunks
+
+def readchunkctm(ctmfile):
+    """Reads a CTM, returns a list of (fields, starttime, duration) tuples"""
+    words = []
+    with open(ctmfile,'r',encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                fields = line.rstrip("\n").split(" ")
+                words.append((fields, float(fields[2]), float(fields[3])))
+    return words
+
+def mergechunks(results, file_id):
+    """Merges the CTMs and transcriptions of the decoded chunks. Results is a list of (ctmwords, txtlines, offset, begin,
+    end) tuples in chunk order (see readchunkctm()). Returns the merged CTM lines and transcription lines"""
+    ctmlines = []
+    txtlines = []
+    last = None #(word, endtime) of the last word kept
+    for i, (ctmwords, chunktxt, offset, begin, end) in enumerate(results):
+        kept = []
+        first = True
+        for fields, starttime, duration in ctmwords:
+            starttime += offset
+            midpoint = starttime + duration / 2
+            #a word belongs to the chunk whose own part contains its midpoint (the first and last chunk extend to the edges)
+            owned = (i == 0 or midpoint >= begin) and (i == len(results) - 1 or midpoint < end)
+            if owned and first and last is not None and fields[4] == last[0] and starttime < last[1]:
+                owned = False #the same word, recognised on both sides of the boundary
+            kept.append(owned)
+            if owned:
+                first = False
+                ctmlines.append(" ".join([file_id, fields[1], "%.2f" % starttime] + fields[3:]))
+                last = (fields[4], starttime + duration)
+        txtlines += mergetxt(chunktxt, [ fields[4] for fields, _, _ in ctmwords ], kept)
+    return ctmlines, txtlines
+
+def mergetxt(txtlines, ctmwords, kept):
+    """Returns the transcription lines of a chunk ("text (utterance)") without the words that were dropped from its CTM.
+    The words of the transcription are matched to the CTM words in order (the CTM may hold additional filler words); if
+    they can not be matched, a single line with the kept CTM words is returned instead"""
+    lines = []
+    j = 0
+    for line in txtlines:
+        text, bracket, utterance = line.partition('(')
+        tokens = []
+        for token in text.split():
+            while j < len(ctmwords) and ctmwords[j] != token:
+                j += 1
+            if j == len(ctmwords):
+                words = [ word for word, owned in zip(ctmwords, kept) if owned and word != '#' ]
+                return [ " ".join(words) ] if words else []
+            if kept[j]:
+                tokens.append(token)
+            j += 1
+        if tokens:
+            lines.append(" ".join(tokens) + (" " + bracket + utterance if bracket else ""))
+    return lines
+
+
+class CommandDecoder:
+    """Decoder that runs a command with the wavfile and target directory as arguments (the convention of decode_PR.sh)"""
+
+    def __init__(self, command, cwd=None):
+        self.command = command
+        self.cwd = cwd
+
+    def decode(self, wavfile, target_dir):
+        if subprocess.call(self.command + [wavfile, target_dir], cwd=self.cwd) != 0:
+            raise ChunkError("Decoding failed: " + wavfile)
+
+
+class ChunkedASR:
+    """Wraps an ASR step (anything with a decode(wavfile, target_dir) method, such as pipeline.KaldiASR), long recordings are
+    split into chunks that are decoded in parallel by up to workers decoders. Other methods are passed on to the wrapped ASR"""
+
+    def __init__(self, asr, maxlength=MAXLENGTH, workers=1, search=SEARCH, overlap=OVERLAP):
+        self.asr = asr
+        self.maxlength = maxlength
+        self.workers = workers
+        self.search = min(search, maxlength)
+        self.overlap = overlap
+
+    def __getattr__(self, name):
+        return getattr(self.asr, name)
+
+    def modelid(self):
+        #chunking may change the results, so it is part of the model identity (for the ASR cache)
+        return self.asr.modelid() + ":chunked:" + str(self.maxlength)
+
+    def decode(self, wavfile, target_dir):
+        file_id = os.path.splitext(os.path.basename(wavfile))[0]
+        energies, framelength, samplerate = frameenergies(wavfile)
+        splits = findsplits(energies, framelength, samplerate, self.maxlength, self.search)
+        if not splits:
+            self.asr.decode(wavfile, target_dir)
+            return
+        chunkdir = os.path.join(target_dir, "chunks")
+        os.makedirs(chunkdir, exist_ok=True)
+        chunks = writechunks(wavfile, splits, chunkdir, file_id, self.overlap)
+        print("Decoding " + file_id + " in " + str(len(chunks)) + " chunks",file=sys.stderr)
+        def decodechunk(chunk):
+            chunkfile, offset, begin, end = chunk
+            chunk_id = os.path.splitext(os.path.basename(chunkfile))[0]
+            chunk_dir = os.path.join(chunkdir, chunk_id)
+            os.makedirs(chunk_dir, exist_ok=True)
+            self.asr.decode(os.path.abspath(chunkfile), os.path.abspath(chunk_dir))
+            ctmwords = readchunkctm(os.path.join(chunk_dir, "1Best.ctm"))
+            txtfile = os.path.join(chunk_dir, chunk_id + ".txt")
+            txtlines = []
+            if os.path.exists(txtfile):
+                with open(txtfile,'r',encoding='utf-8') as f:
+                    txtlines = [ line.rstrip("\n") for line in f if line.strip() ]
+            return ctmwords, txtlines, offset, begin, end
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(decodechunk, chunks))
+            ctmlines, txtlines = mergechunks(results, file_id)
+            with open(os.path.join(target_dir, "1Best.ctm"),'w',encoding='utf-8') as f:
+                for line in ctmlines:
+                    f.write(line + "\n")
+            with open(os.path.join(target_dir, file_id + ".txt"),'w',encoding='utf-8') as f:
+                for line in txtlines:
+                    f.write(line + "\n")
+        finally:
+            shutil.rmtree(chunkdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decodes a (normalised 16-bit) WAV file in chunks split at pauses, in parallel, and merges the results into a single 1Best.ctm and {file_id}.txt in the target directory", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-d','--decoder', type=str,help="Decoder command, called with the chunk WAV file and a target directory as extra arguments, must write 1Best.ctm (and {chunk_id}.txt) there", action='store',default="./decode_PR.sh",required=False)
+    parser.add_argument('--cwd', type=str,help="Working directory for the decoder (e.g. Kaldi_NL)", action='store',default=None,required=False)
+    parser.add_argument('-l','--maxlength', type=float,help="Maximum chunk length (in seconds)", action='store',default=MAXLENGTH,required=False)
+    parser.add_argument('--search', type=float,help="Seek a split point within the last this many seconds of a chunk", action='store',default=SEARCH,required=False)
+    parser.add_argument('--overlap', type=float,help="Extra audio on both sides of a chunk (in seconds)", action='store',default=OVERLAP,required=False)
+    parser.add_argument('-j','--workers', type=int,help="Number of chunks decoded simultaneously", action='store',default=1,required=False)
+    parser.add_argument('wavfile', type=str,help="WAV file")
+    parser.add_argument('target_dir', type=str,help="Target directory")
+    args = parser.parse_args()
+
+    os.makedirs(args.target_dir, exist_ok=True)
+    asr = ChunkedASR(CommandDecoder(shlex.split(args.decoder), args.cwd), args.maxlength, args.workers, args.search, args.overlap)
+    try:
+        asr.decode(args.wavfile, args.target_dir)
+    except ChunkError as e:
+        print("ERROR: " + str(e),file=sys.stderr)
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
@@ -7,20 +7,23 @@
 
 import sys
 
-sentence = []
-with open(sys.argv[1], 'r', encoding='utf-8') as f:
-    for line in f:
+def ctm2txt(lines):
+    """Reads CTM lines, yields the sentences (as strings), split on sentence-final punctuation"""
+    sentence = []
+    for line in lines:
         if line.strip():
             fields = line.split(" ")
             word = fields[4]
             if word != '#':
                 sentence.append(word)
                 if word in ('.','!','?'):
-                    print(" ".join(sentence))
+                    yield " ".join(sentence)
                     sentence = []
 
+def main():
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        for sentence in ctm2txt(f):
+            print(sentence)
 
-
-
-
-
+if __name__ == '__main__':
+    main()
@@ -1,89 +1,121 @@
-#!/usr/bin/env python
-
-import xml.etree.cElementTree as ET
-import codecs, sys, pdb
-import re
-import wave
-import contextlib
-import xml.dom.minidom
-
-
-# This script is written to convert ctm files into xml format. It is based on the following assuptions:
-# 1- the CTM file corresponds to a single audio file.
-# 2- No segementaion info is available, so the wole audion file is transcribed into one segment
-# 3- Single speaker/ No speaker identification
-
-##ResFolder="/vol/tensusers/sahmadi/OralHistory/Kaldi_NL/Test-decode208-OH-NL-alle_gegevensE2-VetinD-getuigen2/"
-##ResFolder="T:/OralHistory/Kaldi_NL/Test-decode208-OH-NL-alle_gegevensE2-VetinD-getuigen2/"
-ResFolder = sys.argv[1]
-UttId = sys.argv[2]
-AudioFolder = sys.argv[3]
-
-f=codecs.open(ResFolder+'/'+UttId+'.ctm','r',encoding='utf-8')
-lines=[]
-for line in f:
-    lines.append(line)
-
-
-
-CTM=[]
-Res={}
-for line in lines:
-
-    if line.find('\n')>0:
-        line=re.sub("\n"," ",line)
-    tmp=line.split(" ")
-
-    Res={}
-    Res['fname']=tmp[0]
-    Res['channel']=tmp[1]
-    Res['stime']='%.2f' %float(tmp[2])
-    Res['dur']=tmp[3]
-    Res['word']=tmp[4]
-    Res['conf']=tmp[5]
-
-    CTM.append(Res)
-
-
-sdur=str(float(CTM[-1]['stime'])+float(CTM[-1]['dur'])) #file duration
-##print(sdur)
-nwords=str(len(CTM))
-# get the signal duration from the wav file
-fname = CTM[0]['fname']+".wav"
-with contextlib.closing(wave.open(AudioFolder+'/'+fname,'r')) as f:
-    frames = f.getnframes()
-    rate = f.getframerate()
-    duration = frames / float(rate)
-##    print(duration)
-tdur='%.2f' %duration
-##print(tdur)
-
-# write to xml
-root = ET.Element("AudioDoc", path=AudioFolder, name=CTM[0]['fname']+".wav")
-
-ProcList = ET.SubElement(root, "ProcList")
-ChannelList = ET.SubElement(root, "ChannelList")
-SpeakerList = ET.SubElement(root, "SpeakerList")
-SegmentList = ET.SubElement(root, "SegmentList")
-
-ET.SubElement(ProcList, "Proc", name="OH-rec", version="1.0", editor="Radboud Research")
-
-ET.SubElement(ChannelList, "Channel", tconf="1.0", nw=nwords, spdur=sdur, sigdur=tdur, num=CTM[0]['channel'])
-
-ET.SubElement(SpeakerList, "Speaker", lang="dut", tconf="1.0", nw=nwords, lconf="1.00", spkid="Int", gender="1", dur=sdur, ch="1")
-
-SpeechSegment=ET.SubElement(SegmentList, "SpeechSegment", lang="dut", lconf="1.00", spkid="Int", ch="1", trs="1", stime=CTM[0]['stime'], etime=sdur, sconf="1.00")
-
-for line in CTM:
-
-    ET.SubElement(SpeechSegment, "Word", stime=line['stime'], dur=line['dur'], conf=line['conf']).text=line['word']
-
-
-tree = ET.ElementTree(root)
-tree.write(ResFolder+'/'+CTM[0]['fname']+".xml",encoding="UTF-8",xml_declaration=True)
-
-xml = xml.dom.minidom.parse(ResFolder+'/'+CTM[0]['fname']+".xml") # or xml.dom.minidom.parseString(xml_string)
-pretty_xml = xml.toprettyxml()
-fid = codecs.open(ResFolder+'/'+CTM[0]['fname']+".xml",'w',encoding='utf-8')
-fid.write(pretty_xml)
-fid.close()
+#!/usr/bin/env python
+
+import sys
+import os
+import wave
+import contextlib
+from xml.sax.saxutils import escape, quoteattr
+
+
+# This script is written to convert ctm files into xml format. It is based on the following assuptions:
+# 1- the CTM file corresponds to a single audio file.
+# 2- No segementaion info is available, so the wole audion file is transcribed into one segment
+# 3- Single speaker/ No speaker identification
+
+#The header contains totals (number of words, speech duration) that are only known at the end. They are written as
+#placeholders padded with whitespace (between the attributes, where XML allows it) and filled in afterwards.
+PLACEHOLDERWIDTH = 24
+
+def parsectmline(line):
+    tmp = line.replace("\n"," ").split(" ")
+    return {
+        'fname': tmp[0],
+        'channel': tmp[1],
+        'stime': '%.2f' %float(tmp[2]),
+        'dur': tmp[3],
+        'word': tmp[4],
+        'conf': tmp[5],
+    }
+
+def wavduration(filename):
+    """Duration of a WAV file in seconds, from the header"""
+    with contextlib.closing(wave.open(filename,'r')) as f:
+        return f.getnframes() / float(f.getframerate())
+
+def attributes(attribs):
+    return "".join( " " + key + "=" + quoteattr(value) for key, value in attribs )
+
+def placeholder(key):
+    return " " + key + '=""' + " " * PLACEHOLDERWIDTH
+
+def fillplaceholder(key, value):
+    attrib = " " + key + "=" + quoteattr(value)
+    if len(attrib) > len(placeholder(key)):
+        raise ValueError("Value too long for placeholder: " + value)
+    return attrib.ljust(len(placeholder(key)))
+
+def ctm2xml(lines, out, audiofolder, wavfile=None, file_id=None):
+    """Converts CTM lines into AudioDoc XML (as read by formats.AudioDoc), written in a single pass to out, which must be a
+    seekable file opened in binary mode. The signal duration is taken from the WAV file, which defaults to the file named in
+    the CTM in the audio folder. An empty CTM (e.g. for silent audio) yields an AudioDoc without words, named after file_id
+    or the WAV file. Returns the number of words"""
+    lines = ( line for line in lines if line.strip() )
+    first = next(lines, None)
+    if first is not None:
+        first = parsectmline(first)
+    else:
+        if file_id is None:
+            if wavfile is None:
+                raise ValueError("CTM file is empty and no file ID or WAV file is given")
+            file_id = os.path.splitext(os.path.basename(wavfile))[0]
+        first = {'fname': file_id, 'channel': "1", 'stime': "0.00"}
+    if wavfile is None:
+        wavfile = audiofolder + '/' + first['fname'] + ".wav"
+    tdur = '%.2f' % wavduration(wavfile)
+
+    begin = out.tell()
+    header = ['<?xml version="1.0" ?>',
+        "<AudioDoc" + attributes([("path", audiofolder), ("name", first['fname'] + ".wav")]) + ">",
+        "\t<ProcList>",
+        "\t\t<Proc" + attributes([("name", "OH-rec"), ("version", "1.0"), ("editor", "Radboud Research")]) + "/>",
+        "\t</ProcList>",
+        "\t<ChannelList>",
+        "\t\t<Channel" + attributes([("tconf", "1.0")]) + placeholder("nw") + placeholder("spdur") + attributes([("sigdur", tdur), ("num", first['channel'])]) + "/>",
+        "\t</ChannelList>",
+        "\t<SpeakerList>",
+        "\t\t<Speaker" + attributes([("lang", "dut"), ("tconf", "1.0")]) + placeholder("nw") + attributes([("lconf", "1.00"), ("spkid", "Int"), ("gender", "1")]) + placeholder("dur") + attributes([("ch", "1")]) + "/>",
+        "\t</SpeakerList>",
+        "\t<SegmentList>",
+        "\t\t<SpeechSegment" + attributes([("lang", "dut"), ("lconf", "1.00"), ("spkid", "Int"), ("ch", "1"), ("trs", "1"), ("stime", first['stime'])]) + placeholder("etime") + attributes([("sconf", "1.00")]) + ">",
+    ]
+    header = "\n".join(header) + "\n"
+    out.write(header.encode('utf-8'))
+
+    nwords = 0
+    word = first if 'word' in first else None
+    last = {'stime': first['stime'], 'dur': "0"}
+    while word is not None:
+        out.write(("\t\t\t<Word" + attributes([("stime", word['stime']), ("dur", word['dur']), ("conf", word['conf'])]) + ">" + escape(word['word'], {'"': '&quot;'}) + "</Word>\n").encode('utf-8'))
+        nwords += 1
+        last = word
+        line = next(lines, None)
+        word = parsectmline(line) if line is not None else None
+    out.write("\t\t</SpeechSegment>\n\t</SegmentList>\n</AudioDoc>\n".encode('utf-8'))
+    end = out.tell()
+
+    sdur = str(float(last['stime'])+float(last['dur'])) #file duration
+    nwords = str(nwords)
+    header = header.replace(placeholder("nw"), fillplaceholder("nw", nwords)) \
+                   .replace(placeholder("spdur"), fillplaceholder("spdur", sdur)) \
+                   .replace(placeholder("dur"), fillplaceholder("dur", sdur)) \
+                   .replace(placeholder("etime"), fillplaceholder("etime", sdur))
+    out.seek(begin)
+    out.write(header.encode('utf-8'))
+    out.seek(end)
+    return int(nwords)
+
+def main():
+    ##ResFolder="/vol/tensusers/sahmadi/OralHistory/Kaldi_NL/Test-decode208-OH-NL-alle_gegevensE2-VetinD-getuigen2/"
+    ResFolder = sys.argv[1]
+    UttId = sys.argv[2]
+    AudioFolder = sys.argv[3]
+
+    with open(ResFolder+'/'+UttId+'.ctm','r',encoding='utf-8') as f:
+        first = next(( line for line in f if line.strip() ), None)
+        fname = parsectmline(first)['fname'] if first is not None else UttId
+        f.seek(0)
+        with open(ResFolder+'/'+fname+".xml",'wb') as out:
+            ctm2xml(f, out, AudioFolder, file_id=UttId)
+
+if __name__ == '__main__':
+    main()
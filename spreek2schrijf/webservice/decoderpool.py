@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+#Persistent pool of MT decoder processes (Moses), so the model is loaded once rather than for every input file. Any command
+#that reads one sentence per line on stdin and writes one translation per line on stdout can act as decoder (e.g. cat, for testing)
+
+import sys
+import os
+import argparse
+import queue
+import select
+import socket
+import socketserver
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DecoderError(Exception):
+    pass
+
+
+def prepareconfig(inifile, modeldir, outputfile):
+    """Writes a copy of the Moses configuration with all model paths made relative to the model directory"""
+    with open(inifile,'r',encoding='utf-8') as f_in:
+        with open(outputfile,'w',encoding='utf-8') as f_out:
+            for line in f_in:
+                f_out.write(line.replace("path=", "path=" + os.path.join(modeldir, "")))
+    return outputfile
+
+
+class DecoderProcess:
+    """A single long-running decoder process"""
+
+    def __init__(self, command, stderr=None):
+        self.command = command
+        self.stderr = stderr
+        self.process = None
+        self.buffer = b""
+        self.start()
+
+    def start(self):
+        self.buffer = b""
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.stderr, bufsize=0)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+    def restart(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.start()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def readline(self, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self.buffer:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not select.select([fd],[],[],remaining)[0]:
+                    raise DecoderError("Decoder did not respond within " + str(timeout) + "s")
+            data = os.read(fd, 65536)
+            if not data:
+                raise DecoderError("Decoder terminated unexpectedly (exit code " + str(self.process.poll()) + ")")
+            self.buffer += data
+        line, self.buffer = self.buffer.split(b"\n",1)
+        return line.decode('utf-8')
+
+    def translate(self, lines, timeout=None):
+        """Translates a batch of lines. Input is fed from a separate thread so the decoder can work on multiple lines at once
+        without the pipes deadlocking"""
+        if not self.alive():
+            raise DecoderError("Decoder is not running")
+        data = "".join( line.replace("\n"," ").strip() + "\n" for line in lines ).encode('utf-8')
+        errors = []
+        def feed():
+            try:
+                self.process.stdin.write(data)
+                self.process.stdin.flush()
+            except OSError as e:
+                errors.append(e)
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            results = [ self.readline(timeout) for _ in lines ]
+        finally:
+            feeder.join(timeout=1)
+        if errors:
+            raise DecoderError("Unable to write to decoder: " + str(errors[0]))
+        return results
+
+
+class DecoderPool:
+    """A bounded pool of persistent decoder processes with health checks and restart on crash"""
+
+    def __init__(self, command, workers=1, chunksize=100, probe="test", probetimeout=60, checkinterval=30, stderr=None):
+        self.command = command
+        self.chunksize = chunksize
+        self.probe = probe
+        self.probetimeout = probetimeout
+        self.workers = [ DecoderProcess(command, stderr) for _ in range(workers) ]
+        self.idle = queue.Queue()
+        for worker in self.workers:
+            self.idle.put(worker)
+        self.restarts = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stopped = threading.Event()
+        self.checker = None
+        if checkinterval:
+            self.checker = threading.Thread(target=self._checkloop, args=(checkinterval,), daemon=True)
+            self.checker.start()
+
+    def _restart(self, worker):
+        print("Restarting decoder process (" + " ".join(self.command) + ")",file=sys.stderr)
+        self.restarts += 1
+        worker.restart()
+
+    def _run(self, lines):
+        worker = self.idle.get()
+        try:
+            try:
+                return worker.translate(lines)
+            except DecoderError as e:
+                #the decoder crashed, restart it and retry the batch once
+                print("Decoder error: " + str(e),file=sys.stderr)
+                self._restart(worker)
+                return worker.translate(lines)
+        finally:
+            self.idle.put(worker)
+
+    def translate(self, lines):
+        """Translates a list of lines, larger inputs are split into chunks that are distributed over the workers"""
+        lines = list(lines)
+        chunks = [ lines[i:i+self.chunksize] for i in range(0, len(lines), self.chunksize) ]
+        results = []
+        for chunk in self.executor.map(self._run, chunks):
+            results += chunk
+        return results
+
+    def healthcheck(self):
+        """Checks all idle workers, restarts those that have died or do not respond to the probe sentence. Returns the number of healthy workers"""
+        healthy = 0
+        for checked in range(len(self.workers)):
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                #all remaining workers are busy, so they are evidently working
+                healthy += len(self.workers) - checked
+                break
+            try:
+                if not worker.alive():
+                    self._restart(worker)
+                if self.probe is not None:
+                    worker.translate([self.probe], self.probetimeout)
+                healthy += 1
+            except DecoderError as e:
+                print("Decoder failed health check: " + str(e),file=sys.stderr)
+                self._restart(worker)
+            finally:
+                self.idle.put(worker)
+        return healthy
+
+    def _checkloop(self, interval):
+        while not self.stopped.wait(interval):
+            self.healthcheck()
+
+    def close(self):
+        self.stopped.set()
+        self.executor.shutdown()
+        for worker in self.workers:
+            worker.stop()
+
+
+#Protocol over the socket, all lines UTF-8:
+#  client: TRANSLATE <n>, followed by n lines  ->  server: OK <n>, followed by n lines (or ERROR <message>)
+#  client: PING                                 ->  server: PONG <number of healthy workers>
+
+class DecoderRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for request in self.rfile:
+            request = request.decode('utf-8').strip()
+            if request.startswith("TRANSLATE "):
+                try:
+                    n = int(request.split(" ")[1])
+                    if n < 0:
+                        raise ValueError(n)
+                except ValueError:
+                    self.wfile.write(("ERROR Invalid line count: " + request[10:] + "\n").encode('utf-8'))
+                    continue
+                lines = [ self.rfile.readline().decode('utf-8').rstrip("\n") for _ in range(n) ]
+                try:
+                    results = self.server.pool.translate(lines)
+                except DecoderError as e:
+                    self.wfile.write(("ERROR " + str(e).replace("\n"," ") + "\n").encode('utf-8'))
+                else:
+                    self.wfile.write(("OK " + str(len(results)) + "\n" + "".join( result + "\n" for result in results )).encode('utf-8'))
+            elif request == "PING":
+                self.wfile.write(("PONG " + str(self.server.pool.healthcheck()) + "\n").encode('utf-8'))
+            else:
+                self.wfile.write(b"ERROR Invalid request\n")
+
+
+class DecoderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socketpath, pool):
+        self.pool = pool
+        if os.path.exists(socketpath):
+            os.unlink(socketpath)
+        super().__init__(socketpath, DecoderRequestHandler)
+
+
+class DecoderClient:
+    """Client for a decoder pool served over a Unix socket"""
+
+    def __init__(self, socketpath, timeout=None):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(socketpath)
+        self.rfile = self.socket.makefile('rb')
+
+    def _request(self, data):
+        self.socket.sendall(data.encode('utf-8'))
+        response = self.rfile.readline().decode('utf-8').rstrip("\n")
+        if not response:
+            raise DecoderError("Connection closed by decoder pool")
+        if response.startswith("ERROR"):
+            raise DecoderError(response[6:])
+        return response
+
+    def translate(self, lines):
+        lines = [ line.replace("\n"," ").strip() for line in lines ]
+        response = self._request("TRANSLATE " + str(len(lines)) + "\n" + "".join( line + "\n" for line in lines ))
+        n = int(response.split(" ")[1])
+        return [ self.rfile.readline().decode('utf-8').rstrip("\n") for _ in range(n) ]
+
+    def ping(self):
+        return int(self._request("PING\n").split(" ")[1])
+
+    def close(self):
+        self.rfile.close()
+        self.socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Persistent pool of MT decoder processes", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='action')
+    serveparser = subparsers.add_parser('serve', help="Start a decoder pool and serve it on a Unix socket", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    serveparser.add_argument('-s','--socket', type=str,help="Path to the Unix socket", action='store',required=True)
+    serveparser.add_argument('-w','--workers', type=int,help="Number of decoder processes", action='store',default=1,required=False)
+    serveparser.add_argument('--moses', type=str,help="Path to the Moses executable (used if no decoder command is given)", action='store',default="moses",required=False)
+    serveparser.add_argument('--modeldir', type=str,help="Model directory containing moses.ini (used if no decoder command is given)", action='store',default="",required=False)
+    serveparser.add_argument('--checkinterval', type=int,help="Interval (in seconds) for health checks", action='store',default=30,required=False)
+    serveparser.add_argument('command', nargs=argparse.REMAINDER, help="Decoder command (after --), reads one sentence per line from stdin and outputs one per line on stdout")
+    translateparser = subparsers.add_parser('translate', help="Translate standard input (one sentence per line) using a running decoder pool", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    translateparser.add_argument('-s','--socket', type=str,help="Path to the Unix socket", action='store',required=True)
+    pingparser = subparsers.add_parser('ping', help="Check whether a decoder pool is up, outputs the number of healthy workers", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    pingparser.add_argument('-s','--socket', type=str,help="Path to the Unix socket", action='store',required=True)
+    args = parser.parse_args()
+
+    if args.action == 'serve':
+        command = [ arg for arg in args.command if arg != '--' ]
+        if not command:
+            if not args.modeldir:
+                parser.error("Specify either --modeldir or a decoder command")
+            config = prepareconfig(os.path.join(args.modeldir, "moses.ini"), os.path.abspath(args.modeldir), args.socket + ".moses.ini")
+            command = [args.moses, "-f", config]
+        pool = DecoderPool(command, args.workers, checkinterval=args.checkinterval)
+        server = DecoderServer(args.socket, pool)
+        print("Serving decoder pool (" + str(args.workers) + " workers) on " + args.socket,file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            pool.close()
+            os.unlink(args.socket)
+    elif args.action == 'translate':
+        client = DecoderClient(args.socket)
+        for result in client.translate(sys.stdin):
+            print(result)
+        client.close()
+    elif args.action == 'ping':
+        client = DecoderClient(args.socket)
+        print(client.ping())
+        client.close()
+    else:
+        parser.print_help()
+        sys.exit(2)
+
+if __name__ == '__main__':
+    main()
@@ -2,48 +2,112 @@
 
 import sys
 import json
-from bs4 import BeautifulSoup
-
-with open(sys.argv[1], 'r',encoding='utf-8') as f:
-    doc = BeautifulSoup(f.read(), 'html.parser')
-
-srcfile = doc.title.string
-seqnr = 0
-events = []
-sentences = []
-sentence = []
-begintime, endtime = 0,0
-speaker = "unknown"
-for font in doc.find('div', id='transcript').find_all('font'):
-    if 'speaker' in font['class']:
-        print(srcfile, speaker, begintime, endtime,file=sys.stderr)
-        if sentences:
-            if sentence:
+import argparse
+import lxml.etree
+
+def iterfonts(filename):
+    """Streams the title and the font elements in the transcript div of a Flemish HTML file, yields ('title', text) and
+    ('font', element) tuples. Elements are discarded once processed so memory use does not grow with the file size"""
+    intranscript = 0 #nesting depth within the transcript div
+    title = False
+    for event, node in lxml.etree.iterparse(filename, events=('start','end'), html=True, encoding='utf-8'):
+        if event == 'start':
+            if node.tag == 'div' and (intranscript or node.get('id') == 'transcript'):
+                intranscript += 1
+            continue
+        if node.tag == 'title' and not title:
+            title = True
+            yield 'title', node.text
+        elif node.tag == 'font' and intranscript:
+            yield 'font', node
+        elif node.tag == 'div' and intranscript:
+            intranscript -= 1
+        if node.tag in ('font', 'div') and node.getparent() is not None and node.getparent().tag != 'font':
+            node.clear()
+            #drop the processed elements from the parent as well
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+
+def iterflemishhtml(filename, log=sys.stderr):
+    """Parses a Flemish HTML transcript incrementally, yields the events (speaker turns), each with its sentences"""
+    srcfile = None
+    seqnr = 0
+    sentences = []
+    sentence = []
+    begintime, endtime = 0,0
+    speaker = "unknown"
+    for kind, font in iterfonts(filename):
+        if kind == 'title':
+            srcfile = font
+            continue
+        classes = font.attrib['class'].split()
+        if 'speaker' in classes:
+            if log:
+                print(srcfile, speaker, begintime, endtime,file=log)
+            if sentences:
+                if sentence:
+                    sentences.append({'seqnr': seqnr, 'tokens': sentence})
+                    sentence = []
+                yield {'speaker': speaker, 'src': srcfile, 'begintime': begintime, 'endtime': endtime, 'sentences':sentences}
+                sentences = []
+            speaker = "".join(font.itertext()).strip()
+            begintime, endtime = font.attrib['ts'], font.attrib['te']
+        elif 'player' in classes:
+            token = "".join(font.itertext()).strip()
+            if token[-1] == '.':
+                sentence.append(token[:-1])
+                sentence.append('.')
+                seqnr += 1
                 sentences.append({'seqnr': seqnr, 'tokens': sentence})
                 sentence = []
-            events.append({'speaker': speaker, 'src': srcfile, 'begintime': begintime, 'endtime': endtime, 'sentences':sentences})
-            sentences = []
-        speaker = font.get_text().strip()
-        begintime, endtime = font['ts'], font['te']
-    elif 'player' in font['class']:
-        token = font.get_text().strip()
-        if token[-1] == '.':
-            sentence.append(token[:-1])
-            sentence.append('.')
-            seqnr += 1
+            else:
+                sentence.append(token)
+    if sentences:
+        if sentence:
             sentences.append({'seqnr': seqnr, 'tokens': sentence})
             sentence = []
-        else:
-            sentence.append(token)
-if sentences:
-    if sentence:
-        sentences.append({'seqnr': seqnr, 'tokens': sentence})
-        sentence = []
-    events.append({'speaker': speaker, 'src': srcfile, 'begintime': begintime, 'endtime': endtime, 'sentences':sentences})
-
-with open('out.json','w',encoding='utf-8') as f:
-    json.dump(events, f, indent=4, ensure_ascii=False)
-with open('out.txt','w',encoding='utf-8') as f:
+        yield {'speaker': speaker, 'src': srcfile, 'begintime': begintime, 'endtime': endtime, 'sentences':sentences}
+
+def parseflemishhtml(filename, log=sys.stderr):
+    """Parses a Flemish HTML transcript, returns a list of events (speaker turns), each with its sentences"""
+    return list(iterflemishhtml(filename, log))
+
+def eventsentences(events):
+    """Yields the sentences (as strings) of the parsed events, one per line of the plain text output"""
     for event in events:
         for sentence in event['sentences']:
-            print(" ".join(sentence['tokens']), file=f)
+            yield " ".join(sentence['tokens'])
+
+def writeevents(events, f):
+    """Writes the events as a JSON array (formatted as json.dump() with indent=4 would), one event at a time. Yields the
+    events as they are written, so they can be processed further in the same pass"""
+    f.write("[")
+    first = True
+    for event in events:
+        f.write(("\n" if first else ",\n") + "    " + json.dumps(event, indent=4, ensure_ascii=False).replace("\n", "\n    "))
+        first = False
+        yield event
+    f.write("]" if first else "\n]")
+
+def convert(filename, jsonfile, txtfile, log=sys.stderr):
+    """Converts a Flemish HTML transcript to the events in JSON and the sentences in plain text, in a single pass.
+    Returns the number of sentences"""
+    count = 0
+    with open(jsonfile,'w',encoding='utf-8') as jsonf:
+        with open(txtfile,'w',encoding='utf-8') as txtf:
+            for sentence in eventsentences(writeevents(iterflemishhtml(filename, log), jsonf)):
+                print(sentence, file=txtf)
+                count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Parses a Flemish HTML transcript into events (JSON) and sentences (plain text)", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-j','--json', type=str,help="Output file for the events (JSON)", action='store',default="out.json",required=False)
+    parser.add_argument('-t','--txt', type=str,help="Output file for the sentences (plain text, one per line)", action='store',default="out.txt",required=False)
+    parser.add_argument('htmlfile', type=str,help="Flemish HTML file")
+    args = parser.parse_args()
+
+    convert(args.htmlfile, args.json, args.txt)
+
+if __name__ == '__main__':
+    main()
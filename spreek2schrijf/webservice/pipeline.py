@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+#In-process pipeline driver for the webservice: runs the text processing stages (ctm2txt, ctm2xml, flemish HTML parsing,
+#post-correction, flemish HTML writing) as functions within a single interpreter, shared resources are loaded once per job.
+#ASR and MT are external steps that can be plugged in.
+
+import sys
+import os
+import glob
+import shlex
+import shutil
+import argparse
+import queue
+import threading
+import datetime
+import subprocess
+from spreek2schrijf.webservice.ctm2txt import ctm2txt
+from spreek2schrijf.webservice.ctm2xml import ctm2xml
+from spreek2schrijf.webservice.segment import Segmenter, ctmsentences, readctm, timedlines, rejoin, PAUSE, MAXLENGTH
+from spreek2schrijf.webservice.parseflemishhtml import iterflemishhtml, eventsentences, writeevents
+from spreek2schrijf.webservice.writeflemishhtml import writeflemishhtml
+from spreek2schrijf.formats import iterjsonarray
+from spreek2schrijf.webservice.postcorrect import PostCorrector
+from spreek2schrijf.webservice.decoderpool import DecoderProcess, DecoderClient, DecoderError, prepareconfig
+from spreek2schrijf.webservice.translationcache import TranslationCache, modelhash
+from spreek2schrijf.webservice.asrcache import ASRCache, kaldimodelid
+from spreek2schrijf.webservice.chunker import ChunkedASR
+
+
+class PipelineError(Exception):
+    pass
+
+
+def readlines(filename):
+    with open(filename,'r',encoding='utf-8') as f:
+        return [ line.rstrip("\n") for line in f ]
+
+def writelines(filename, lines):
+    with open(filename,'w',encoding='utf-8') as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+class KaldiASR:
+    """ASR step: converts the audio with sox and decodes it with Kaldi_NL (decode_PR.sh). Produces a directory with the
+    transcription ({file_id}.txt) and the CTM (1Best.ctm)"""
+
+    def __init__(self, kaldi_nl, sox="sox", model=None):
+        self.kaldi_nl = kaldi_nl
+        self.sox = sox
+        self.model = model #identifies the ASR model in the ASR cache, computed from the Kaldi_NL installation if not set
+
+    def modelid(self):
+        if self.model is None:
+            self.model = kaldimodelid(self.kaldi_nl)
+        return self.model
+
+    def convert(self, inputfile, wavfile):
+        if subprocess.call([self.sox, inputfile, "-e", "signed-integer", "-c", "1", "-r", "16000", "-b", "16", wavfile]) != 0:
+            raise PipelineError("Audio conversion failed")
+
+    def decode(self, wavfile, target_dir):
+        if subprocess.call(["./decode_PR.sh", wavfile, target_dir], cwd=self.kaldi_nl) != 0:
+            self.dumplogs(target_dir)
+            raise PipelineError("ASR decoding failed")
+
+    def dumplogs(self, target_dir):
+        for title, pattern in (("intermediate log", "intermediate/log"), ("kaldi decode logs", "intermediate/decode/decode*log")):
+            print("[Output of " + title + "]",file=sys.stderr)
+            for filename in glob.glob(os.path.join(target_dir, pattern)):
+                with open(filename,'r',encoding='utf-8',errors='replace') as f:
+                    sys.stderr.write(f.read())
+            print("[End of " + title + "]",file=sys.stderr)
+
+
+class Translator:
+    """MT step: translates a list of sentences, through the decoder pool (if a socket is given) or Moses processes that are
+    started once and kept for the whole job. Optionally backed by the persistent translation cache. Safe to call from
+    multiple threads: each concurrent caller gets its own decoder process. Cache hits and misses are counted over all calls"""
+
+    def __init__(self, config, moses="moses", modeldir=None, socket=None, cache=None, command=None, scratchdir=".", maxentries=1000000, maxage=90 * 86400):
+        self.modeldir = os.path.abspath(modeldir if modeldir else os.path.dirname(os.path.abspath(config)))
+        self.config = config
+        self.moses = moses
+        self.socket = socket
+        self.command = command
+        self.scratchdir = scratchdir
+        self.processes = [] #all decoder processes started
+        self.idle = queue.LifoQueue() #decoder processes not in use
+        self.cachefile = cache
+        self.maxentries = maxentries
+        self.maxage = maxage
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        if cache:
+            self.model = modelhash(config, self.modeldir)
+
+    def decode(self, sentences):
+        if self.socket:
+            client = DecoderClient(self.socket)
+            try:
+                return client.translate(sentences)
+            finally:
+                client.close()
+        try:
+            process = self.idle.get_nowait()
+        except queue.Empty:
+            command = self.command
+            with self.lock:
+                if not command:
+                    #the configuration is written only once, Moses processes that are already running may be reading it
+                    if not self.processes:
+                        prepareconfig(self.config, self.modeldir, os.path.join(self.scratchdir, "moses.ini"))
+                    command = [self.moses, "-f", os.path.join(self.scratchdir, "moses.ini")]
+                process = DecoderProcess(command)
+                self.processes.append(process)
+        try:
+            return process.translate(sentences)
+        except DecoderError:
+            #the decoder crashed (it may not have been reaped yet, so alive() can not be relied on) or its output can no
+            #longer be matched to the input: discard it, the next call starts a fresh one
+            with self.lock:
+                self.processes.remove(process)
+            process.stop()
+            process = None
+            raise
+        finally:
+            if process is not None:
+                self.idle.put(process)
+
+    def __call__(self, sentences):
+        if self.cachefile:
+            #SQLite connections can not be shared between threads, so open the cache for each call
+            cache = TranslationCache(self.cachefile, self.model, self.maxentries, self.maxage)
+            try:
+                return cache.translate(sentences, self.decode)
+            finally:
+                with self.lock:
+                    self.hits += cache.hits
+                    self.misses += cache.misses
+                cache.close()
+        return self.decode(sentences)
+
+    def close(self):
+        for process in self.processes:
+            process.stop()
+        self.processes = []
+        self.idle = queue.LifoQueue()
+
+
+#The stages each input file goes through, files are pipelined: while one file is in MT, the next can be in ASR
+STAGES = ("conversion", "asr", "mt", "postcorrect")
+
+class Pipeline:
+    """Processes all input files of a job: audio, CTM or flemish HTML in, the output files of the CLAM output templates out.
+    Every file runs in its own thread, the number of files that can be in each stage simultaneously is limited by the
+    concurrency setting for that stage (a dictionary, stages not mentioned get 1)"""
+
+    def __init__(self, translator, asr=None, corrector=None, segmenter=None, statusfile=None, concurrency=None, asrcache=None):
+        self.translator = translator
+        self.asr = asr
+        self.asrcache = asrcache #ASR results by audio hash (asrcache.ASRCache), decoding is skipped for known audio
+        self.corrector = corrector
+        self.segmenter = segmenter #splits the sentences into shorter segments for MT (segment.Segmenter)
+        self.statusfile = statusfile
+        if concurrency is None:
+            concurrency = {}
+        self.limits = { stage: threading.BoundedSemaphore(concurrency.get(stage, 1)) for stage in STAGES }
+        self.statuslock = threading.Lock()
+
+    def status(self, message):
+        with self.statuslock:
+            print(message,file=sys.stderr)
+            if self.statusfile:
+                with open(self.statusfile,'a',encoding='utf-8') as f:
+                    print(message,file=f)
+
+    def process(self, inputfile, outputdir, scratchdir):
+        filename = os.path.basename(inputfile)
+        file_id, extension = os.path.splitext(filename)
+        extension = extension[1:]
+        eventsfile = None
+        if extension == "ctm":
+            self.status("Using CTM file " + filename + "...")
+            shutil.copyfile(inputfile, os.path.join(outputdir, file_id + ".ctm"))
+            with open(inputfile,'r',encoding='utf-8') as f:
+                if self.segmenter is not None:
+                    sentences = list(ctmsentences(f))
+                    spraak = [ " ".join( word for word, _, _ in sentence ) for sentence in sentences ]
+                else:
+                    spraak = sentences = list(ctm2txt(f))
+        elif extension == "html":
+            self.status("Using HTML file " + filename + "...")
+            eventsfile = os.path.join(outputdir, file_id + ".spraak.json")
+            try:
+                with open(eventsfile,'w',encoding='utf-8') as f:
+                    spraak = sentences = list(eventsentences(writeevents(iterflemishhtml(inputfile), f)))
+            except Exception as e:
+                raise PipelineError("Parse flemish HTML failed, input was " + os.path.abspath(inputfile) + ": " + str(e))
+        else:
+            spraak, sentences = self.transcribe(inputfile, file_id, outputdir, scratchdir)
+        writelines(os.path.join(outputdir, file_id + ".spraak.txt"), spraak)
+
+        with self.limits['mt']:
+            self.status("MT Decoding " + filename + "...")
+            try:
+                if self.segmenter is not None:
+                    linemap, segments = [], []
+                    for linenr, segment in self.segmenter(sentences):
+                        linemap.append(linenr)
+                        segments.append(segment)
+                    translations = rejoin(self.translator(segments), linemap, len(sentences))
+                else:
+                    translations = self.translator(spraak)
+            except Exception as e:
+                raise PipelineError("MT Decoding failed: " + str(e))
+        writelines(os.path.join(outputdir, file_id + ".mt-out.txt"), translations)
+        with self.limits['postcorrect']:
+            self.status("MT Postprocessing " + filename + "...")
+            if self.corrector is not None:
+                schrijf = list(self.corrector.correct(translations))
+            else:
+                schrijf = translations
+            writelines(os.path.join(outputdir, file_id + ".schrijf.txt"), schrijf)
+            if eventsfile is not None:
+                #the events are streamed back from the JSON written earlier
+                with open(eventsfile,'r',encoding='utf-8') as eventsf:
+                    with open(os.path.join(outputdir, file_id + ".html"),'w',encoding='utf-8') as f:
+                        writeflemishhtml(schrijf, iterjsonarray(eventsf), f)
+
+    def transcribe(self, inputfile, file_id, outputdir, scratchdir):
+        if self.asr is None:
+            raise PipelineError("No ASR available for " + inputfile)
+        filename = os.path.basename(inputfile)
+        wavfile = os.path.join(scratchdir, file_id + ".wav")
+        with self.limits['conversion']:
+            self.status("Audio conversion " + filename + "...")
+            self.asr.convert(inputfile, wavfile)
+        target_dir = os.path.join(scratchdir, file_id + "_" + datetime.datetime.now().strftime("%y_%m_%d_%H_%m_%S"))
+        os.makedirs(target_dir, exist_ok=True)
+        with self.limits['asr']:
+            try:
+                key = None
+                if self.asrcache is not None:
+                    key = self.asrcache.key(wavfile, self.asr.modelid())
+                if key is not None and self.asrcache.fetch(key, target_dir, file_id):
+                    self.status("ASR results for " + filename + " found in cache, skipping decoding")
+                else:
+                    self.status("ASR Decoding " + filename + "...")
+                    self.asr.decode(os.path.abspath(wavfile), os.path.abspath(target_dir))
+                    if key is not None:
+                        self.asrcache.store(key, target_dir, file_id)
+                spraak = [ line.split('(')[0] for line in readlines(os.path.join(target_dir, file_id + ".txt")) ]
+                ctmfile = os.path.join(outputdir, file_id + ".ctm")
+                shutil.copyfile(os.path.join(target_dir, "1Best.ctm"), ctmfile)
+            finally:
+                shutil.rmtree(target_dir, ignore_errors=True)
+        with open(ctmfile,'r',encoding='utf-8') as f:
+            with open(os.path.join(outputdir, file_id + ".xml"),'wb') as out:
+                ctm2xml(f, out, scratchdir, wavfile, file_id)
+        if self.segmenter is not None:
+            #take the pauses between the words from the CTM
+            with open(ctmfile,'r',encoding='utf-8') as f:
+                return spraak, list(timedlines(spraak, readctm(f)))
+        return spraak, spraak
+
+    def run(self, inputdir, outputdir, scratchdir):
+        """Processes all files in the input directory. A failing file does not abort the others, returns a dictionary mapping
+        the filenames to their error message (or None if they were processed successfully)"""
+        os.makedirs(scratchdir, exist_ok=True)
+        inputfiles = sorted(glob.glob(os.path.join(inputdir, "*")))
+        report = {}
+        done = [0]
+        def process(inputfile):
+            filename = os.path.basename(inputfile)
+            try:
+                self.process(inputfile, outputdir, scratchdir)
+            except Exception as e:
+                error = str(e) if isinstance(e, PipelineError) else e.__class__.__name__ + ": " + str(e)
+                with self.statuslock:
+                    report[filename] = error
+                    done[0] += 1
+                self.status("Failed " + filename + " (" + str(done[0]) + "/" + str(len(inputfiles)) + "): " + error)
+            else:
+                with self.statuslock:
+                    report[filename] = None
+                    done[0] += 1
+                self.status("Finished " + filename + " (" + str(done[0]) + "/" + str(len(inputfiles)) + ")")
+        threads = [ threading.Thread(target=process, args=(inputfile,)) for inputfile in inputfiles ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return { os.path.basename(inputfile): report[os.path.basename(inputfile)] for inputfile in inputfiles }
+
+def main():
+    webservicedir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Runs the spreek2schrijf webservice pipeline on all files in the input directory", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('statusfile', type=str,help="CLAM status file")
+    parser.add_argument('inputdir', type=str,help="Input directory")
+    parser.add_argument('outputdir', type=str,help="Output directory")
+    parser.add_argument('scratchdir', type=str,help="Scratch directory")
+    parser.add_argument('-f','--config', type=str,help="Moses configuration (moses.ini) of the MT model", action='store',required=True)
+    parser.add_argument('--modeldir', type=str,help="Model directory the paths in the configuration are relative to (defaults to the directory of the configuration)", action='store',default=None,required=False)
+    parser.add_argument('--moses', type=str,help="Path to the Moses executable", action='store',default="moses",required=False)
+    parser.add_argument('--kaldi-nl', dest='kaldi_nl', type=str,help="Path to Kaldi_NL, for ASR of audio input", action='store',default="",required=False)
+    parser.add_argument('-s','--socket', type=str,help="Use the decoder pool (s2s-decoderpool) on this Unix socket for MT", action='store',default="",required=False)
+    parser.add_argument('-c','--cache', type=str,help="Translation cache database file", action='store',default="",required=False)
+    parser.add_argument('--cache-maxentries', dest='cachemaxentries', type=int,help="Maximum number of entries in the translation cache", action='store',default=1000000,required=False)
+    parser.add_argument('--cache-maxage', dest='cachemaxage', type=float,help="Evict translation cache entries not used for this number of days", action='store',default=90,required=False)
+    parser.add_argument('-n','--names', type=str,help="List of names for post-correction", action='store',default=os.path.join(webservicedir, "namen.txt"),required=False)
+    parser.add_argument('--pause', type=float,help="Split the MT input on pauses longer than this (in seconds)", action='store',default=PAUSE,required=False)
+    parser.add_argument('--maxlength', type=int,help="Maximum length (in words) of the MT input segments, the translated segments are joined again in the output (0 disables segmentation)", action='store',default=MAXLENGTH,required=False)
+    for stage in STAGES:
+        parser.add_argument('--' + stage + '-workers', dest=stage, type=int,help="Maximum number of files in the " + stage + " stage simultaneously", action='store',default=1,required=False)
+    parser.add_argument('--asr-cache', dest='asrcache', type=str,help="ASR cache directory, audio that has been decoded before (with the same ASR model) is not decoded again", action='store',default="",required=False)
+    parser.add_argument('--asr-cache-size', dest='asrcachesize', type=int,help="Maximum size of the ASR cache (in MB), least recently used entries are evicted (0 for no limit)", action='store',default=10240,required=False)
+    parser.add_argument('--asr-model', dest='asrmodel', type=str,help="Identifier of the ASR model for the ASR cache (computed from the Kaldi_NL models if not set)", action='store',default=None,required=False)
+    parser.add_argument('--chunk-length', dest='chunklength', type=float,help="Split long recordings at pauses into chunks of at most this length (in seconds) for ASR, decoded in parallel (0 to decode recordings as a whole)", action='store',default=0,required=False)
+    parser.add_argument('--chunk-workers', dest='chunkworkers', type=int,help="Number of chunks of a recording decoded simultaneously", action='store',default=1,required=False)
+    parser.add_argument('--decoder', type=str,help="MT decoder command to use instead of Moses, reads one sentence per line from stdin and outputs one per line on stdout", action='store',default="",required=False)
+    args = parser.parse_args()
+
+    asr = None
+    if args.kaldi_nl:
+        asr = KaldiASR(args.kaldi_nl, model=args.asrmodel)
+        if args.chunklength:
+            asr = ChunkedASR(asr, args.chunklength, args.chunkworkers)
+    translator = Translator(args.config, args.moses, args.modeldir, args.socket if args.socket and os.path.exists(args.socket) else None, args.cache, shlex.split(args.decoder), args.scratchdir,
+        args.cachemaxentries, args.cachemaxage * 86400 if args.cachemaxage else None)
+    pipeline = Pipeline(
+        translator,
+        asr,
+        PostCorrector.fromfile(args.names),
+        Segmenter(args.pause, args.maxlength) if args.maxlength else None,
+        args.statusfile,
+        { stage: getattr(args, stage) for stage in STAGES },
+        ASRCache(args.asrcache, args.asrcachesize * 1024 * 1024) if args.asrcache else None
+    )
+    try:
+        report = pipeline.run(args.inputdir, args.outputdir, args.scratchdir)
+    finally:
+        translator.close()
+    if translator.cachefile:
+        print("Translation cache: " + str(translator.hits) + " hits, " + str(translator.misses) + " misses, hit rate " + str(round(translator.hits / (translator.hits + translator.misses) * 100 if translator.hits + translator.misses else 0.0,2)) + "%",file=sys.stderr)
+    if pipeline.asrcache is not None:
+        print("ASR cache: " + str(pipeline.asrcache.hits) + " hits, " + str(pipeline.asrcache.misses) + " misses",file=sys.stderr)
+    failed = [ (filename, error) for filename, error in report.items() if error is not None ]
+    if failed:
+        print("-----------------------------------------------------------------------",file=sys.stderr)
+        for filename, error in failed:
+            print("ERROR in " + filename + ": " + error,file=sys.stderr)
+        print("-----------------------------------------------------------------------",file=sys.stderr)
+        pipeline.status(str(len(failed)) + " of " + str(len(report)) + " files failed: " + ", ".join( filename for filename, _ in failed ))
+        if len(failed) == len(report):
+            sys.exit(2)
+
+if __name__ == '__main__':
+    main()
@@ -2,46 +2,95 @@
 
 import sys
 
-names = {}
-with open(sys.argv[2],'r',encoding='utf-8') as f:
-    for line in f:
-        line = line.strip()
-        names[line.lower()] = line
-
 #filter duplicate punctuation
-substitutions = {
+SUBSTITUTIONS = {
     '. .': '.',
     ', ,': ',',
 }
 
-with open(sys.argv[1],'r',encoding='utf-8') as f:
-    for line in f:
-        line = line.strip()
-        words = line.split(' ')
+#longest n-gram that is matched
+MAXLENGTH = 4
+
+def loadnames(filename):
+    """Loads a list of names (one per line), returns a dictionary mapping the lowercased names to their proper casing"""
+    names = {}
+    with open(filename,'r',encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            names[line.lower()] = line
+    return names
+
+
+class PostCorrector:
+    """Recases known names and applies substitutions to the MT output. Names and substitutions are compiled into a token trie,
+    each line is then matched in a single left-to-right pass (longest match first, names before substitutions)"""
+
+    def __init__(self, names, substitutions=SUBSTITUTIONS, maxlength=MAXLENGTH, log=sys.stderr):
+        self.maxlength = maxlength
+        self.log = log
+        self.trie = {}
+        for key, substitution in substitutions.items():
+            self.add(key, substitution, False)
+        #names are added last so they take precedence over substitutions with the same key
+        for key, name in names.items():
+            self.add(key, name, True)
+
+    @classmethod
+    def fromfile(cls, namesfile, **kwargs):
+        return cls(loadnames(namesfile), **kwargs)
+
+    def add(self, key, replacement, isname):
+        tokens = key.split(' ')
+        if len(tokens) > self.maxlength:
+            return
+        node = self.trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        #the None key marks the end of a match, tokens are always strings
+        node[None] = (replacement, replacement.split(' '), isname, key)
+
+    def correctline(self, line):
+        words = line.strip().split(' ')
+        keys = [ word.lower() for word in words ]
         newwords = []
-        skip = 0
-        #recasing for known names
-        for i in range(0, len(words)):
-            if skip:
-                skip = skip - 1
-                continue
-            found = False
-            for l in range(4, 0,-1):
-                ngram = " ".join(words[i:i+l])
-                key = ngram.lower()
-                if key in names:
-                    if ngram != names[key]:
-                        print("  Corrected name " + names[key],file=sys.stderr)
-                    found = True
-                    newwords += names[key].split(' ')
-                elif key in substitutions:
-                    if ngram != substitutions[key]:
-                        print("  Applied substitution " + key + " -> " + substitutions[key],file=sys.stderr)
-                    found = True
-                    newwords.append(substitutions[key])
-                if found:
-                    skip = l-1
+        i = 0
+        while i < len(words):
+            #find the longest match starting at this position
+            node = self.trie
+            match = None
+            for l in range(min(self.maxlength, len(words) - i)):
+                node = node.get(keys[i+l])
+                if node is None:
                     break
-            if not found:
+                if None in node:
+                    match = l + 1, node[None]
+            if match is None:
                 newwords.append(words[i])
-        print(" ".join(newwords))
+                i += 1
+                continue
+            length, (replacement, replacementtokens, isname, key) = match
+            if isname:
+                if self.log and words[i:i+length] != replacementtokens:
+                    print("  Corrected name " + replacement,file=self.log)
+                newwords += replacementtokens
+            else:
+                if self.log and words[i:i+length] != replacementtokens:
+                    print("  Applied substitution " + key + " -> " + replacement,file=self.log)
+                newwords.append(replacement)
+            i += length
+        return " ".join(newwords)
+
+    def correct(self, lines):
+        """Corrects a stream of lines, yields the corrected lines (without newline)"""
+        for line in lines:
+            yield self.correctline(line)
+
+
+def main():
+    corrector = PostCorrector.fromfile(sys.argv[2])
+    with open(sys.argv[1],'r',encoding='utf-8') as f:
+        for line in corrector.correct(f):
+            print(line)
+
+if __name__ == '__main__':
+    main()
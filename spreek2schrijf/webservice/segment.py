@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+#Segmentation of the ASR output into MT input. Sentences are split on punctuation, long pauses, and are capped to a maximum
+#length (decoding time rises sharply with the length of the input). Every segment is mapped to the output line it belongs to,
+#so the translated segments can be joined again.
+
+import argparse
+
+PAUSE = 1.0 #seconds
+MAXLENGTH = 40 #words
+EOS = ('.','!','?')
+
+
+def readctm(lines):
+    """Reads CTM lines, yields (word, starttime, endtime) tuples (times in seconds), skips the '#' filler"""
+    for line in lines:
+        if line.strip():
+            fields = line.split(" ")
+            word = fields[4].strip()
+            if word != '#':
+                starttime = float(fields[2])
+                yield word, starttime, starttime + float(fields[3])
+
+def ctmsentences(lines):
+    """Groups the words of a CTM into sentences on sentence-final punctuation, exactly as ctm2txt does (trailing words
+    without final punctuation are discarded), yields lists of (word, starttime, endtime) tuples"""
+    sentence = []
+    for word in readctm(lines):
+        sentence.append(word)
+        if word[0] in EOS:
+            yield sentence
+            sentence = []
+
+def timedlines(lines, ctmwords):
+    """Attaches the timing information from the CTM words to the given text lines (the plain transcription that accompanies
+    the CTM). Yields lists of (word, starttime, endtime) tuples, times are None once the text and the CTM diverge"""
+    ctmwords = iter(ctmwords)
+    aligned = True
+    for line in lines:
+        tokens = line.split()
+        if aligned:
+            words = [ word for _, word in zip(tokens, ctmwords) ]
+            if [ word for word, _, _ in words ] == tokens:
+                yield words
+                continue
+            aligned = False
+        yield [ (token, None, None) for token in tokens ]
+
+
+class Segmenter:
+    """Splits sentences (lists of (word, starttime, endtime), times may be None) into segments of at most maxlength words,
+    on pauses longer than the pause threshold (in seconds) and, where a sentence is still too long, at the most natural
+    point: after a comma, else at the longest pause"""
+
+    def __init__(self, pause=PAUSE, maxlength=MAXLENGTH):
+        self.pause = pause
+        self.maxlength = maxlength
+
+    def gap(self, words, i):
+        """The pause before word i"""
+        if words[i][1] is None or words[i-1][2] is None:
+            return 0.0
+        return words[i][1] - words[i-1][2]
+
+    def split(self, words):
+        """Yields the segments of a single sentence, as lists of words"""
+        begin = 0
+        for i in range(1, len(words)):
+            if self.pause is not None and self.gap(words, i) > self.pause:
+                yield from self.cap(words[begin:i])
+                begin = i
+        if begin < len(words):
+            yield from self.cap(words[begin:])
+
+    def cap(self, words):
+        while len(words) > self.maxlength:
+            #split somewhere in the second half of the maximum length
+            best = max(range(max(1, self.maxlength // 2), self.maxlength + 1), key=lambda i: (words[i-1][0] == ',', self.gap(words, i), i))
+            yield words[:best]
+            words = words[best:]
+        if words:
+            yield words
+
+    def __call__(self, sentences):
+        """Segments a sequence of sentences, yields (linenr, segment) tuples, where the segment is a string and linenr the
+        index of the sentence it came from. Sentences may be lists of (word, starttime, endtime) tuples or strings"""
+        for linenr, sentence in enumerate(sentences):
+            if isinstance(sentence, str):
+                sentence = [ (token, None, None) for token in sentence.split() ]
+            if not sentence:
+                yield linenr, ""
+                continue
+            for segment in self.split(sentence):
+                yield linenr, " ".join( word for word, _, _ in segment )
+
+
+def rejoin(translations, linemap, lines):
+    """Joins the translated segments back into lines, linemap holds the line number of every segment"""
+    output = [ [] for _ in range(lines) ]
+    for linenr, translation in zip(linemap, translations):
+        if translation.strip():
+            output[linenr].append(translation.strip())
+    return [ " ".join(segments) for segments in output ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Segments a CTM file (with punctuation) into MT input, on punctuation and pauses, capped to a maximum length. Outputs one segment per line", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-p','--pause', type=float,help="Split on pauses longer than this (in seconds)", action='store',default=PAUSE,required=False)
+    parser.add_argument('-m','--maxlength', type=int,help="Maximum segment length (in words)", action='store',default=MAXLENGTH,required=False)
+    parser.add_argument('-M','--mapfile', type=str,help="Write the number of the sentence each segment belongs to (one per line) to this file", action='store',default="",required=False)
+    parser.add_argument('ctmfile', type=str,help="CTM file")
+    args = parser.parse_args()
+
+    segmenter = Segmenter(args.pause, args.maxlength)
+    mapfile = open(args.mapfile,'w',encoding='utf-8') if args.mapfile else None
+    with open(args.ctmfile,'r',encoding='utf-8') as f:
+        for linenr, segment in segmenter(ctmsentences(f)):
+            print(segment)
+            if mapfile:
+                print(linenr, file=mapfile)
+    if mapfile:
+        mapfile.close()
+
+if __name__ == '__main__':
+    main()
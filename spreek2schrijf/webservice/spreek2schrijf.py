@@ -29,6 +29,7 @@ from clam.common.formats import WaveAudioFormat, OggAudioFormat, MP3AudioFormat
 import clam
 import sys
 import os
+from spreek2schrijf.webservice.batcher import gettranslator
 from base64 import b64decode as D
 
 REQUIRE_VERSION = 3.0
@@ -340,7 +341,16 @@ PARAMETERS =  [
 #for commands is equal to those of COMMAND above, any file or project specific
 #variables are not available though, so there is no $DATAFILE, $STATUSFILE, $INPUTDIRECTORY, $OUTPUTDIRECTORY or $PROJECT.
 
+def translate(text):
+    """Translates spraak text (one sentence per line) to postcorrected schrijf text, synchronously. All requests to this
+    process share a warm translation backend (see batcher.py), configured through the same environment variables as the
+    wrapper script; S2S_DECODER sets any line-based decoder command instead of Moses (for testing)"""
+    return gettranslator()(text)
+
 ACTIONS = [
+    Action(id='translate',name='Vertaal',description='Zet spraaktekst (een zin per regel) direct om naar schrijftaal, zonder project',function=translate,mimetype='text/plain',parameters=[
+        TextParameter(id='text',name='Spraaktekst',description='Spraaktekst, een zin per regel',required=True),
+    ]),
     #Action(id='multiply',name='Multiply',parameters=[IntegerParameter(id='x',name='Value'),IntegerParameter(id='y',name='Multiplier'), command=sys.path[0] + "/actions/multiply.sh $PARAMETERS" ])
     #Action(id='multiply',name='Multiply',parameters=[IntegerParameter(id='x',name='Value'),IntegerParameter(id='y',name='Multiplier'), function=lambda x,y: x*y ])
 ]
@@ -37,28 +37,6 @@ mkdir -p $SCRATCHDIRECTORY
 #Output a status message to the status file that users will see in the interface
 echo "Starting..." >> $STATUSFILE
 
-fatalerror() {
-    echo "-----------------------------------------------------------------------" >&2
-    echo "FATAL ERROR: $*" >&2
-    echo "-----------------------------------------------------------------------" >&2
-    echo "$*" >> $STATUSFILE
-    if [ ! -z "$target_dir" ]; then
-        echo "[Index of $target_dir]" >&2
-        du -ah $target_dir >&2
-        echo "[End of index]">&2
-        echo "[Output of intermediate log]" >&2
-        cat $target_dir/intermediate/log >&2
-        echo "[End output of intermediate log]">&2
-        echo "[Output of kaldi decode logs]" >&2
-        cat $target_dir/intermediate/decode/decode*log >&2
-        echo "[End of kaldi decode logs]" >&2
-        if [ ! -z "$debug" ]; then
-            echo "(cleaning intermediate files after error)">&2
-            rm -Rf $target_dir
-        fi
-    fi
-    exit 2
-}
 #Example parameter parsing using getopt:
 #while getopts ":h" opt "$PARAMETERS"; do
 #  case $opt in
@@ -108,58 +86,41 @@ if [ ! -e "$MOSES" ]; then
     exit 2
 fi
 
-cd $KALDI_NL
-for inputfile in $INPUTDIRECTORY/*; do
-  inputfile_absolute=$(realpath "$inputfile")
-  filename=$(basename "$inputfile")
-  extension="${filename##*.}"
-  file_id=$(basename "$inputfile" .$extension)
-  if [ "$extension" = "ctm" ]; then
-      echo "Using CTM file $filename..." >&2
-      echo "Using CTM file $filename..." >> $STATUSFILE
-      cp $inputfile $OUTPUTDIRECTORY/${file_id}.ctm
-      python3 $S2SDIR/spreek2schrijf/webservice/ctm2txt.py $OUTPUTDIRECTORY/$file_id.ctm > $OUTPUTDIRECTORY/${file_id}.spraak.txt
-  elif [ "$extension" = "html" ]; then
-      echo "Using HTML file $filename..." >&2
-      echo "Using HTML file $filename..." >> $STATUSFILE
-      cd $OUTPUTDIRECTORY
-      python3 $S2SDIR/spreek2schrijf/webservice/parseflemishhtml.py $inputfile_absolute
-      if [ $? -ne 0 ]; then
-          echo "ERROR: Parse flemish HTML failed, input was $inputfile_absolute">&2
-          exit 2
-      fi
-      mv out.txt ${file_id}.spraak.txt
-      mv out.json ${file_id}.spraak.json
-      cd $KALDI_NL
-  else
-      echo "Audio conversion $filename..." >&2
-      echo "Audio conversion $filename..." >> $STATUSFILE
-      sox $inputfile -e signed-integer -c 1 -r 16000 -b 16 $SCRATCHDIRECTORY/${file_id}.wav || fatalerror "Audio conversion failed"
-      target_dir=$SCRATCHDIRECTORY/${file_id}_$(date +"%y_%m_%d_%H_%m_%S")
-      mkdir -p $target_dir
-      echo "ASR Decoding $filename..." >&2
-      echo "ASR Decoding $filename..." >> $STATUSFILE
-      ./decode_PR.sh $SCRATCHDIRECTORY/${file_id}.wav $target_dir || fatalerror "ASR decoding failed"
-
-      cat $target_dir/${file_id}.txt | cut -d'(' -f 1 > $OUTPUTDIRECTORY/${file_id}.spraak.txt
-      cp $target_dir/1Best.ctm $OUTPUTDIRECTORY/${file_id}.ctm
-      cat $OUTPUTDIRECTORY/${file_id}.ctm | perl $S2SDIR/spreek2schrijf/webservice/wordpausestatistic.perl 1.0 $OUTPUTDIRECTORY/${file_id}.sent #currently computed but ignored!!!
-  fi
-  #python3 $S2SDIR/spreek2schrijf/webservice/ctm2xml.py $OUTPUTDIRECTORY $file_id $SCRATCHDIRECTORY
-  sed -e "s|path=|path=$S2SDIR/model/|g" $S2SDIR/model/moses.ini > $SCRATCHDIRECTORY/moses.ini
-  cat $SCRATCHDIRECTORY/moses.ini >&2
-  echo "MT Decoding $filename..." >&2
-  echo "MT Decoding $filename..." >> $STATUSFILE
-  $MOSES -f $SCRATCHDIRECTORY/moses.ini  < $OUTPUTDIRECTORY/${file_id}.spraak.txt > $OUTPUTDIRECTORY/${file_id}.mt-out.txt || fatalerror "MT Decoding failed"
-  python3 $S2SDIR/spreek2schrijf/webservice/postcorrect.py $OUTPUTDIRECTORY/${file_id}.mt-out.txt $S2SDIR/spreek2schrijf/webservice/namen.txt > $OUTPUTDIRECTORY/${file_id}.schrijf.txt || fatalerror "MT Postprocessing failed"
-  if [ "$extension" = "html" ]; then
-     python3 $S2SDIR/spreek2schrijf/webservice/writeflemishhtml.py $OUTPUTDIRECTORY/${file_id}.schrijf.txt $OUTPUTDIRECTORY/${file_id}.spraak.json > $OUTPUTDIRECTORY/${file_id}.html
-  fi
-  if [ ! -z "$target_dir" ] && [ -d "$target_dir" ]; then
-      rm -Rf $target_dir
-  fi
-done
-cd -
+#all processing stages run in-process in a single python interpreter, only ASR and MT run as external processes
+pipelineargs=""
+if [ ! -z "$S2S_TRANSLATION_CACHE" ]; then
+    #translate through the persistent translation cache, only cache misses are decoded
+    pipelineargs="$pipelineargs --cache $S2S_TRANSLATION_CACHE"
+    if [ ! -z "$S2S_TRANSLATION_CACHE_MAXENTRIES" ]; then
+        pipelineargs="$pipelineargs --cache-maxentries $S2S_TRANSLATION_CACHE_MAXENTRIES"
+    fi
+    if [ ! -z "$S2S_TRANSLATION_CACHE_MAXAGE" ]; then
+        pipelineargs="$pipelineargs --cache-maxage $S2S_TRANSLATION_CACHE_MAXAGE"
+    fi
+fi
+if [ ! -z "$S2S_DECODER_SOCKET" ] && [ -S "$S2S_DECODER_SOCKET" ]; then
+    #use the persistent decoder pool (s2s-decoderpool serve), which has the model loaded already
+    pipelineargs="$pipelineargs --socket $S2S_DECODER_SOCKET"
+fi
+if [ ! -z "$S2S_ASR_CACHE" ]; then
+    #reuse the ASR results of audio that has been decoded before (content-addressed, shared by all jobs)
+    pipelineargs="$pipelineargs --asr-cache $S2S_ASR_CACHE"
+    if [ ! -z "$S2S_ASR_CACHE_SIZE" ]; then
+        pipelineargs="$pipelineargs --asr-cache-size $S2S_ASR_CACHE_SIZE"
+    fi
+fi
+if [ ! -z "$S2S_ASR_CHUNK_LENGTH" ]; then
+    #decode long recordings in chunks (split at pauses), S2S_ASR_CHUNK_WORKERS chunks at a time
+    pipelineargs="$pipelineargs --chunk-length $S2S_ASR_CHUNK_LENGTH --chunk-workers ${S2S_ASR_CHUNK_WORKERS:-1}"
+fi
+#files are processed as a pipeline, the number of files simultaneously in ASR and MT can be raised if the machine allows
+if [ ! -z "$S2S_ASR_WORKERS" ]; then
+    pipelineargs="$pipelineargs --asr-workers $S2S_ASR_WORKERS"
+fi
+if [ ! -z "$S2S_MT_WORKERS" ]; then
+    pipelineargs="$pipelineargs --mt-workers $S2S_MT_WORKERS"
+fi
+python3 -m spreek2schrijf.webservice.pipeline $STATUSFILE $INPUTDIRECTORY $OUTPUTDIRECTORY $SCRATCHDIRECTORY --config $S2SDIR/model/moses.ini --moses $MOSES --kaldi-nl $KALDI_NL --names $S2SDIR/spreek2schrijf/webservice/namen.txt $pipelineargs || exit 2
 
 echo "Done." >> $STATUSFILE
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+#Persistent sentence-level translation cache (SQLite) in front of the MT decoder. Parliamentary speech contains many recurring
+#formulaic sentences, only the sentences that are not in the cache are sent to the decoder.
+
+import sys
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import argparse
+from spreek2schrijf.webservice.decoderpool import DecoderProcess, DecoderClient, DecoderError, prepareconfig
+
+
+def normalize(sentence):
+    """Normalizes a sentence for use as cache key (whitespace only, the decoder does not distinguish more than that)"""
+    return " ".join(sentence.split())
+
+def modelhash(inifile, modeldir=None):
+    """Computes a hash identifying the MT model: the Moses configuration plus the size and modification time of the model files it refers to"""
+    if modeldir is None:
+        modeldir = os.path.dirname(inifile)
+    h = hashlib.sha1()
+    with open(inifile,'rb') as f:
+        config = f.read()
+    h.update(config)
+    for path in re.findall(rb"path=(\S+)", config):
+        path = os.path.join(modeldir, path.decode('utf-8'))
+        if os.path.exists(path):
+            stat = os.stat(path)
+            h.update((path + ":" + str(stat.st_size) + ":" + str(stat.st_mtime_ns)).encode('utf-8'))
+    return h.hexdigest()
+
+
+class TranslationCache:
+    """Persistent translation cache keyed by the normalized source sentence and a model hash. Entries are evicted when they have
+    not been used for maxage seconds, or (least recently used first) when there are more than maxentries"""
+
+    def __init__(self, filename, model, maxentries=None, maxage=None):
+        self.model = model
+        self.maxentries = maxentries
+        self.maxage = maxage
+        self.hits = 0
+        self.misses = 0
+        #multiple CLAM jobs may use the cache concurrently
+        self.db = sqlite3.connect(filename, timeout=60)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS translations (model TEXT, source TEXT, target TEXT, accessed REAL, PRIMARY KEY (model, source))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS translations_accessed ON translations (accessed)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS statistics (model TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)")
+
+    def lookup(self, sentences):
+        """Returns a dictionary of the normalized sentences found in the cache and their translations"""
+        found = {}
+        keys = list({ normalize(sentence) for sentence in sentences })
+        for i in range(0, len(keys), 500): #stay below the SQLite variable limit
+            batch = keys[i:i+500]
+            for source, target in self.db.execute("SELECT source, target FROM translations WHERE model = ? AND source IN (" + ",".join("?" * len(batch)) + ")", [self.model] + batch):
+                found[source] = target
+        if found:
+            with self.db:
+                self.db.executemany("UPDATE translations SET accessed = ? WHERE model = ? AND source = ?", [ (time.time(), self.model, source) for source in found ])
+        return found
+
+    def store(self, sources, targets):
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO translations (model, source, target, accessed) VALUES (?, ?, ?, ?)", [ (self.model, normalize(source), target, now) for source, target in zip(sources, targets) ])
+        self.evict()
+
+    def evict(self):
+        with self.db:
+            if self.maxage:
+                self.db.execute("DELETE FROM translations WHERE accessed < ?", (time.time() - self.maxage,))
+            if self.maxentries:
+                self.db.execute("DELETE FROM translations WHERE rowid IN (SELECT rowid FROM translations ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.maxentries,))
+
+    def translate(self, sentences, decoder):
+        """Translates the sentences, only the cache misses are passed (once each, as a list) to the decoder function.
+        Results are returned in the original order"""
+        sentences = list(sentences)
+        found = self.lookup(sentences)
+        misses = []
+        for sentence in sentences:
+            key = normalize(sentence)
+            if key not in found:
+                misses.append(key)
+                found[key] = None #translate repeated sentences only once
+        if misses:
+            targets = decoder(misses)
+            if len(targets) != len(misses):
+                raise DecoderError("Decoder returned " + str(len(targets)) + " translations for " + str(len(misses)) + " sentences")
+            for source, target in zip(misses, targets):
+                found[source] = target
+            self.store(misses, [ found[source] for source in misses ])
+        self.hits += len(sentences) - len(misses)
+        self.misses += len(misses)
+        with self.db:
+            self.db.execute("INSERT OR IGNORE INTO statistics (model, hits, misses) VALUES (?, 0, 0)", (self.model,))
+            self.db.execute("UPDATE statistics SET hits = hits + ?, misses = misses + ? WHERE model = ?", (len(sentences) - len(misses), len(misses), self.model))
+        return [ found[normalize(sentence)] for sentence in sentences ]
+
+    def hitrate(self):
+        """Hit rate for this session"""
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def statistics(self):
+        """Returns a dictionary with the cache statistics, for this session and in total (for the current model)"""
+        totalhits, totalmisses = self.db.execute("SELECT hits, misses FROM statistics WHERE model = ?", (self.model,)).fetchone() or (0, 0)
+        entries = self.db.execute("SELECT COUNT(*) FROM translations WHERE model = ?", (self.model,)).fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitrate": self.hitrate(),
+            "totalhits": totalhits,
+            "totalmisses": totalmisses,
+            "totalhitrate": totalhits / (totalhits + totalmisses) if totalhits + totalmisses else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translates standard input (one sentence per line) through a persistent translation cache, only cache misses are passed to the decoder", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-c','--cache', type=str,help="Cache database file", action='store',required=True)
+    parser.add_argument('-f','--config', type=str,help="Moses configuration (moses.ini) of the model, identifies the model in the cache", action='store',required=True)
+    parser.add_argument('--modeldir', type=str,help="Model directory the paths in the configuration are relative to (defaults to the directory of the configuration)", action='store',default=None,required=False)
+    parser.add_argument('-s','--socket', type=str,help="Use the decoder pool (s2s-decoderpool) on this Unix socket rather than a decoder command", action='store',default="",required=False)
+    parser.add_argument('--moses', type=str,help="Path to the Moses executable (used if no decoder command or socket is given)", action='store',default="moses",required=False)
+    parser.add_argument('--maxentries', type=int,help="Maximum number of entries in the cache", action='store',default=1000000,required=False)
+    parser.add_argument('--maxage', type=float,help="Evict entries not used for this number of days", action='store',default=90,required=False)
+    parser.add_argument('command', nargs=argparse.REMAINDER, help="Decoder command (after --), reads one sentence per line from stdin and outputs one per line on stdout")
+    args = parser.parse_args()
+
+    modeldir = args.modeldir if args.modeldir else os.path.dirname(os.path.abspath(args.config))
+    cache = TranslationCache(args.cache, modelhash(args.config, modeldir), args.maxentries, args.maxage * 86400 if args.maxage else None)
+
+    def decoder(sentences):
+        if args.socket:
+            client = DecoderClient(args.socket)
+            try:
+                return client.translate(sentences)
+            finally:
+                client.close()
+        command = [ arg for arg in args.command if arg != '--' ]
+        config = None
+        if not command:
+            config = prepareconfig(args.config, os.path.abspath(modeldir), args.cache + "." + str(os.getpid()) + ".moses.ini")
+            command = [args.moses, "-f", config]
+        process = DecoderProcess(command)
+        try:
+            return process.translate(sentences)
+        finally:
+            process.stop()
+            if config:
+                os.unlink(config)
+
+    for translation in cache.translate(sys.stdin, decoder):
+        print(translation)
+    statistics = cache.statistics()
+    print("Translation cache: " + str(statistics['hits']) + " hits, " + str(statistics['misses']) + " misses, hit rate " + str(round(statistics['hitrate'] * 100,2)) + "% (overall " + str(round(statistics['totalhitrate'] * 100,2)) + "%, " + str(statistics['entries']) + " entries)",file=sys.stderr)
+    cache.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,72 @@
 #!/usr/bin/env python3
 
+#Run as s2s-writeflemishhtml (or python3 -m spreek2schrijf.webservice.writeflemishhtml), not by path: the CLAM
+#configuration (spreek2schrijf.py) in this directory would shadow the spreek2schrijf package
+
 import sys
-import json
+import argparse
+from spreek2schrijf.formats import iterjsonarray
+
+class SentenceBuffer:
+    """Random access to a stream of sentences by seqnr. The seqnr of the events increases monotonically, so only the
+    sentences from the last requested one onward have to be kept"""
+
+    def __init__(self, sentences):
+        self.sentences = iter(sentences)
+        self.buffer = []
+        self.offset = 0 #index of the first sentence in the buffer
+
+    def __getitem__(self, index):
+        if index < self.offset:
+            raise IndexError("Sentence " + str(index) + " is no longer available")
+        while index - self.offset >= len(self.buffer):
+            try:
+                self.buffer.append(next(self.sentences))
+            except StopIteration:
+                raise IndexError("Sentence " + str(index) + " out of range")
+        del self.buffer[:index - self.offset]
+        self.offset = index
+        return self.buffer[0]
 
-txtfile, jsonfile = sys.argv[1:]
+def writeflemishhtml(sentences, events, out=sys.stdout):
+    """Writes the translated sentences (indexed by the seqnr of the sentences in the events) as Flemish HTML. Both the
+    sentences and the events may be iterators (such as the lines of a file and iterjsonarray()), output is written one event
+    at a time"""
+    events = iter(events)
+    try:
+        event = next(events)
+    except StopIteration:
+        raise ValueError("No events")
+    if not isinstance(sentences, (list, tuple)):
+        sentences = SentenceBuffer(sentences)
+    srcfile = event['src']
+    out.write("<html>\n<head><title>{srcfile}</title></head>\n<body><h1>{srcfile}</h1><p>\n</p>\n".format(srcfile=srcfile))
 
-with open(txtfile, 'r', encoding='utf-8') as f:
-    sentences = list(f.readlines())
+    while event is not None:
+        html = ["<p><b><font color=\"#00C000\">" + event['speaker'] + "</font></b> {"+str(event['begintime'])+"-"+str(event['endtime'])+"}<br>\n"]
+        for sentence in event['sentences']:
+            tokens = sentences[sentence['seqnr']-1].split(' ')
+            for token in tokens:
+                html.append(token.strip() + "<wbr>\n")
+        html.append("</p>\n")
+        out.write("".join(html))
+        event = next(events, None)
+    out.write("</body>\n</html>\n")
 
-with open(jsonfile, 'r', encoding='utf-8') as f:
-    events = json.load(f)
+def main():
+    parser = argparse.ArgumentParser(description="Writes translated sentences as Flemish HTML, using the events parsed from the original HTML (see parseflemishhtml)", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-o','--output', type=str,help="Output file (defaults to standard output)", action='store',default="",required=False)
+    parser.add_argument('txtfile', type=str,help="Translated sentences (plain text, one per line)")
+    parser.add_argument('jsonfile', type=str,help="Events (JSON, as written by parseflemishhtml)")
+    args = parser.parse_args()
 
-srcfile = events[0]['src']
-print("<html>\n<head><title>{srcfile}</title></head>\n<body><h1>{srcfile}</h1><p>\n</p>".format(srcfile=srcfile))
+    with open(args.txtfile, 'r', encoding='utf-8') as sentences:
+        with open(args.jsonfile, 'r', encoding='utf-8') as f:
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as out:
+                    writeflemishhtml(sentences, iterjsonarray(f), out)
+            else:
+                writeflemishhtml(sentences, iterjsonarray(f))
 
-for event in events:
-    print("<p><b><font color=\"#00C000\">" + event['speaker'] + "</font></b> {"+str(event['begintime'])+"-"+str(event['endtime'])+"}<br>")
-    for sentence in event['sentences']:
-        tokens = sentences[sentence['seqnr']-1].split(' ')
-        for token in tokens:
-            print(token.strip() + "<wbr>")
-    print("</p>")
-print("</body>\n</html>")
+if __name__ == '__main__':
+    main()
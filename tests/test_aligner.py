@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+#Checks that the vectorised code paths of the aligner agree with the cell by cell reference implementation
+
+import random
+import numpy as np
+from spreek2schrijf.aligner import wordmatch, smith_waterman_distance, smith_waterman_prefix_distances
+from spreek2schrijf.vocabulary import Vocabulary, NeighbourIndex
+
+WORDS = ["de", "het", "een", "en", "van", "parlement", "parlementen", "minister", "ministers", "ministerie", "voorzitter",
+         "voorzitters", "begroting", "begrotingen", "vergadering", "vergaderingen", "regering", "regeringen", "vraag", "vragen"]
+
+def randomsequence(rng, length):
+    """Random words, including case variants and near misses (a character changed, dropped or added)"""
+    sequence = []
+    for _ in range(length):
+        word = rng.choice(WORDS)
+        variant = rng.random()
+        if variant < 0.15:
+            word = word.upper()
+        elif variant < 0.3:
+            word = word.capitalize()
+        elif variant < 0.45 and len(word) > 1:
+            i = rng.randrange(len(word))
+            word = word[:i] + rng.choice("aeiouxz") + word[i+1:]
+        elif variant < 0.55:
+            i = rng.randrange(len(word))
+            word = word[:i] + word[i+1:] or word
+        elif variant < 0.65:
+            i = rng.randrange(len(word)+1)
+            word = word[:i] + rng.choice("aeiouxz") + word[i:]
+        sequence.append(word)
+    return sequence
+
+def randompairs(seed, n=50):
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield randomsequence(rng, rng.randint(1, 25)), randomsequence(rng, rng.randint(1, 25))
+
+def test_engines_agree():
+    for seq1, seq2 in randompairs(1):
+        score_python, mat_python = smith_waterman_distance(seq1, seq2, engine="python")
+        score_numpy, mat_numpy = smith_waterman_distance(seq1, seq2, engine="numpy")
+        assert score_python == score_numpy
+        assert np.array_equal(mat_python, mat_numpy)
+
+def test_prefix_distances():
+    for seq1, seq2 in randompairs(2):
+        for engine in ("python", "numpy"):
+            expected = [ smith_waterman_distance(seq1, seq2[:end], engine="python")[0] for end in range(1, len(seq2)+1) ]
+            assert smith_waterman_prefix_distances(seq1, seq2, engine=engine) == expected
+
+def test_neighbourindex():
+    for ldthreshold in (1, 2, 3):
+        vocabulary = Vocabulary()
+        neighbours = NeighbourIndex(vocabulary, ldthreshold)
+        for seq1, seq2 in randompairs(3, 20):
+            for w1 in seq1:
+                for w2 in seq2:
+                    assert neighbours.wordmatch(w1, w2) == wordmatch(w1, w2, ldthreshold)
+            score, mat = smith_waterman_distance(seq1, seq2, ldthreshold=ldthreshold, engine="python")
+            score_index, mat_index = smith_waterman_distance(seq1, seq2, ldthreshold=ldthreshold, neighbours=neighbours)
+            assert score == score_index
+            assert np.array_equal(mat, mat_index)
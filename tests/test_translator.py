@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+#Checks that the warm translation backend recovers from a decoder that crashes, using a stub decoder
+
+import sys
+import pytest
+from spreek2schrijf.webservice.decoderpool import DecoderError
+from spreek2schrijf.webservice.pipeline import Translator
+from spreek2schrijf.webservice.batcher import WarmTranslator
+
+#uppercases every line, exits on the line "crash"
+STUBDECODER = """
+import sys
+while True:
+    line = sys.stdin.readline()
+    if not line or line.strip() == "crash":
+        break
+    sys.stdout.write(line.upper())
+    sys.stdout.flush()
+"""
+
+def stubtranslator(tmp_path):
+    return Translator(str(tmp_path / "moses.ini"), command=[sys.executable, "-c", STUBDECODER], scratchdir=str(tmp_path))
+
+def test_translator_recovers(tmp_path):
+    translator = stubtranslator(tmp_path)
+    try:
+        assert translator(["hallo"]) == ["HALLO"]
+        with pytest.raises(DecoderError):
+            translator(["crash"])
+        assert translator(["hallo", "daar"]) == ["HALLO", "DAAR"]
+        assert len(translator.processes) == 1
+    finally:
+        translator.close()
+
+def test_warmtranslator_recovers(tmp_path):
+    warm = WarmTranslator(stubtranslator(tmp_path), maxlength=0)
+    try:
+        assert warm("hallo\n") == "HALLO\n"
+        with pytest.raises(DecoderError):
+            warm("crash\n")
+        assert warm("hallo\ndaar\n") == "HALLO\nDAAR\n"
+    finally:
+        warm.close()